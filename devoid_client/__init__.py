@@ -1,3 +1,12 @@
 from .client import GeneratorClient
-from .messages import GenerationResponse, GenerationRequest
-from .queue import QueueIsFullError
\ No newline at end of file
+from .messages import GenerationResponse, GenerationRequest, RequestTemplate
+from .queue import QueueIsFullError, AdmissionTimeoutError
+from .pool import GatewayPool, ShardConnectionError
+from .tracker import RequestHandle
+from .attachments import ImageSource
+from .cache import ResultCache
+from .dispatch import HandlerDispatcher
+from .download import ResultDownloader, DownloadError
+from .scheduling import SchedulingPolicy, RoundRobinPolicy, DeficitRoundRobinPolicy, PremiumLanePolicy
+
+from .reconnect import ReconnectPolicy
\ No newline at end of file
@@ -0,0 +1,161 @@
+import os
+import base64
+
+from typing import BinaryIO, Dict, Iterator, List, Tuple, Union
+
+# Feature name exchanged in `features` handshake header
+BINARY_ATTACHMENTS = 'binary-attachments'
+
+# Payload fields which may hold raw images
+IMAGE_FIELDS = ('init_images', 'images_texts')
+
+# Read size of streamed images, multiple of 3 so chunks base64 encode independently
+CHUNK_SIZE = 3 * 64 * 1024
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+class ImageSource():
+    '''Image referenced by file path, open binary file or buffer (e.g. `mmap`).\n
+    Nothing is read until the request is sent, so a queued request only
+    holds the reference. Every send reads the image again from the start
+    offset, which allows resending the request.
+    '''
+    __slots__ = ('path', 'file', 'buffer', 'offset')
+    path: Union[str, None]
+    file: Union[BinaryIO, None]
+    buffer: Union[Buffer, None]
+    offset: int
+
+    def __init__(
+            self,
+            path: Union[str, os.PathLike] = None,
+            file: BinaryIO = None,
+            buffer: Buffer = None
+        ) -> None:
+        if (path is None) + (file is None) + (buffer is None) != 2:
+            raise ValueError('Exactly one of path, file or buffer is required')
+        self.path = None if path is None else os.fspath(path)
+        self.file = file
+        self.buffer = buffer
+        self.offset = 0 if file is None else file.tell()
+
+    @classmethod
+    def from_path(cls, path: Union[str, os.PathLike]):
+        return ImageSource(path=path)
+
+    @classmethod
+    def from_file(cls, file: BinaryIO):
+        '''`file` - binary file opened by caller, read from its current position'''
+        return ImageSource(file=file)
+
+    @classmethod
+    def from_buffer(cls, buffer: Buffer):
+        '''`buffer` - any bytes-like object, e.g. `mmap.mmap`'''
+        return ImageSource(buffer=buffer)
+
+    def size(self) -> int:
+        if self.buffer is not None:
+            return memoryview(self.buffer).nbytes
+        if self.path is not None:
+            return os.path.getsize(self.path)
+        return os.fstat(self.file.fileno()).st_size - self.offset
+
+    def chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[Buffer]:
+        if self.buffer is not None:
+            view = memoryview(self.buffer).cast('B')
+            for start in range(0, view.nbytes, chunk_size):
+                yield view[start:start + chunk_size]
+            return
+        if self.path is not None:
+            with open(self.path, 'rb') as file:
+                yield from iter(lambda: file.read(chunk_size), b'')
+            return
+        self.file.seek(self.offset)
+        yield from iter(lambda: self.file.read(chunk_size), b'')
+
+    def b64encode(self) -> str:
+        '''Base64 text of the image, encoded chunk by chunk'''
+        return ''.join(base64.b64encode(chunk).decode('ascii') for chunk in self.chunks())
+
+    def __repr__(self) -> str:
+        if self.path is not None:
+            return f"ImageSource(path={self.path!r})"
+        if self.file is not None:
+            return f"ImageSource(file={getattr(self.file, 'name', self.file)!r})"
+        return f"ImageSource(buffer={type(self.buffer).__name__})"
+
+Attachment = Union[memoryview, ImageSource]
+
+def is_buffer(value) -> bool:
+    return isinstance(value, (bytes, bytearray, memoryview))
+
+def is_image(value) -> bool:
+    '''True for raw image buffers and image references, False for base64 text and prompts'''
+    return isinstance(value, (bytes, bytearray, memoryview, ImageSource, os.PathLike))
+
+def attachment_size(attachment: Attachment) -> int:
+    if isinstance(attachment, ImageSource):
+        return attachment.size()
+    return attachment.nbytes
+
+def parse_features(header: Union[str, None]) -> set:
+    if not header:
+        return set()
+    return {feature.strip() for feature in header.split(',') if feature.strip()}
+
+def extract_attachments(
+        message: Dict,
+        binary: bool
+    ) -> Tuple[Dict, List[Attachment]]:
+    '''Replace raw image buffers and image references in `message` payload before encoding.\n
+    `binary` - True if peer accepts binary attachments: every image is
+    replaced with `{"attachment": index}` and returned to be sent as separate
+    binary frames right after the envelope, in order. Otherwise images are
+    base64 encoded in place, as generator expects without the feature.
+    `os.PathLike` values are treated as `ImageSource.from_path`.\n
+    Image lists are copied, the request payload itself is never modified.
+    '''
+    payload = message.get('payload')
+    if not payload:
+        return message, []
+    attachments = []
+    for field in IMAGE_FIELDS:
+        images = payload.get(field)
+        if not images or not any(is_image(image) for image in images):
+            continue
+        replaced = []
+        for image in images:
+            if not is_image(image):
+                replaced.append(image)
+                continue
+            if isinstance(image, os.PathLike):
+                image = ImageSource.from_path(image)
+            if binary:
+                replaced.append({"attachment": len(attachments)})
+                attachments.append(image if isinstance(image, ImageSource) else memoryview(image))
+            elif isinstance(image, ImageSource):
+                replaced.append(image.b64encode())
+            else:
+                replaced.append(base64.b64encode(image).decode('ascii'))
+        payload[field] = replaced
+    if attachments:
+        message['attachments'] = [{"size": attachment_size(attachment)} for attachment in attachments]
+    return message, attachments
+
+def resolve_attachments(
+        message: Dict,
+        attachments: List[bytes]
+    ) -> Dict:
+    '''Inverse of `extract_attachments`, used by the receiving side'''
+    payload = message.get('payload')
+    if not payload or not attachments:
+        return message
+    for field in IMAGE_FIELDS:
+        images = payload.get(field)
+        if not images:
+            continue
+        payload[field] = [
+            attachments[image['attachment']] if isinstance(image, dict) and 'attachment' in image else image
+            for image in images
+        ]
+    return message
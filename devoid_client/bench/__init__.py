@@ -0,0 +1,3 @@
+'''Benchmarks of devoid_client hot paths.\n
+Every module is runnable on its own, e.g. `python -m devoid_client.bench.codec`
+'''
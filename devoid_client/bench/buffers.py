@@ -0,0 +1,44 @@
+'''Memory of GenerationQueue user buffers under many distinct users.\n
+Every user submits one request which is then answered, so each buffer
+ends up empty and idle. Memory must stay flat once idle buffers start
+being evicted.\n
+`python -m devoid_client.bench.buffers [--users N] [--max-idle-buffers N]`
+'''
+import gc
+import time
+import asyncio
+import argparse
+import tracemalloc
+
+from ..queue import GenerationQueue
+from .fakes import NullGateway, response_for
+from .payloads import text2img_request
+
+async def run(users: int, max_idle_buffers: int, idle_ttl: float, report_every: int):
+    queue = GenerationQueue(NullGateway(), max_idle_buffers=max_idle_buffers, idle_ttl=idle_ttl)
+    print(f'{"users":>10} {"buffers":>10} {"traced MB":>10} {"elapsed s":>10}')
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    for i in range(1, users + 1):
+        user_id = f'user-{i}'
+        request = text2img_request(user_id)
+        await queue.put(user_id, request, 1)
+        await asyncio.sleep(0)
+        queue.on_response(response_for(request))
+        if i % report_every == 0:
+            traced = tracemalloc.get_traced_memory()[0] / 2 ** 20
+            print(f'{i:>10} {len(queue.users_bufs):>10} {traced:>10.1f} {time.perf_counter() - started:>10.1f}')
+    tracemalloc.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--max-idle-buffers', type=int, default=10000)
+    parser.add_argument('--idle-ttl', type=float, default=300.0)
+    parser.add_argument('--report-every', type=int, default=100_000)
+    args = parser.parse_args()
+    asyncio.run(run(args.users, args.max_idle_buffers, args.idle_ttl, args.report_every))
+
+if __name__ == '__main__':
+    main()
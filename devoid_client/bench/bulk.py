@@ -0,0 +1,76 @@
+'''Batch submission through a real websocket to the mock generator in a separate process.\n
+Compares `text2img` called in a loop with unbatched writes (one drain per
+request) against the same loop and `submit_many` with writes pipelined by
+the writer task. The generator only reads requests, so the time until the
+client has written and drained every frame is the client send path only.\n
+`python -m devoid_client.bench.bulk [--requests N] [--users N] [--repeat N]`
+'''
+import sys
+import time
+import asyncio
+import argparse
+
+from ..client import GeneratorClient
+from ..enums import *
+from .payloads import AUTOMATIC1111_PAYLOAD
+
+async def start_generator() -> asyncio.subprocess.Process:
+    '''`python -m devoid_client.bench.server` which does not answer, its endpoint is in `endpoint`'''
+    process = await asyncio.create_subprocess_exec(sys.executable, '-m', 'devoid_client.bench.server',
+                                                   '--port', '0', '--no-respond', stdout=asyncio.subprocess.PIPE)
+    line = (await process.stdout.readline()).decode()
+    process.endpoint = line.rsplit(' ', 1)[-1].strip()
+    return process
+
+async def run_once(endpoint: str, bulk: bool, batch: int, requests: int, users: int):
+    client = GeneratorClient(endpoint, 'test', 'token', send_batch=batch, user_max_in_flight=requests)
+    client.gateway.write_batch = batch
+    client.run(asyncio.get_running_loop())
+    while not client.gateway.connected:
+        await asyncio.sleep(0.01)
+    items = [dict(
+        gen_type=GenType.TEXT2IMG, executor=Executor.AUTOMATIC1111, premium=False, moderate=False,
+        sync_with_s3=False, user_id=f'user-{i % users}', chat_id=1, message_id=i,
+        payload=AUTOMATIC1111_PAYLOAD, max_user_queue_size=requests
+    ) for i in range(requests)]
+    started = time.perf_counter()
+    if bulk:
+        handles = await client.submit_many(items)
+    else:
+        handles = []
+        for item in items:
+            item = dict(item)
+            del item['gen_type']
+            handles.append(await client.text2img(**item))
+    submitted = time.perf_counter()
+    while client.gateway.outbound_metrics.written < requests:
+        await asyncio.sleep(0.001)
+    finished = time.perf_counter()
+    await client.close()
+    return submitted - started, finished - started
+
+async def run(requests: int, users: int, repeat: int):
+    print(f'{"mode":<26} {"requests":>9} {"submit ms":>10} {"written ms":>11} {"req/s":>10}')
+    generator = await start_generator()
+    try:
+        for name, bulk, batch in (('text2img loop, unbatched', False, 1),
+                                  ('text2img loop', False, 64),
+                                  ('submit_many', True, 64)):
+            # best of `repeat` runs, the machine is shared with the generator process
+            submit, total = min([await run_once(generator.endpoint, bulk, batch, requests, users)
+                                 for _ in range(repeat)], key=lambda times: times[1])
+            print(f'{name:<26} {requests:>9} {submit * 1000:>10.1f} {total * 1000:>11.1f} {requests / total:>10.0f}')
+    finally:
+        generator.terminate()
+        await generator.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(run(args.requests, args.users, args.repeat))
+
+if __name__ == '__main__':
+    main()
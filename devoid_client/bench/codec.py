@@ -0,0 +1,54 @@
+'''Compare json codecs on realistic request and response frames.\n
+`to frame` is `encode` plus turning its output into the payload of the
+frame the gateway writes.\n
+`python -m devoid_client.bench.codec [--image-size BYTES] [--repeat N]`
+'''
+import argparse
+
+from typing import Dict, List, Tuple
+
+from ..enums import GenStatus
+from ..codec import CODECS, available_codecs
+from .payloads import *
+from .stats import measure
+
+def make_cases(image_size: int) -> List[Tuple[str, Dict]]:
+    text2img = text2img_request()
+    return [
+        ('text2img request', text2img.as_dict()),
+        ('img2img request', img2img_request(image_size).as_dict()),
+        ('mix2img request', mix2img_request(image_size).as_dict()),
+        ('queued response', response_message(text2img, GenStatus.QUEUED)),
+        ('ok base64 response', response_message(text2img, GenStatus.OK, fake_image_b64(image_size)))
+    ]
+
+def run(image_size: int, repeat: int):
+    codecs = [codec() for codec in available_codecs().values()]
+    missing = sorted(set(CODECS) - {codec.name for codec in codecs})
+    if missing:
+        print(f'not installed: {", ".join(missing)}')
+    print(f'{"case":<20} {"codec":<8} {"size":>10} {"encode us":>12} {"to frame us":>12} {"decode us":>12}')
+    for case, message in make_cases(image_size):
+        for codec in codecs:
+            data = codec.encode(message)
+            encode = measure(lambda: codec.encode(message), repeat)
+            if codec.binary:
+                # the gateway writes bytes as they are, in text frames too
+                to_frame = encode
+            else:
+                # str is utf-8 encoded when its frame is written
+                to_frame = measure(lambda: codec.encode(message).encode(), repeat)
+            decode = measure(lambda: codec.decode(data), repeat)
+            print(f'{case:<20} {codec.name:<8} {len(data):>10} {encode * 1e6:>12.1f} '
+                  f'{to_frame * 1e6:>12.1f} {decode * 1e6:>12.1f}')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--image-size', type=int, default=384 * 1024,
+                        help='raw size of each embedded image in bytes')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run(args.image_size, args.repeat)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+'''Result downloads over a local HTTP server standing in for the result storage.\n
+Compares a new `requests.get` per result, as done by handlers without a
+downloader, against `ResultDownloader` with its pooled keep-alive session,
+and reports throughput and connections opened on the server.\n
+`python -m devoid_client.bench.download [--results N] [--size BYTES]`
+'''
+import time
+import asyncio
+import argparse
+import requests
+
+from ..download import ResultDownloader
+from .server import MockFileServer
+
+def naive(urls: list):
+    for url in urls:
+        requests.get(url, timeout=30).content
+
+async def pooled(urls: list, concurrency: int):
+    downloader = ResultDownloader(concurrency=concurrency)
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*(loop.run_in_executor(downloader.executor, downloader.download, url) for url in urls))
+    await downloader.close()
+
+async def run(results: int, size: int):
+    print(f'{"mode":<28} {"results":>8} {"ms":>9} {"results/s":>10} {"connections":>12}')
+    for name, concurrency in (('requests.get per result', None),
+                              ('ResultDownloader, 1', 1),
+                              ('ResultDownloader, 8', 8),
+                              ('ResultDownloader, 32', 32)):
+        with MockFileServer(size=size) as files:
+            urls = [f'{files.url}/{i}.png' for i in range(results)]
+            started = time.perf_counter()
+            if concurrency is None:
+                await asyncio.get_running_loop().run_in_executor(None, naive, urls)
+            else:
+                await pooled(urls, concurrency)
+            elapsed = time.perf_counter() - started
+            print(f'{name:<28} {results:>8} {elapsed * 1000:>9.1f} {results / elapsed:>10.0f} {files.connections:>12}')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--results', type=int, default=500)
+    parser.add_argument('--size', type=int, default=300_000)
+    args = parser.parse_args()
+    asyncio.run(run(args.results, args.size))
+
+if __name__ == '__main__':
+    main()
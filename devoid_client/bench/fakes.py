@@ -0,0 +1,86 @@
+import asyncio
+
+from collections import deque
+from typing import Dict, List
+
+from ..enums import *
+from ..messages import GenerationRequest, GenerationResponse
+from ..tracker import RequestTracker
+
+class NullGateway():
+    '''Always connected gateway which only counts sent messages.\n
+    Lets benchmarks drive `GenerationQueue` without network.
+    '''
+    req_done_handlers: List
+    req_error_handlers: List
+    req_queued_handlers: List
+    req_generating_handlers: List
+
+    def __init__(self, record: bool = False, send_yields: int = 0) -> None:
+        '''`record` - keep sent messages in `messages`\n
+        `send_yields` - times each send yields to the loop, like a socket drain.
+        Yielding sends hold `send_lock`, so concurrent senders take turns as on
+        a single socket. Unlike `GeneratorWebSocket`, sends are not queued for a
+        writer task and return only after yielding
+        '''
+        self.connected = True
+        self.sent = 0
+        self.record = record
+        self.send_yields = send_yields
+        self.send_lock = asyncio.Lock()
+        self.messages = deque()
+        self.req_done_handlers = []
+        self.req_error_handlers = []
+        self.req_queued_handlers = []
+        self.req_generating_handlers = []
+        self.con_error_handlers = []
+        self.connected_handlers = []
+        self.response_listeners = []
+        self.written_listeners = []
+        self.write_error_listeners = []
+        self.tracker = RequestTracker()
+        self.tracer = None
+
+    def shard_for(self, user_id: str):
+        return self
+
+    async def send_message(self, message: Dict):
+        if self.send_yields:
+            async with self.send_lock:
+                for _ in range(self.send_yields):
+                    await asyncio.sleep(0)
+        self.sent += 1
+        if self.record:
+            self.messages.append(message)
+
+    async def send_messages(self, messages: List[Dict]) -> List:
+        '''Pipelined send, yields `send_yields` times per batch'''
+        if self.send_yields:
+            async with self.send_lock:
+                for _ in range(self.send_yields):
+                    await asyncio.sleep(0)
+        self.sent += len(messages)
+        if self.record:
+            self.messages.extend(messages)
+        return [None] * len(messages)
+
+def response_for(
+        request: GenerationRequest,
+        gen_status: GenStatus = GenStatus.OK
+    ) -> GenerationResponse:
+    '''Smallest lazy response the queue accepts as an answer to `request`'''
+    return response_to_message(request.as_dict(), gen_status)
+
+def response_to_message(
+        message: Dict,
+        gen_status: GenStatus = GenStatus.OK
+    ) -> GenerationResponse:
+    service_info = message['service_info']
+    return GenerationResponse({
+        "object_id": service_info.get('request_id'),
+        "message_type": MessageType.RESPONSE.value,
+        "executor": message['executor'],
+        "gen_type": message['gen_type'],
+        "gen_status": gen_status.value,
+        "service_info": {"user_id": service_info['user_id'], "request_id": service_info.get('request_id')}
+    }, lazy=True)
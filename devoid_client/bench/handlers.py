@@ -0,0 +1,81 @@
+'''Event loop latency while slow handlers run, against the local mock generator.\n
+A ticker task measures how late the loop wakes it up while done responses
+are received and handled. A blocking handler run inline stalls the loop
+for its whole duration, the same handler in the thread pool or a CPU heavy
+one in the process pool leaves the receive loop latency flat.\n
+`python -m devoid_client.bench.handlers [--requests N] [--handler-ms MS]`
+'''
+import time
+import asyncio
+import hashlib
+import argparse
+
+from functools import partial
+
+from ..client import GeneratorClient
+from ..dispatch import HandlerDispatcher
+from ..enums import *
+from ..messages import GenerationResponse
+from .server import MockGenerator
+from .stats import LoopLagMonitor, percentile
+from .payloads import AUTOMATIC1111_PAYLOAD
+
+def blocking_handler(delay: float, response: GenerationResponse):
+    time.sleep(delay)
+
+async def blocking_inline_handler(delay: float, response: GenerationResponse):
+    time.sleep(delay)
+
+def cpu_handler(delay: float, response: GenerationResponse):
+    digest = response.object_id.encode()
+    deadline = time.perf_counter() + delay
+    while time.perf_counter() < deadline:
+        digest = hashlib.sha256(digest).digest()
+
+async def run_once(server: MockGenerator, handler, mode: str, requests: int):
+    dispatcher = HandlerDispatcher(workers=8, slow_after=float('inf'))
+    client = GeneratorClient(server.endpoint, 'test', 'token', handler_dispatcher=dispatcher, user_max_in_flight=requests)
+    client.register_req_done_handler(handler, mode=mode)
+    client.run(asyncio.get_running_loop())
+    while not client.gateway.connected:
+        await asyncio.sleep(0.01)
+    if mode == HandlerMode.PROCESS.value:
+        # start worker processes before measuring
+        await asyncio.get_running_loop().run_in_executor(dispatcher.executor(HandlerMode.PROCESS), time.sleep, 0)
+    monitor = LoopLagMonitor()
+    monitor.start()
+    items = [dict(
+        gen_type=GenType.TEXT2IMG, executor=Executor.AUTOMATIC1111, premium=False, moderate=False,
+        sync_with_s3=False, user_id=f'user-{i}', chat_id=1, message_id=i,
+        payload=AUTOMATIC1111_PAYLOAD, max_user_queue_size=1
+    ) for i in range(requests)]
+    started = time.perf_counter()
+    handles = await client.submit_many(items)
+    await asyncio.gather(*handles)
+    received = time.perf_counter()
+    await client.drain_handlers()
+    finished = time.perf_counter()
+    await monitor.stop()
+    await client.close()
+    return received - started, finished - started, monitor.lags
+
+async def run(requests: int, handler_ms: float):
+    delay = handler_ms / 1000
+    print(f'{"handler":<24} {"received ms":>12} {"handled ms":>11} {"lag p50 ms":>11} {"lag p99 ms":>11} {"lag max ms":>11}')
+    async with MockGenerator() as server:
+        for name, handler, mode in (('blocking, inline', partial(blocking_inline_handler, delay), 'inline'),
+                                    ('blocking, thread', partial(blocking_handler, delay), 'thread'),
+                                    ('cpu, process', partial(cpu_handler, delay), 'process')):
+            received, handled, lags = await run_once(server, handler, mode, requests)
+            print(f'{name:<24} {received * 1000:>12.1f} {handled * 1000:>11.1f} {percentile(lags, 0.5) * 1000:>11.2f} '
+                  f'{percentile(lags, 0.99) * 1000:>11.2f} {max(lags) * 1000:>11.2f}')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--handler-ms', type=float, default=20.0)
+    args = parser.parse_args()
+    asyncio.run(run(args.requests, args.handler_ms))
+
+if __name__ == '__main__':
+    main()
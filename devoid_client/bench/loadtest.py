@@ -0,0 +1,153 @@
+'''Load test of GeneratorClient against the local mock generator.\n
+Thousands of simulated users submit requests in a closed loop: every user
+waits for the result of its request, and an optional think time, before
+submitting the next one. The generator answers after configurable latency
+distributions and fails a share of requests. Throughput, end-to-end latency
+percentiles, event loop lag and memory are reported, so changes of the queue
+and gateway hot paths can be compared run to run with `--json`.\n
+Latencies are seconds or distributions: `exp:MEAN`, `uniform:LOW,HIGH`,
+`lognormal:MEDIAN,SIGMA`.\n
+`python -m devoid_client.bench [--users N] [--requests-per-user N] [--queue-time SPEC]
+[--generation-time SPEC] [--error-rate R] [--endpoint URL] [--json FILE] [--record FILE]`
+'''
+import json
+import time
+import asyncio
+import argparse
+import tracemalloc
+
+from collections import Counter
+from typing import Dict, List
+
+from ..client import GeneratorClient
+from ..enums import *
+from ..recording import TrafficRecorder
+from .server import Latency, MockGenerator
+from .stats import LoopLagMonitor, max_rss_mb, percentile
+from .payloads import AUTOMATIC1111_PAYLOAD
+
+async def simulate_user(
+        client: GeneratorClient,
+        user_id: str,
+        requests: int,
+        think_time: Latency,
+        latencies: List[float],
+        outcomes: Counter
+    ):
+    for message_id in range(requests):
+        started = time.perf_counter()
+        try:
+            handle = await client.text2img(Executor.AUTOMATIC1111, False, False, False, user_id, 1, message_id,
+                                           AUTOMATIC1111_PAYLOAD, max_user_queue_size=1)
+            response = await handle
+        except Exception as e:
+            outcomes[type(e).__name__] += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+        outcomes[response.gen_status.value] += 1
+        delay = think_time.sample()
+        if delay:
+            await asyncio.sleep(delay)
+
+async def load(args: argparse.Namespace, endpoint: str) -> Dict:
+    queue_options = {}
+    if args.max_in_flight is not None:
+        queue_options['max_in_flight'] = args.max_in_flight
+    recorder = None if args.record is None else TrafficRecorder(args.record)
+    client = GeneratorClient(endpoint, 'test', 'token', connections=args.connections, recorder=recorder, **queue_options)
+    client.run(asyncio.get_running_loop())
+    try:
+        while not client.gateway.connected:
+            await asyncio.sleep(0.01)
+        think_time = Latency.parse(args.think_time)
+        latencies = []
+        outcomes = Counter()
+        if args.tracemalloc:
+            tracemalloc.start()
+        async with LoopLagMonitor() as monitor:
+            started = time.perf_counter()
+            await asyncio.gather(*(simulate_user(client, f'user-{i}', args.requests_per_user, think_time, latencies, outcomes)
+                                   for i in range(args.users)))
+            elapsed = time.perf_counter() - started
+        traced_peak = tracemalloc.get_traced_memory()[1] / 2 ** 20 if args.tracemalloc else None
+        tracemalloc.stop()
+    finally:
+        await client.close()
+        if recorder is not None:
+            recorder.close()
+    lags = monitor.lags
+    return {
+        "users": args.users,
+        "requests": args.users * args.requests_per_user,
+        "outcomes": dict(outcomes),
+        "elapsed_s": elapsed,
+        "throughput_rps": len(latencies) / elapsed,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.5) * 1000,
+            "p99": percentile(latencies, 0.99) * 1000,
+            "max": max(latencies) * 1000
+        } if latencies else None,
+        "loop_lag_ms": {
+            "p50": percentile(lags, 0.5) * 1000,
+            "p99": percentile(lags, 0.99) * 1000,
+            "max": max(lags) * 1000
+        } if lags else None,
+        "max_rss_mb": max_rss_mb(),
+        "traced_peak_mb": traced_peak,
+        "client": client.metrics_snapshot()
+    }
+
+async def run(args: argparse.Namespace) -> Dict:
+    if args.endpoint is not None:
+        return await load(args, args.endpoint)
+    generator = MockGenerator(queue_time=args.queue_time, generation_time=args.generation_time,
+                              error_rate=args.error_rate, collect=False, seed=args.seed)
+    async with generator:
+        report = await load(args, generator.endpoint)
+    report["generator"] = {
+        "queue_time": str(generator.queue_time),
+        "generation_time": str(generator.generation_time),
+        "error_rate": generator.error_rate
+    }
+    return report
+
+def print_report(report: Dict):
+    latency, lag = report["latency_ms"] or {}, report["loop_lag_ms"] or {}
+    outcomes = ', '.join(f'{outcome} {count}' for outcome, count in sorted(report["outcomes"].items()))
+    print(f'{"users":<20} {report["users"]}')
+    print(f'{"requests":<20} {report["requests"]} ({outcomes})')
+    print(f'{"elapsed":<20} {report["elapsed_s"]:.2f} s')
+    print(f'{"throughput":<20} {report["throughput_rps"]:.0f} req/s')
+    for name, values in (('latency', latency), ('loop lag', lag)):
+        if values:
+            print(f'{name:<20} p50 {values["p50"]:.2f} ms, p99 {values["p99"]:.2f} ms, max {values["max"]:.2f} ms')
+    if report["max_rss_mb"] is not None:
+        print(f'{"max rss":<20} {report["max_rss_mb"]:.1f} MB')
+    if report["traced_peak_mb"] is not None:
+        print(f'{"traced peak":<20} {report["traced_peak_mb"]:.1f} MB')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--requests-per-user', type=int, default=5)
+    parser.add_argument('--queue-time', default='exp:0.05')
+    parser.add_argument('--generation-time', default='lognormal:0.2,0.5')
+    parser.add_argument('--think-time', default='0')
+    parser.add_argument('--error-rate', type=float, default=0.01)
+    parser.add_argument('--connections', type=int, default=1)
+    parser.add_argument('--max-in-flight', type=int)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--endpoint', help='running generator or `python -m devoid_client.bench.server`, '
+                                           'the local mock generator is started otherwise')
+    parser.add_argument('--tracemalloc', action='store_true', help='also trace peak python memory, slows the run')
+    parser.add_argument('--json', help='write the full report with client metrics to this file')
+    parser.add_argument('--record', help='capture websocket traffic for `devoid_client.bench.replay`')
+    args = parser.parse_args()
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json is not None:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
+
+if __name__ == '__main__':
+    main()
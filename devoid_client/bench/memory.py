@@ -0,0 +1,49 @@
+'''Memory held by buffered generation requests.\n
+`python -m devoid_client.bench.memory [--requests N] [--image-size BYTES]`
+'''
+import gc
+import sys
+import argparse
+import tracemalloc
+
+from collections import deque
+
+from ..attachments import ImageSource
+from .payloads import *
+
+def measure(build, count: int) -> float:
+    '''Bytes allocated per object kept alive, as reported by tracemalloc'''
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    buffered = deque(build(str(i % 1000)) for i in range(count))
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(buffered) == count
+    return (after - before) / count
+
+def run(count: int, image_size: int):
+    print(f'{"request":<18} {"count":>8} {"bytes/request":>14}')
+    print(f'{"text2img":<18} {count:>8} {measure(text2img_request, count):>14.0f}')
+    if image_size:
+        # every request shares the same image string, so only the model overhead is counted here
+        image = fake_image_b64(image_size)
+        build = lambda user_id: img2img_request(0, user_id, image)
+        shared = measure(build, count)
+        print(f'{"img2img":<18} {count:>8} {shared:>14.0f}')
+        # what each queued request holds when callers encode the image per request
+        print(f'{"img2img + base64":<18} {count:>8} {shared + sys.getsizeof(image):>14.0f}')
+        build = lambda user_id: img2img_request(0, user_id, ImageSource.from_path(__file__))
+        print(f'{"img2img by path":<18} {count:>8} {measure(build, count):>14.0f}')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=100_000)
+    parser.add_argument('--image-size', type=int, default=0,
+                        help='also measure img2img requests referencing one shared image')
+    args = parser.parse_args()
+    run(args.requests, args.image_size)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import os
+import base64
+
+from typing import Dict
+from uuid import uuid4
+
+from ..enums import *
+from ..messages import GenerationRequest
+from ..messages.components import ServiceInfo
+
+AUTOMATIC1111_PAYLOAD = {
+    "prompt": "a lighthouse on a cliff at sunset, highly detailed, 8k",
+    "steps": 30,
+    "cfg_scale": 7,
+    "sampler_index": "Euler a",
+    "width": 512,
+    "height": 768,
+    "seed": 1111111111,
+    "hr_scale": 1,
+    "hr_upscaler": "Latent",
+    "hr_second_pass_steps": 0,
+    "hr_resize_x": 768,
+    "hr_resize_y": 1024,
+    "denoising_strength": 0.7,
+    "negative_prompt": "child, childish"
+}
+
+KANDINSKY_PAYLOAD = {
+    "prompt": "cat girl",
+    "steps": 30,
+    "guidance_scale": 4,
+    "height": 512,
+    "width": 512,
+    "sampler": "p_sampler",
+    "prior_cf_scale": 4,
+    "prior_steps": "5",
+    "negative_prior_prompt": "",
+    "negative_decoder_prompt": ""
+}
+
+def fake_image_b64(size: int) -> str:
+    '''Base64 text of `size` random bytes, stands in for an encoded PNG'''
+    return base64.b64encode(os.urandom(size)).decode('ascii')
+
+def make_service_info(user_id: str) -> ServiceInfo:
+    return ServiceInfo(user_id=user_id, chat_id=1, message_id=1, request_id=uuid4().hex)
+
+def text2img_request(user_id: str = '1') -> GenerationRequest:
+    return GenerationRequest(GenType.TEXT2IMG, Executor.AUTOMATIC1111, False, False, True,
+                             make_service_info(user_id), AUTOMATIC1111_PAYLOAD)
+
+def img2img_request(image_size: int, user_id: str = '1', image = None) -> GenerationRequest:
+    if image is None:
+        image = fake_image_b64(image_size)
+    payload = dict(AUTOMATIC1111_PAYLOAD, init_images=[image])
+    return GenerationRequest(GenType.IMG2IMG, Executor.AUTOMATIC1111, False, False, True,
+                             make_service_info(user_id), payload)
+
+def mix2img_request(image_size: int, user_id: str = '1') -> GenerationRequest:
+    payload = dict(KANDINSKY_PAYLOAD, images_texts=['first prompt', fake_image_b64(image_size),
+                   fake_image_b64(image_size), 'second prompt'], weights=[0.25, 0.25, 0.25, 0.25])
+    return GenerationRequest(GenType.MIX2IMG, Executor.KANDINSKY, False, False, True,
+                             make_service_info(user_id), payload)
+
+def response_message(
+        request: GenerationRequest,
+        gen_status: GenStatus,
+        content: str = None,
+        object_id: str = None
+    ) -> Dict:
+    '''Generator response to `request` as it comes from the wire'''
+    message = request.as_dict()
+    message.update({
+        "object_id": object_id or uuid4().hex,
+        "message_type": MessageType.RESPONSE.value,
+        "gen_status": gen_status.value,
+        "avg_time": 12.5,
+        "result": None
+    })
+    if content is not None:
+        content_type = ContentType.BASE64 if gen_status == GenStatus.OK else ContentType.TEXT
+        message["result"] = {
+            "content_type": content_type.value,
+            "content": content,
+            "file_name": f'{message["object_id"]}.png'
+        }
+    return message
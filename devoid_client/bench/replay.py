@@ -0,0 +1,87 @@
+'''Replay a traffic capture through the receive path of a disconnected GeneratorWebSocket.\n
+Inbound frames of a capture written by `TrafficRecorder` are decoded, turned
+into responses and dispatched to no-op handlers of every status, the same
+way `receiver_loop` handles them. Reports frames and megabytes per second
+with per-stage timings, `--profile` writes cProfile stats of the replay.\n
+Without production traffic `--synthesize N` first writes a capture of N
+requests answered in status bursts with base64 results of `--result-size`.\n
+`python -m devoid_client.bench.replay CAPTURE [--speed X] [--codec NAME] [--eager] [--profile FILE]
+[--synthesize N] [--result-size BYTES]`
+'''
+import json
+import time
+import asyncio
+import argparse
+import cProfile
+
+from ..enums import *
+from ..gateway import GeneratorWebSocket
+from ..messages import GenerationResponse
+from ..recording import TrafficRecorder, INBOUND, OUTBOUND, replay
+from ..tracing import StageTimer
+from .payloads import fake_image_b64, response_message, text2img_request
+
+def synthesize(path: str, requests: int, result_size: int, burst: int = 100):
+    '''Capture of `requests` sent in bursts of `burst`, each burst answered
+    with all QUEUED, then all GENERATING, then all OK responses
+    '''
+    content = fake_image_b64(result_size)
+    with TrafficRecorder(path) as recorder:
+        for start in range(0, requests, burst):
+            batch = [text2img_request(f'user-{i}') for i in range(start, min(start + burst, requests))]
+            object_ids = {request.request_id: f'{request.request_id}-object' for request in batch}
+            for request in batch:
+                recorder.record(OUTBOUND, json.dumps(request.as_dict()))
+            for gen_status in (GenStatus.QUEUED, GenStatus.GENERATING, GenStatus.OK):
+                for request in batch:
+                    message = response_message(request, gen_status, content if gen_status == GenStatus.OK else None,
+                                               object_ids[request.request_id])
+                    recorder.record(INBOUND, json.dumps(message))
+
+async def noop_handler(response: GenerationResponse):
+    pass
+
+async def run(args: argparse.Namespace):
+    timer = StageTimer(stall_after=float('inf'))
+    gateway = GeneratorWebSocket('ws://replay', Service.TEST, 'token', codec=args.codec,
+                                 lazy_responses=not args.eager, tracer=None if args.profile else timer)
+    for handlers in (gateway.req_queued_handlers, gateway.req_generating_handlers,
+                     gateway.req_done_handlers, gateway.req_error_handlers):
+        handlers.append(noop_handler)
+    profiler = cProfile.Profile() if args.profile else None
+    started = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    frames = await replay(gateway, args.capture, args.speed)
+    await gateway.handler_dispatcher.drain()
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+    elapsed = time.perf_counter() - started
+    print(f'{frames.frames} inbound frames, {frames.bytes / 2 ** 20:.1f} MB, {frames.skipped} outbound skipped')
+    print(f'{elapsed:.3f} s, {frames.frames / elapsed:.0f} frames/s, {frames.bytes / 2 ** 20 / elapsed:.1f} MB/s')
+    if profiler is not None:
+        print(f'profile written to {args.profile}')
+        return
+    print(f'{"stage":<20} {"count":>8} {"avg us":>10} {"p50 us":>10} {"p99 us":>10}')
+    for stage, histogram in timer.histograms.items():
+        stats = histogram.as_dict()
+        print(f'{stage:<20} {stats["count"]:>8} {stats["avg"] * 1e6:>10.1f} '
+              f'{stats["p50"] * 1e6:>10.1f} {stats["p99"] * 1e6:>10.1f}')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('capture', help='capture file, `.gz` captures are compressed')
+    parser.add_argument('--speed', type=float, help='1 replays at recorded speed, as fast as possible by default')
+    parser.add_argument('--codec', help='json codec, fastest installed one by default')
+    parser.add_argument('--eager', action='store_true', help='decode responses eagerly instead of lazily')
+    parser.add_argument('--profile', help='write cProfile stats to this file instead of stage timings')
+    parser.add_argument('--synthesize', type=int, metavar='N', help='write a synthetic capture of N requests first')
+    parser.add_argument('--result-size', type=int, default=384 * 1024, help='raw size of synthetic base64 results')
+    args = parser.parse_args()
+    if args.synthesize:
+        synthesize(args.capture, args.synthesize, args.result_size)
+    asyncio.run(run(args))
+
+if __name__ == '__main__':
+    main()
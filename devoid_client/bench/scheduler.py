@@ -0,0 +1,122 @@
+'''Submit and complete throughput of GenerationQueue with many concurrent users.\n
+Compares the dispatcher based queue with the previous design, where every
+user buffer held an `asyncio.Lock` while awaiting the send.\n
+`python -m devoid_client.bench.scheduler [--users N] [--requests-per-user N] [--send-yields N]`
+'''
+import time
+import asyncio
+import logging
+import argparse
+
+from asyncio import Lock
+from collections import deque
+from typing import Dict
+
+from ..queue import GenerationQueue, QueueIsFullError
+from .fakes import NullGateway, response_to_message
+from .payloads import text2img_request
+
+class LockingUserRequestBuffer:
+    '''Previous per-user buffer: lock held while awaiting `send_message`'''
+    def __init__(self, id: str, max_size: int, gateway) -> None:
+        self.id = id
+        self.cur_size = 0
+        self.max_size = max_size
+        self.queue = deque()
+        self.lock = Lock()
+        self.generating = False
+        self.gateway = gateway
+
+    async def add_request(self, request):
+        async with self.lock:
+            if self.cur_size >= self.max_size:
+                raise QueueIsFullError("Cannot add new request, because user's queue is full")
+            logging.debug(f'Adding new request of user `{self.id}`')
+            self.queue.append(request)
+            self.cur_size += 1
+            if self.generating == False:
+                logging.debug(f'Starting generating for user `{self.id}`')
+                request = self.queue.popleft()
+                self.generating = True
+                await self.gateway.send_message(request.as_dict())
+
+    async def on_response(self, response):
+        async with self.lock:
+            self.cur_size -= 1
+            if self.cur_size < 1:
+                self.generating = False
+                logging.debug(f'ReqBuffer for user `{self.id}` is empty, not sending request')
+                return
+            request = self.queue.popleft()
+            logging.debug(f'Sending another request for user `{self.id}`')
+            await self.gateway.send_message(request.as_dict())
+
+class LockingGenerationQueue:
+    '''Previous `GenerationQueue` with per-user locks'''
+    users_bufs: Dict[str, LockingUserRequestBuffer]
+
+    def __init__(self, gateway) -> None:
+        self.users_bufs = dict()
+        self.gateway = gateway
+
+    async def put(self, user_id: str, request, max_user_queue_size: int):
+        user_buf = self.users_bufs.get(user_id)
+        if user_buf is None:
+            user_buf = LockingUserRequestBuffer(user_id, max_user_queue_size, self.gateway)
+            self.users_bufs[user_id] = user_buf
+        user_buf.max_size = max_user_queue_size
+        await user_buf.add_request(request)
+
+    async def req_done_handler(self, response):
+        user_buf = self.users_bufs.get(response.user_id)
+        if user_buf is not None:
+            await user_buf.on_response(response)
+
+async def run_once(queue_factory, users: int, per_user: int, send_yields: int):
+    gateway = NullGateway(record=True, send_yields=send_yields)
+    queue = queue_factory(gateway)
+    total = users * per_user
+    requests = [[text2img_request(f'user-{user}') for _ in range(per_user)] for user in range(users)]
+
+    async def submit(user: int):
+        for request in requests[user]:
+            await queue.put(f'user-{user}', request, per_user)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(submit(user) for user in range(users)))
+    while gateway.sent < users:
+        await asyncio.sleep(0)
+    submitted = time.perf_counter()
+
+    completed = 0
+    while completed < total:
+        if not gateway.messages:
+            await asyncio.sleep(0)
+            continue
+        response = response_to_message(gateway.messages.popleft())
+        if isinstance(queue, GenerationQueue):
+            # the gateway calls response listeners synchronously
+            queue.response_listener(response)
+        else:
+            await queue.req_done_handler(response)
+        completed += 1
+    finished = time.perf_counter()
+    return total / (submitted - started), total / (finished - submitted)
+
+async def run(users: int, per_user: int, send_yields: int):
+    print(f'{"queue":<12} {"users":>8} {"requests":>9} {"submit/s":>12} {"complete/s":>12}')
+    for name, factory in (('locking', LockingGenerationQueue), ('dispatcher', GenerationQueue)):
+        submit_rate, complete_rate = await run_once(factory, users, per_user, send_yields)
+        print(f'{name:<12} {users:>8} {users * per_user:>9} {submit_rate:>12.0f} {complete_rate:>12.0f}')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--requests-per-user', type=int, default=3)
+    parser.add_argument('--send-yields', type=int, default=1,
+                        help='times every send yields to the event loop, emulates socket drain')
+    args = parser.parse_args()
+    asyncio.run(run(args.users, args.requests_per_user, args.send_yields))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+import json
+import math
+import random
+import asyncio
+import argparse
+import threading
+
+from typing import Dict, Iterable, List, Set, Union
+from uuid import uuid4
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from websockets.server import serve
+from websockets.exceptions import ConnectionClosed
+from websockets.protocol import State
+
+from ..enums import *
+from ..attachments import BINARY_ATTACHMENTS, resolve_attachments
+
+class Latency():
+    '''Random delay in seconds drawn from a `kind` distribution with `params`:
+    `constant` (seconds), `uniform` (low, high), `exp` (mean) or
+    `lognormal` (median, sigma)
+    '''
+    KINDS = {'constant': 1, 'uniform': 2, 'exp': 1, 'lognormal': 2}
+
+    def __init__(self, kind: str, *params: float, rng: random.Random = None) -> None:
+        if self.KINDS.get(kind) != len(params):
+            raise ValueError(f'Unknown latency `{kind}` with {len(params)} params, expected one of {self.KINDS}')
+        self.kind = kind
+        self.params = params
+        self.rng = rng or random.Random()
+
+    @classmethod
+    def parse(cls, spec: Union[str, float, 'Latency'], rng: random.Random = None) -> 'Latency':
+        '''Latency from `0.5`, `exp:0.5`, `uniform:0.1,0.9` or `lognormal:0.5,0.8` spec'''
+        if isinstance(spec, Latency):
+            return spec
+        if isinstance(spec, (int, float)):
+            return cls('constant', float(spec), rng=rng)
+        kind, _, params = spec.partition(':')
+        if not params:
+            return cls('constant', float(kind), rng=rng)
+        return cls(kind, *(float(param) for param in params.split(',')), rng=rng)
+
+    @property
+    def mean(self) -> float:
+        if self.kind == 'uniform':
+            return sum(self.params) / 2
+        if self.kind == 'lognormal':
+            median, sigma = self.params
+            return median * math.exp(sigma ** 2 / 2)
+        return self.params[0]
+
+    def sample(self) -> float:
+        if self.kind == 'constant':
+            return self.params[0]
+        if self.kind == 'uniform':
+            return self.rng.uniform(*self.params)
+        if self.kind == 'exp':
+            return self.rng.expovariate(1 / self.params[0]) if self.params[0] > 0 else 0.0
+        median, sigma = self.params
+        return self.rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+
+    def __str__(self) -> str:
+        return f'{self.kind}:{",".join(str(param) for param in self.params)}'
+
+class MockGenerator():
+    '''Local stand-in for Devoid Generator websocket endpoint.\n
+    Answers every request with QUEUED, GENERATING and OK responses
+    echoing request `service_info`. Requests with binary attachments
+    resolved to `bytes` are collected in `received`.\n
+    `features` - features advertised in `features` handshake header\n
+    `queue_time`, `generation_time` - seconds between status responses,
+    fixed or a `Latency` distribution\n
+    `error_rate` - share of requests answered with ERROR instead of OK\n
+    `respond` - answer requests, otherwise they are only collected\n
+    `result_url` - base url of `IMAGE_URL` results, e.g. `MockFileServer.url`\n
+    `collect` - keep received requests in `received`, off for long load tests\n
+    `max_size` - max bytes of a received frame, larger ones close the
+    connection with code 1009, unlimited if None\n
+    `seed` - seed of latencies and errors
+    '''
+    received: List[Dict]
+
+    def __init__(
+            self,
+            host: str = '127.0.0.1',
+            port: int = 0,
+            features: Iterable[str] = (BINARY_ATTACHMENTS,),
+            queue_time: Union[float, Latency] = 0.0,
+            generation_time: Union[float, Latency] = 0.0,
+            respond: bool = True,
+            result_url: str = None,
+            error_rate: float = 0.0,
+            collect: bool = True,
+            max_size: int = None,
+            seed: int = None
+        ) -> None:
+        self.host = host
+        self.port = port
+        self.features = list(features)
+        self.rng = random.Random(seed)
+        self.queue_time = Latency.parse(queue_time, self.rng)
+        self.generation_time = Latency.parse(generation_time, self.rng)
+        self.error_rate = error_rate
+        self.respond_requests = respond
+        self.result_url = result_url or f'http://{host}'
+        self.collect = collect
+        self.max_size = max_size
+        self.received = []
+        self.answered = 0
+        self.errors = 0
+        self.server = None
+        self.tasks: Set[asyncio.Task] = set()
+
+    @property
+    def endpoint(self) -> str:
+        return f'ws://{self.host}:{self.port}'
+
+    async def start(self):
+        headers = {'features': ', '.join(self.features)} if self.features else {}
+        self.server = await serve(self.handler, self.host, self.port, extra_headers=headers,
+                                  max_size=self.max_size)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        for task in list(self.tasks):
+            task.cancel()
+        for websocket in list(self.server.websockets):
+            if websocket.state is State.CLOSING:
+                # e.g. failed with 1009 while the client was writing, the closing handshake would wait `close_timeout`
+                websocket.transport.abort()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def handler(self, websocket, path: str = None):
+        try:
+            await self.receive(websocket)
+        except ConnectionClosed:
+            pass
+
+    async def receive(self, websocket):
+        envelope = None
+        attachments = []
+        async for frame in websocket:
+            if envelope is not None:
+                attachments.append(bytes(frame))
+                if len(attachments) < len(envelope['attachments']):
+                    continue
+                message = resolve_attachments(envelope, attachments)
+                envelope, attachments = None, []
+            else:
+                message = json.loads(frame)
+                if message.get('attachments'):
+                    envelope = message
+                    continue
+            if self.collect:
+                self.received.append(message)
+            if not self.respond_requests:
+                continue
+            task = asyncio.get_running_loop().create_task(self.respond(websocket, message))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def respond(self, websocket, request: Dict):
+        object_id = uuid4().hex
+        try:
+            await websocket.send(self.response(request, object_id, GenStatus.QUEUED))
+            await asyncio.sleep(self.queue_time.sample())
+            await websocket.send(self.response(request, object_id, GenStatus.GENERATING))
+            await asyncio.sleep(self.generation_time.sample())
+            failed = self.error_rate and self.rng.random() < self.error_rate
+            await websocket.send(self.response(request, object_id, GenStatus.ERROR if failed else GenStatus.OK))
+            self.answered += 1
+            self.errors += bool(failed)
+        except ConnectionClosed:
+            # client is gone, like the real generator the result is lost
+            pass
+
+    def response(
+            self,
+            request: Dict,
+            object_id: str,
+            gen_status: GenStatus
+        ) -> str:
+        result = None
+        if gen_status == GenStatus.OK:
+            result = {
+                "content_type": ContentType.IMAGE_URL.value,
+                "content": f'{self.result_url}/{object_id}.png',
+                "file_name": f'{object_id}.png'
+            }
+        elif gen_status == GenStatus.ERROR:
+            result = {
+                "content_type": ContentType.TEXT.value,
+                "content": 'Mock generation error',
+                "file_name": None
+            }
+        return json.dumps({
+            "object_id": object_id,
+            "message_type": MessageType.RESPONSE.value,
+            "executor": request.get('executor'),
+            "gen_type": request.get('gen_type'),
+            "gen_status": gen_status.value,
+            "avg_time": self.queue_time.mean + self.generation_time.mean,
+            "result": result,
+            "settings": request.get('settings'),
+            "service_info": request.get('service_info')
+        })
+
+class MockFileServer():
+    '''Local keep-alive HTTP server standing in for the result storage.\n
+    Answers every GET with `size` bytes derived from the path, the first
+    `fail_first` requests of every path are answered with HTTP 503.
+    Runs on its own thread, `requests` counts requests by path and
+    `connections` accepted connections.
+    '''
+    requests: Counter
+
+    def __init__(
+            self,
+            host: str = '127.0.0.1',
+            port: int = 0,
+            size: int = 300_000,
+            fail_first: int = 0
+        ) -> None:
+        self.size = size
+        self.fail_first = fail_first
+        self.requests = Counter()
+        self.connections = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        self.server.daemon_threads = True
+        # clients dropping connections are not errors here
+        self.server.handle_error = lambda request, client_address: None
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def content(self, path: str) -> bytes:
+        pattern = path.encode() or b'/'
+        return (pattern * (self.size // len(pattern) + 1))[:self.size]
+
+    def handler_class(self):
+        files = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # headers and body are written separately, without TCP_NODELAY
+            # a kept-alive connection stalls on Nagle and delayed acks
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with files.lock:
+                    files.connections += 1
+
+            def do_GET(self):
+                with files.lock:
+                    files.requests[self.path] += 1
+                    failed = files.requests[self.path] <= files.fail_first
+                body = b'unavailable' if failed else files.content(self.path)
+                self.send_response(503 if failed else 200)
+                self.send_header('Content-Type', 'image/png')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+async def serve_forever(generator: MockGenerator):
+    async with generator:
+        print(f'Mock generator listening on {generator.endpoint}', flush=True)
+        await asyncio.Future()
+
+def main():
+    parser = argparse.ArgumentParser(description='Local mock of the generator websocket endpoint')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--queue-time', default='0', help='seconds or distribution, e.g. exp:0.5')
+    parser.add_argument('--generation-time', default='0', help='seconds or distribution, e.g. lognormal:2,0.5')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--no-respond', action='store_true', help='only read requests, e.g. for send path benchmarks')
+    args = parser.parse_args()
+    generator = MockGenerator(args.host, args.port, queue_time=args.queue_time, generation_time=args.generation_time,
+                              respond=not args.no_respond, error_rate=args.error_rate, collect=False, seed=args.seed)
+    try:
+        asyncio.run(serve_forever(generator))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
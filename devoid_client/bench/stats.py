@@ -0,0 +1,64 @@
+import sys
+import timeit
+import asyncio
+
+from typing import List, Union
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def percentile(values: List[float], q: float) -> Union[float, None]:
+    '''Exact `q` quantile of `values`, None if there are none'''
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+def measure(func, repeat: int) -> float:
+    '''Best time of single `func` call in seconds'''
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+def max_rss_mb() -> Union[float, None]:
+    '''Peak resident memory of this process, None where it is not available'''
+    if resource is None:
+        return None
+    # bytes on macOS, kilobytes elsewhere
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 2 ** 20
+
+class LoopLagMonitor():
+    '''Measures how late the event loop wakes up a task sleeping for `tick` seconds'''
+    lags: List[float]
+
+    def __init__(self, tick: float = 0.001) -> None:
+        self.tick = tick
+        self.lags = []
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.tick
+            await asyncio.sleep(self.tick)
+            self.lags.append(loop.time() - expected)
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
@@ -0,0 +1,94 @@
+'''Per-submit CPU cost of requests built from payload dicts against `RequestTemplate`.\n
+Build times the request construction with payload validation, build +
+as_dict adds serialization to the message dict and + encode the json
+encoding done by the gateway. Submit times `text2img` against
+`submit_template` through the tracker, queue and the gateway encoding
+of every request; the gateway is marked connected but its outbound
+queue is replaced, so nothing is written to a socket. Only `prompt` and
+`seed` change between requests.\n
+`python -m devoid_client.bench.templates [--requests N] [--repeat N]`
+'''
+import gc
+import time
+import asyncio
+import argparse
+
+from ..client import GeneratorClient
+from ..codec import get_codec
+from ..enums import *
+from ..messages import GenerationRequest, RequestTemplate
+from .payloads import AUTOMATIC1111_PAYLOAD, KANDINSKY_PAYLOAD, make_service_info
+from .stats import measure
+
+def stage_cases(executor: Executor, base_payload: dict, codec):
+    template = RequestTemplate(GenType.TEXT2IMG, executor, False, False, True, base_payload)
+    service_info = make_service_info('user')
+    seeded = executor == Executor.AUTOMATIC1111
+
+    def from_dict():
+        payload = dict(base_payload, prompt='a red fox in the snow')
+        if seeded:
+            payload['seed'] = 12345
+        return GenerationRequest(GenType.TEXT2IMG, executor, False, False, True, service_info, payload)
+
+    def from_template():
+        if seeded:
+            return template.request(service_info, prompt='a red fox in the snow', seed=12345)
+        return template.request(service_info, prompt='a red fox in the snow')
+
+    for name, build in (('payload dict', from_dict), ('template', from_template)):
+        yield name, (build, lambda: build().as_dict(), lambda: codec.encode(build().as_dict()))
+
+async def submit_cost(template: bool, requests: int) -> float:
+    '''CPU seconds per submit of `requests` requests of distinct users'''
+    gc.collect()
+    client = GeneratorClient('ws://127.0.0.1:9', 'test', 'token', user_max_in_flight=1)
+    gateway = client.gateway
+    encoded = 0
+
+    async def encode_messages(messages):
+        nonlocal encoded
+        for message in messages:
+            gateway.encode(message)
+        encoded += len(messages)
+        return [None] * len(messages)
+
+    gateway.connected = True
+    gateway.send_messages = encode_messages
+    request_template = RequestTemplate(GenType.TEXT2IMG, Executor.AUTOMATIC1111, False, False, True,
+                                       AUTOMATIC1111_PAYLOAD)
+    started = time.process_time()
+    for i in range(requests):
+        if template:
+            await client.submit_template(request_template, f'user-{i}', 1, i, 1,
+                                         prompt=f'prompt {i}', seed=i)
+        else:
+            payload = dict(AUTOMATIC1111_PAYLOAD, prompt=f'prompt {i}', seed=i)
+            await client.text2img(Executor.AUTOMATIC1111, False, False, True, f'user-{i}', 1, i, payload, 1)
+    while encoded < requests:
+        await asyncio.sleep(0)
+    elapsed = time.process_time() - started
+    client.queue.dispatcher.cancel()
+    return elapsed / requests
+
+def run(requests: int, repeat: int):
+    codec = get_codec()
+    print(f'codec {codec.name}')
+    print(f'{"executor":<14} {"built from":<14} {"build us":>10} {"+ as_dict us":>14} {"+ encode us":>14}')
+    for executor, payload in ((Executor.AUTOMATIC1111, AUTOMATIC1111_PAYLOAD), (Executor.KANDINSKY, KANDINSKY_PAYLOAD)):
+        for name, funcs in stage_cases(executor, payload, codec):
+            build, as_dict, encode = (measure(func, repeat) for func in funcs)
+            print(f'{executor.value:<14} {name:<14} {build * 1e6:>10.2f} {as_dict * 1e6:>14.2f} {encode * 1e6:>14.2f}')
+    for name, template in (('text2img', False), ('submit_template', True)):
+        cost = min(asyncio.run(submit_cost(template, requests)) for _ in range(repeat))
+        print(f'{name:<29} {"submit us":>10} {cost * 1e6:>9.2f}')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=50000, help='requests submitted through the client')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run(args.requests, args.repeat)
+
+if __name__ == '__main__':
+    main()
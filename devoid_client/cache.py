@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import hashlib
+import logging
+
+from collections import OrderedDict
+from typing import Callable, Dict, List, Tuple, Union
+
+from .enums import *
+from .attachments import ImageSource, is_buffer
+from .messages import GenerationRequest, GenerationResponse
+
+def is_deterministic(executor: Executor, payload: Dict) -> bool:
+    '''True if the same `payload` always generates the same image.\n
+    Automatic1111 requests are deterministic with a fixed seed, Kandinsky
+    requests have no seed and are never cached by default.
+    '''
+    if executor == Executor.AUTOMATIC1111:
+        seed = payload.get('seed')
+        return seed is not None and seed != -1
+    return False
+
+class _NotContentAddressable(Exception):
+    pass
+
+def _canonical(value):
+    # images are hashed by content, references to files are not cacheable
+    if is_buffer(value):
+        return {"sha256": hashlib.sha256(value).hexdigest()}
+    if isinstance(value, (ImageSource, os.PathLike)):
+        raise _NotContentAddressable()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+def request_key(request: GenerationRequest) -> Union[str, None]:
+    '''Hash of `request` without `service_info`, None if images are not in memory'''
+    data = request.as_dict()
+    del data['service_info']
+    data.pop('idempotency_key', None)
+    try:
+        encoded = json.dumps(data, sort_keys=True, separators=(',', ':'), default=_canonical)
+    except _NotContentAddressable:
+        return None
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+class ResultCache():
+    '''Successful responses of deterministic requests keyed by `request_key`.\n
+    Entries are evicted after `ttl` seconds, at most `max_size` least recently
+    used entries are kept in memory. With `path` entries are also written to
+    that directory as json files and survive restarts, evicted entries are
+    deleted from it.\n
+    Identical requests submitted while one is generating are coalesced,
+    they wait for its terminal response instead of being sent.
+    '''
+    entries: OrderedDict
+    in_flight: Dict[str, List[GenerationRequest]]
+
+    def __init__(
+            self,
+            max_size: int = 1024,
+            ttl: float = 3600.0,
+            path: str = None,
+            deterministic: Callable[[Executor, Dict], bool] = is_deterministic
+        ) -> None:
+        '''`deterministic` - function of `(executor, payload)` deciding if a request is cacheable'''
+        self.entries = OrderedDict()
+        self.in_flight = dict()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.deterministic = deterministic
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def key(self, request: GenerationRequest) -> Union[str, None]:
+        return request_key(request)
+
+    def get(self, key: str) -> Union[Dict, None]:
+        '''Cached response message or None'''
+        entry = self.entries.get(key)
+        if entry is None and self.path is not None:
+            entry = self.load(key)
+            if entry is not None:
+                self.entries[key] = entry
+        if entry is not None:
+            expires_at, message = entry
+            if expires_at > time.time():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return message
+            self.remove(key)
+        self.misses += 1
+        return None
+
+    def put(self, key: str, message: Dict):
+        entry = (time.time() + self.ttl, message)
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            evicted, _ = self.entries.popitem(last=False)
+            # disk holds the same entries as memory, not every result ever cached
+            self.remove(evicted)
+        if self.path is not None:
+            self.store(key, entry)
+
+    def remove(self, key: str):
+        self.entries.pop(key, None)
+        if self.path is not None:
+            try:
+                os.remove(self.file_path(key))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        for key in list(self.entries):
+            self.remove(key)
+
+    def file_path(self, key: str) -> str:
+        return os.path.join(self.path, f'{key}.json')
+
+    def load(self, key: str) -> Union[Tuple[float, Dict], None]:
+        try:
+            with open(self.file_path(key), 'r') as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f'Cannot read cached result `{key}` [{type(e)}] {e}')
+            return None
+        return data['expires_at'], data['message']
+
+    def store(self, key: str, entry: Tuple[float, Dict]):
+        expires_at, message = entry
+        file_path = self.file_path(key)
+        try:
+            # written aside and renamed, so readers never see a partial file
+            with open(file_path + '.tmp', 'w') as file:
+                json.dump({"expires_at": expires_at, "message": message}, file)
+            os.replace(file_path + '.tmp', file_path)
+        except (OSError, TypeError, ValueError) as e:
+            logging.warning(f'Cannot store cached result `{key}` [{type(e)}] {e}')
+
+    def stats(self) -> Dict:
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "in_flight": len(self.in_flight)
+        }
+
+def response_for(message: Dict, request: GenerationRequest) -> GenerationResponse:
+    '''Copy of response `message` addressed to `request`'''
+    message = dict(message)
+    message['service_info'] = request.service_info.as_dict()
+    return GenerationResponse(message, lazy=True)
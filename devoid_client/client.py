@@ -1,32 +1,93 @@
 import sys
+import asyncio
 
+from uuid import uuid4
+from functools import partial
+from typing import Callable, Dict, Iterable, List, Tuple, Union
 from asyncio import AbstractEventLoop
 from collections.abc import Coroutine
 
 from .enums import *
 from .messages import *
 from .messages.components import *
+from .messages.message import check_executor
+from .codec import JsonCodec
 from .gateway import GeneratorWebSocket
-from .queue import QueueIsFullError, GenerationQueue
+from .pool import GatewayPool
+from .reconnect import ReconnectPolicy
+from .queue import QueueIsFullError, AdmissionTimeoutError, GenerationQueue
+from .tracker import RequestHandle
+from .cache import ResultCache, response_for
+from .dispatch import HandlerDispatcher
+from .download import ResultDownloader
+from .metrics import LifecycleMetrics, prometheus_text, start_metrics_server
+from .tracing import Tracer
+from .recording import TrafficRecorder
 
 class GeneratorClient():
     def __init__(
             self,
             endpoint: str,
             service: str,
-            token: str
+            token: str,
+            codec: Union[str, JsonCodec, None] = None,
+            binary_frames: bool = False,
+            lazy_responses: bool = True,
+            binary_attachments: bool = True,
+            connections: int = 1,
+            reconnect_policy: ReconnectPolicy = None,
+            cache: ResultCache = None,
+            handler_dispatcher: HandlerDispatcher = None,
+            downloader: ResultDownloader = None,
+            tracer: Tracer = None,
+            recorder: TrafficRecorder = None,
+            **queue_options
         ) -> None:
+        '''`connections` - number of websocket connections, users are
+        sharded between them by `user_id`\n
+        `reconnect_policy` - backoff between connection attempts\n
+        `cache` - results of deterministic requests, identical requests are not regenerated\n
+        `handler_dispatcher` - runs response handlers on a bounded pool of workers\n
+        `downloader` - fetches `IMAGE_URL` results, done handlers get `result.data` or `result.path`\n
+        `tracer` - receives timings of hot path stages, see `set_tracer`\n
+        `recorder` - captures websocket frames to a file for `recording.replay`\n
+        `queue_options` - passed to `GenerationQueue`, e.g. `max_in_flight`,
+        `max_pending`, `rate_limit`, `admission`
+        '''
         self.service = Service(service)
-        self.gateway = GeneratorWebSocket(endpoint + f'/{service}', self.service, token)
+        gateway_kwargs = dict(codec=codec, binary_frames=binary_frames, lazy_responses=lazy_responses,
+                              binary_attachments=binary_attachments, reconnect_policy=reconnect_policy,
+                              handler_dispatcher=handler_dispatcher, downloader=downloader, recorder=recorder)
+        if connections > 1:
+            self.gateway = GatewayPool(endpoint + f'/{service}', self.service, token, connections, **gateway_kwargs)
+        else:
+            self.gateway = GeneratorWebSocket(endpoint + f'/{service}', self.service, token, **gateway_kwargs)
         self.loop = None
-        self.queue = GenerationQueue(self.gateway)
+        self.cache = cache
+        self.lifecycle = LifecycleMetrics()
+        self.gateway.response_listeners.append(self.lifecycle.on_response)
+        self.gateway.written_listeners.append(self.lifecycle.on_sent)
+        self.queue = GenerationQueue(self.gateway, lifecycle=self.lifecycle, **queue_options)
+        self.set_tracer(tracer)
     
+    def set_tracer(self, tracer: Union[Tracer, None]):
+        '''Record timings of request serialization, json encoding, websocket
+        sends, json decoding, response construction, dispatch and handler
+        calls with `tracer`. Can be switched at runtime, None disables
+        tracing and leaves a single `is None` check per stage.
+        '''
+        gateway = self.gateway
+        for member in getattr(gateway, 'members', ()):
+            member.tracer = tracer
+        gateway.tracer = tracer
+        gateway.handler_dispatcher.tracer = tracer
+
     def run(self, loop: AbstractEventLoop = None):
         self.loop = loop
         self.gateway.run(loop)
     
     async def text2img(
-            self, 
+            self,
             executor: Executor,
             premium: bool,
             moderate: bool,
@@ -35,14 +96,14 @@ class GeneratorClient():
             chat_id: int,
             message_id: int,
             payload: dict,
-            max_user_queue_size: int
-        ) -> None:
-        if not isinstance(executor, Executor):
-            raise ValueError(f'Unknown type of executor "{executor}"')
-        service_info = ServiceInfo(user_id=user_id, chat_id=chat_id, message_id=message_id)
-        request = GenerationRequest(GenType.TEXT2IMG, executor, premium, moderate, sync_with_s3, service_info, payload)
-        await self.queue.put(user_id, request, max_user_queue_size)
-        
+            max_user_queue_size: int,
+            max_user_in_flight: int = None
+        ) -> RequestHandle:
+        request = self._build_request(GenType.TEXT2IMG, executor, premium, moderate, sync_with_s3,
+                                      user_id, chat_id, message_id, payload)
+        return await self._submit(user_id, request, max_user_queue_size, max_user_in_flight,
+                                  self._cacheable(executor, payload))
+
     async def img2img(
             self,
             executor: Executor,
@@ -53,15 +114,13 @@ class GeneratorClient():
             chat_id: int,
             message_id: int,
             payload: dict,
-            max_user_queue_size: int
-    ) -> None:
-        if not isinstance(executor, Executor):
-            raise ValueError(f'Unknown type of executor "{executor}"')
-        if executor == Executor.KANDINSKY:
-            raise ValueError(f'Executor {executor.value} cannot process img2img')
-        service_info = ServiceInfo(user_id=user_id, chat_id=chat_id, message_id=message_id)
-        request = GenerationRequest(GenType.IMG2IMG, executor, premium, moderate, sync_with_s3, service_info, payload)
-        await self.queue.put(user_id, request, max_user_queue_size)
+            max_user_queue_size: int,
+            max_user_in_flight: int = None
+        ) -> RequestHandle:
+        request = self._build_request(GenType.IMG2IMG, executor, premium, moderate, sync_with_s3,
+                                      user_id, chat_id, message_id, payload)
+        return await self._submit(user_id, request, max_user_queue_size, max_user_in_flight,
+                                  self._cacheable(executor, payload))
 
     async def mix2img(
             self,
@@ -73,42 +132,308 @@ class GeneratorClient():
             chat_id: int,
             message_id: int,
             payload: dict,
-            max_user_queue_size: int
-    ) -> None:
-        if not isinstance(executor, Executor):
-            raise ValueError(f'Unknown type of executor "{executor}"')
-        if executor != Executor.KANDINSKY:
-            raise ValueError(f'Executor {executor.value} cannot process mix2img')
-        service_info = ServiceInfo(user_id=user_id, chat_id=chat_id, message_id=message_id)
-        request = GenerationRequest(GenType.MIX2IMG, executor, premium, moderate, sync_with_s3, service_info, payload)
-        await self.queue.put(user_id, request, max_user_queue_size)
-
-    def register_req_error_handler(self, handler: Coroutine):
+            max_user_queue_size: int,
+            max_user_in_flight: int = None
+        ) -> RequestHandle:
+        request = self._build_request(GenType.MIX2IMG, executor, premium, moderate, sync_with_s3,
+                                      user_id, chat_id, message_id, payload)
+        return await self._submit(user_id, request, max_user_queue_size, max_user_in_flight,
+                                  self._cacheable(executor, payload))
+
+    async def submit_template(
+            self,
+            template: RequestTemplate,
+            user_id: str,
+            chat_id: int,
+            message_id: int,
+            max_user_queue_size: int,
+            max_user_in_flight: int = None,
+            **fields
+        ) -> RequestHandle:
+        '''Submit a request of `template` with `fields` of its payload replaced,
+        e.g. `prompt` and `seed`. Settings and the rest of the payload were
+        validated once when the template was created.
+        '''
+        request = template.request(self._service_info(user_id, chat_id, message_id), **fields)
+        return await self._submit(user_id, request, max_user_queue_size, max_user_in_flight,
+                                  self._template_cacheable(request))
+
+    async def submit_many(self, items: Iterable[Dict]) -> List[Union[RequestHandle, Exception]]:
+        '''Submit a batch of requests at once.\n
+        `items` - dicts with `gen_type` and arguments of `text2img`,
+        `img2img` or `mix2img`, or with `template`, payload `fields` and
+        the other arguments of `submit_template`\n
+        All requests are built and validated before any of them is queued,
+        queued requests are sent by the dispatcher in pipelined batches.
+        Returns a `RequestHandle` or the exception of every item in order.
+        '''
+        results = []
+        queued = []
+        for item in items:
+            try:
+                item = dict(item)
+                max_user_queue_size = item.pop('max_user_queue_size')
+                max_user_in_flight = item.pop('max_user_in_flight', None)
+                template = item.pop('template', None)
+                if template is None:
+                    gen_type = GenType(item.pop('gen_type'))
+                    request = self._build_request(gen_type, **item)
+                    cacheable = self._cacheable(request.executor, item['payload'])
+                else:
+                    service_info = self._service_info(item['user_id'], item['chat_id'], item['message_id'])
+                    request = template.request(service_info, **item.get('fields', {}))
+                    cacheable = self._template_cacheable(request)
+            except Exception as e:
+                results.append(e)
+                continue
+            handle, leader = self._track(request, cacheable)
+            results.append(handle)
+            if leader:
+                queued.append((len(results) - 1, (item['user_id'], request, max_user_queue_size, max_user_in_flight)))
+        for index, _ in queued:
+            self.lifecycle.on_submit(results[index])
+        errors = await self.queue.put_many([entry for _, entry in queued])
+        for (index, _), error in zip(queued, errors):
+            if error is not None:
+                self._untrack(results[index], error)
+                results[index] = error
+        return results
+
+    def _build_request(
+            self,
+            gen_type: GenType,
+            executor: Executor,
+            premium: bool,
+            moderate: bool,
+            sync_with_s3: bool,
+            user_id: str,
+            chat_id: int,
+            message_id: int,
+            payload: dict
+        ) -> GenerationRequest:
+        check_executor(gen_type, executor)
+        service_info = self._service_info(user_id, chat_id, message_id)
+        return GenerationRequest(gen_type, executor, premium, moderate, sync_with_s3, service_info, payload)
+
+    def _service_info(
+            self,
+            user_id: str,
+            chat_id: int,
+            message_id: int
+        ) -> ServiceInfo:
+        return ServiceInfo(user_id=user_id, chat_id=chat_id, message_id=message_id, request_id=uuid4().hex)
+
+    async def _submit(
+            self,
+            user_id: str,
+            request: GenerationRequest,
+            max_user_queue_size: int,
+            max_user_in_flight: int = None,
+            cacheable: bool = False
+        ) -> RequestHandle:
+        handle, leader = self._track(request, cacheable)
+        if not leader:
+            return handle
+        self.lifecycle.on_submit(handle)
+        try:
+            await self.queue.put(user_id, request, max_user_queue_size, max_user_in_flight)
+        except BaseException as e:
+            self._untrack(handle, e)
+            raise
+        return handle
+
+    def _track(self, request: GenerationRequest, cacheable: bool) -> Tuple[RequestHandle, bool]:
+        '''Handle of `request`, False if it is answered from cache and must not be queued'''
+        tracker = self.gateway.tracker
+        key = self.cache.key(request) if cacheable else None
+        if key is not None:
+            message = self.cache.get(key)
+            if message is not None:
+                handle = tracker.track(request)
+                self.gateway.on_response(response_for(message, request))
+                return handle, False
+            followers = self.cache.in_flight.get(key)
+            if followers is not None:
+                # identical request is generating, share its result
+                self.cache.coalesced += 1
+                followers.append(request)
+                return tracker.track(request), False
+        handle = tracker.track(request)
+        if key is not None:
+            self.cache.in_flight[key] = []
+            # followers wait for the generator, not for the leader's caller who may give up
+            tracker.watch(handle.request_id, partial(self._on_cached_request_done, key))
+        return handle, True
+
+    def _untrack(self, handle: RequestHandle, exception: BaseException):
+        '''Forget request which was not queued, its coalesced followers fail too'''
+        tracker = self.gateway.tracker
+        tracker.discard(handle.request_id)
+        if isinstance(exception, Exception):
+            handle.set_exception(exception)
+        else:
+            handle.result_future.cancel()
+        tracker.notify(handle.request_id, None, exception)
+
+    def _cacheable(self, executor: Executor, payload: dict) -> bool:
+        return self.cache is not None and self.cache.deterministic(executor, payload)
+
+    def _template_cacheable(self, request: TemplateRequest) -> bool:
+        # a seed drawn for the request does not make it repeatable
+        return self.cache is not None and not request.random_seed \
+            and self.cache.deterministic(request.executor, request.payload_dict())
+
+    def _on_cached_request_done(
+            self,
+            key: str,
+            response: Union[GenerationResponse, None],
+            exception: Union[BaseException, None]
+        ):
+        followers = self.cache.in_flight.pop(key, ())
+        if exception is not None:
+            for request in followers:
+                self.gateway.tracker.fail(request.request_id, exception)
+            return
+        message = response.as_dict()
+        if response.gen_status == GenStatus.OK:
+            self.cache.put(key, message)
+        for request in followers:
+            self.gateway.on_response(response_for(message, request))
+
+    def _register_handler(
+            self,
+            handlers: List,
+            handler: Callable,
+            timeout: Union[float, None],
+            mode: Union[HandlerMode, str, None]
+        ):
+        # invalid timeout or mode raises before the handler is registered
+        dispatcher = self.gateway.handler_dispatcher
+        dispatcher.set_timeout(handler, timeout)
+        dispatcher.set_mode(handler, mode)
+        handlers.append(handler)
+
+    def register_req_error_handler(
+            self,
+            handler: Union[Coroutine, Callable],
+            timeout: float = None,
+            mode: Union[HandlerMode, str] = None
+        ):
         '''Register generator error handler\n
-        `handler` - coroutine function with only `response: GenerationResponse` param
+        `handler` - coroutine function with only `response: GenerationResponse` param,
+        or a plain function for thread and process modes\n
+        `timeout` - seconds before the handler is cancelled, dispatcher default if None\n
+        `mode` - `inline`, `thread` or `process`, by default coroutine functions
+        run inline and plain functions in a thread pool
         '''
-        self.gateway.req_error_handlers.append(handler)
+        self._register_handler(self.gateway.req_error_handlers, handler, timeout, mode)
         
-    def register_req_queued_handler(self, handler: Coroutine):
+    def register_req_queued_handler(
+            self,
+            handler: Union[Coroutine, Callable],
+            timeout: float = None,
+            mode: Union[HandlerMode, str] = None
+        ):
         '''Register generator queued handler\n
-        `handler` - coroutine function with only `response: GenerationResponse` param
+        `handler` - coroutine function with only `response: GenerationResponse` param,
+        or a plain function for thread and process modes\n
+        `timeout` - seconds before the handler is cancelled, dispatcher default if None\n
+        `mode` - `inline`, `thread` or `process`, by default coroutine functions
+        run inline and plain functions in a thread pool
         '''
-        self.gateway.req_queued_handlers.append(handler)
+        self._register_handler(self.gateway.req_queued_handlers, handler, timeout, mode)
     
-    def register_req_generating_handler(self, handler: Coroutine):
+    def register_req_generating_handler(
+            self,
+            handler: Union[Coroutine, Callable],
+            timeout: float = None,
+            mode: Union[HandlerMode, str] = None
+        ):
         '''Register generator generating handler\n
-        `handler` - coroutine function with only `response: GenerationResponse` param
+        `handler` - coroutine function with only `response: GenerationResponse` param,
+        or a plain function for thread and process modes\n
+        `timeout` - seconds before the handler is cancelled, dispatcher default if None\n
+        `mode` - `inline`, `thread` or `process`, by default coroutine functions
+        run inline and plain functions in a thread pool
         '''
-        self.gateway.req_generating_handlers.append(handler)
+        self._register_handler(self.gateway.req_generating_handlers, handler, timeout, mode)
     
-    def register_req_done_handler(self, handler: Coroutine):
+    def register_req_done_handler(
+            self,
+            handler: Union[Coroutine, Callable],
+            timeout: float = None,
+            mode: Union[HandlerMode, str] = None
+        ):
         '''Register generator generating handler\n
-        `handler` - coroutine function with only `response: GenerationResponse` param
+        `handler` - coroutine function with only `response: GenerationResponse` param,
+        or a plain function for thread and process modes\n
+        `timeout` - seconds before the handler is cancelled, dispatcher default if None\n
+        `mode` - `inline`, `thread` or `process`, by default coroutine functions
+        run inline and plain functions in a thread pool
         '''
-        self.gateway.req_done_handlers.append(handler)
+        self._register_handler(self.gateway.req_done_handlers, handler, timeout, mode)
         
     def register_con_error_handler(self, handler: Coroutine):
         '''Register generator generating handler\n
         `handler` - coroutine function with only `exception: Exception` param
         '''
-        self.gateway.con_error_handlers.append(handler)
\ No newline at end of file
+        self.gateway.con_error_handlers.append(handler)
+        
+    def register_connected_handler(self, handler: Coroutine):
+        '''Register connection established handler\n
+        `handler` - coroutine function with only `gateway: GeneratorWebSocket` param
+        '''
+        self.gateway.connected_handlers.append(handler)
+
+    def gauges(self) -> Dict:
+        '''Current queue depths, in-flight counts and counters of client components'''
+        connection = self.gateway.metrics
+        outbound = self.gateway.outbound_metrics
+        gauges = {
+            "queue": self.queue.utilization(),
+            "connection": [m.as_dict() for m in connection] if isinstance(connection, list) else connection.as_dict(),
+            "outbound": [m.as_dict() for m in outbound] if isinstance(outbound, list) else outbound.as_dict(),
+            "handlers": self.gateway.handler_dispatcher.as_dict(),
+            "tracker": {"tracked": len(self.gateway.tracker), "timed": len(self.lifecycle)}
+        }
+        if self.cache is not None:
+            gauges["cache"] = self.cache.stats()
+        if self.gateway.downloader is not None:
+            gauges["downloader"] = self.gateway.downloader.as_dict()
+        return gauges
+
+    def metrics_snapshot(self) -> Dict:
+        '''`gauges` with request lifecycle histograms per executor and gen type'''
+        snapshot = self.gauges()
+        snapshot["lifecycle"] = self.lifecycle.as_dict()
+        return snapshot
+
+    def prometheus_metrics(self) -> str:
+        '''Metrics snapshot in Prometheus text format'''
+        return prometheus_text(self.lifecycle, self.gauges())
+
+    async def serve_metrics(self, host: str = '127.0.0.1', port: int = 9100) -> asyncio.AbstractServer:
+        '''Serve `prometheus_metrics` on `http://host:port/metrics` until the returned server is closed'''
+        return await start_metrics_server(self.prometheus_metrics, host, port)
+
+    async def drain_handlers(self, timeout: float = None) -> bool:
+        '''Wait until all queued response handlers are finished, returns False on timeout.\n
+        Running result downloads are waited for first, each stage within `timeout`
+        '''
+        downloader = self.gateway.downloader
+        if downloader is not None and not await downloader.drain(timeout):
+            return False
+        return await self.gateway.handler_dispatcher.drain(timeout)
+
+    async def close(self, timeout: float = None):
+        '''Stop sending and reconnecting, fail unfinished handles with `ConnectionError`,
+        then wait for running downloads and queued handlers at most `timeout` seconds each
+        '''
+        dispatcher = self.queue.dispatcher
+        if dispatcher is not None:
+            dispatcher.cancel()
+            await asyncio.gather(dispatcher, return_exceptions=True)
+        await self.gateway.close()
+        if self.gateway.downloader is not None:
+            await self.gateway.downloader.close(timeout)
+        await self.gateway.handler_dispatcher.close(timeout)
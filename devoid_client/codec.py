@@ -0,0 +1,87 @@
+import json
+
+from typing import Dict, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+class JsonCodec():
+    '''Standard library json codec, always available.\n
+    `binary` - True if `encode` returns utf-8 `bytes` instead of `str`
+    '''
+    name: str = 'json'
+    binary: bool = False
+
+    def encode(self, message: Dict) -> Union[str, bytes]:
+        return json.dumps(message)
+
+    def decode(self, data: Union[str, bytes]) -> Dict:
+        return json.loads(data)
+
+class OrjsonCodec(JsonCodec):
+    name = 'orjson'
+    binary = True
+
+    def __init__(self) -> None:
+        if orjson is None:
+            raise ImportError('orjson is not installed, run `pip install orjson`')
+
+    def encode(self, message: Dict) -> bytes:
+        return orjson.dumps(message)
+
+    def decode(self, data: Union[str, bytes]) -> Dict:
+        return orjson.loads(data)
+
+class MsgspecCodec(JsonCodec):
+    name = 'msgspec'
+    binary = True
+
+    def __init__(self) -> None:
+        if msgspec is None:
+            raise ImportError('msgspec is not installed, run `pip install msgspec`')
+        self.encoder = msgspec.json.Encoder()
+        self.decoder = msgspec.json.Decoder()
+
+    def encode(self, message: Dict) -> bytes:
+        return self.encoder.encode(message)
+
+    def decode(self, data: Union[str, bytes]) -> Dict:
+        return self.decoder.decode(data)
+
+CODECS = {
+    JsonCodec.name: JsonCodec,
+    OrjsonCodec.name: OrjsonCodec,
+    MsgspecCodec.name: MsgspecCodec
+}
+
+def available_codecs() -> Dict[str, type]:
+    '''Codecs whose backing library is installed'''
+    available = {JsonCodec.name: JsonCodec}
+    if orjson is not None:
+        available[OrjsonCodec.name] = OrjsonCodec
+    if msgspec is not None:
+        available[MsgspecCodec.name] = MsgspecCodec
+    return available
+
+def get_codec(codec: Union[str, JsonCodec, None] = None) -> JsonCodec:
+    '''Resolve `codec` to an instance.\n
+    `codec` - codec instance, name from `CODECS` or None
+    for the fastest installed one (orjson, msgspec, json)
+    '''
+    if isinstance(codec, JsonCodec):
+        return codec
+    if codec is None:
+        for name in (OrjsonCodec.name, MsgspecCodec.name):
+            if name in available_codecs():
+                return CODECS[name]()
+        return JsonCodec()
+    if codec not in CODECS:
+        raise ValueError(f'Unknown codec "{codec}"')
+    return CODECS[codec]()
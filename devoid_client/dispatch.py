@@ -0,0 +1,215 @@
+import time
+import asyncio
+import logging
+
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Callable, Dict, Set, Union
+
+from .enums import HandlerMode, HandlerOverflow
+from .tracing import Tracer, HANDLER_RUN
+
+def _handler_name(handler: Callable) -> str:
+    return getattr(handler, '__qualname__', None) or repr(handler)
+
+class HandlerDispatcher():
+    '''Runs response handlers on a fixed number of worker tasks.\n
+    Handler calls wait in a queue of `max_queue` calls. When it is full
+    the receiver stops reading the socket until workers catch up
+    (`HandlerOverflow.BLOCK`) or new calls are dropped and counted
+    (`HandlerOverflow.DROP`).\n
+    `workers` - handlers running concurrently\n
+    `timeout` - default seconds a handler may run before it is cancelled\n
+    `slow_after` - handlers running longer are counted and logged as slow\n
+    Coroutine handlers run on the event loop. Blocking functions run in a
+    pool of `thread_workers` threads and CPU heavy ones in a pool of
+    `process_workers` processes, see `set_mode`.\n
+    `tracer` - receives the duration of every handler call, disabled if None
+    '''
+    workers: Set[asyncio.Task]
+    timeouts: Dict[Callable, float]
+    modes: Dict[Callable, HandlerMode]
+
+    def __init__(
+            self,
+            workers: int = 16,
+            max_queue: int = 10000,
+            timeout: float = None,
+            slow_after: float = 1.0,
+            overflow: Union[HandlerOverflow, str] = HandlerOverflow.BLOCK,
+            thread_workers: int = None,
+            process_workers: int = None,
+            tracer: Tracer = None
+        ) -> None:
+        if workers < 1:
+            raise ValueError(f'workers must be positive, got {workers}')
+        self.worker_count = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.slow_after = slow_after
+        self.overflow = HandlerOverflow(overflow)
+        self.timeouts = dict()
+        self.modes = dict()
+        self.thread_workers = thread_workers
+        self.process_workers = process_workers
+        self.thread_pool = None
+        self.process_pool = None
+        self.tracer = tracer
+        self.queue = None
+        self.workers = set()
+        self.capacity_waiters = deque()
+        self.running = 0
+        self.dispatched = 0
+        self.dropped = 0
+        self.slow = 0
+        self.timed_out = 0
+        self.failed = 0
+
+    def set_timeout(self, handler: Callable, timeout: Union[float, None]):
+        '''Per-handler `timeout`, None falls back to the default one'''
+        if timeout is not None and timeout <= 0:
+            raise ValueError(f'Handler timeout must be positive, got {timeout}')
+        if timeout is None:
+            self.timeouts.pop(handler, None)
+        else:
+            self.timeouts[handler] = timeout
+
+    def set_mode(self, handler: Callable, mode: Union[HandlerMode, str, None] = None):
+        '''Where `handler` runs: `INLINE` on the event loop, `THREAD` or `PROCESS` pool.\n
+        By default coroutine functions run inline and plain functions in threads.
+        Process handlers must be picklable, i.e. module level functions.
+        '''
+        if mode is None:
+            mode = HandlerMode.INLINE if asyncio.iscoroutinefunction(handler) else HandlerMode.THREAD
+        mode = HandlerMode(mode)
+        if mode != HandlerMode.INLINE and asyncio.iscoroutinefunction(handler):
+            raise ValueError(f'Handler `{_handler_name(handler)}` is a coroutine function and runs only inline')
+        if mode == HandlerMode.INLINE:
+            self.modes.pop(handler, None)
+        else:
+            self.modes[handler] = mode
+
+    def executor(self, mode: HandlerMode) -> Executor:
+        if mode == HandlerMode.THREAD:
+            if self.thread_pool is None:
+                self.thread_pool = ThreadPoolExecutor(self.thread_workers, thread_name_prefix='devoid-handler')
+            return self.thread_pool
+        if self.process_pool is None:
+            self.process_pool = ProcessPoolExecutor(self.process_workers)
+        return self.process_pool
+
+    @property
+    def queued(self) -> int:
+        return 0 if self.queue is None else self.queue.qsize()
+
+    def dispatch(self, handler: Callable, response) -> bool:
+        '''Queue `handler(response)` call, returns False if it was dropped'''
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+        if self.queued >= self.max_queue and self.overflow == HandlerOverflow.DROP:
+            self.dropped += 1
+            logging.warning(f'Handler queue is full, dropped `{_handler_name(handler)}` call')
+            return False
+        self.queue.put_nowait((handler, response))
+        self.dispatched += 1
+        if len(self.workers) < self.worker_count:
+            self.start_worker()
+        return True
+
+    async def wait_capacity(self):
+        '''Wait until handler queue has free space, used to stop reading the socket'''
+        if self.overflow != HandlerOverflow.BLOCK:
+            return
+        while self.queued >= self.max_queue:
+            waiter = asyncio.get_running_loop().create_future()
+            self.capacity_waiters.append(waiter)
+            await waiter
+
+    def start_worker(self):
+        task = asyncio.get_running_loop().create_task(self.worker_loop())
+        # tasks are referenced until done, so they are not garbage collected while running
+        self.workers.add(task)
+        task.add_done_callback(self.workers.discard)
+
+    async def worker_loop(self):
+        queue = self.queue
+        while True:
+            handler, response = await queue.get()
+            while self.capacity_waiters and queue.qsize() < self.max_queue:
+                waiter = self.capacity_waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+            self.running += 1
+            try:
+                await self.run(handler, response)
+            finally:
+                self.running -= 1
+                queue.task_done()
+
+    async def run(self, handler: Callable, response):
+        timeout = self.timeouts.get(handler, self.timeout)
+        mode = self.modes.get(handler)
+        tracer = self.tracer
+        started = time.monotonic()
+        traced = time.perf_counter() if tracer is not None else 0.0
+        try:
+            if mode is None:
+                call = handler(response)
+            else:
+                # a timed out thread or process call is abandoned, not interrupted
+                call = asyncio.get_running_loop().run_in_executor(self.executor(mode), handler, response)
+            if timeout is None:
+                await call
+            else:
+                await asyncio.wait_for(call, timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            logging.warning(f'Handler `{_handler_name(handler)}` cancelled after {timeout}s')
+            return
+        except Exception as e:
+            self.failed += 1
+            logging.error(f'Handler `{_handler_name(handler)}` failed [{type(e)}] {e}')
+            return
+        finally:
+            if tracer is not None:
+                tracer.record(HANDLER_RUN, traced, time.perf_counter(),
+                              {"handler": _handler_name(handler), "mode": (mode or HandlerMode.INLINE).value})
+        elapsed = time.monotonic() - started
+        if elapsed > self.slow_after:
+            self.slow += 1
+            logging.warning(f'Slow handler `{_handler_name(handler)}` took {elapsed:.2f}s')
+
+    async def drain(self, timeout: float = None) -> bool:
+        '''Wait until all queued handler calls are finished, returns False on timeout'''
+        if self.queue is None:
+            return True
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def close(self, timeout: float = None) -> bool:
+        '''Drain queued calls and stop workers, unfinished handlers are cancelled after `timeout`'''
+        drained = await self.drain(timeout)
+        for task in list(self.workers):
+            task.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        for pool in (self.thread_pool, self.process_pool):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        self.thread_pool = None
+        self.process_pool = None
+        return drained
+
+    def as_dict(self):
+        return {
+            "workers": len(self.workers),
+            "running": self.running,
+            "queued": self.queued,
+            "dispatched": self.dispatched,
+            "dropped": self.dropped,
+            "slow": self.slow,
+            "timed_out": self.timed_out,
+            "failed": self.failed
+        }
@@ -0,0 +1,172 @@
+import os
+import time
+import asyncio
+import logging
+import requests
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Set, Tuple, Union
+from requests.adapters import HTTPAdapter
+
+from .enums import *
+from .messages import GenerationResponse
+
+RETRY_STATUSES = frozenset((408, 425, 429, 500, 502, 503, 504))
+
+class DownloadError(Exception):
+    '''Result could not be fetched, `status` is None for connection errors'''
+    def __init__(self, url: str, reason: str, status: int = None, retryable: bool = True) -> None:
+        super().__init__(f'{url} {reason}')
+        self.url = url
+        self.status = status
+        self.retryable = retryable and (status is None or status in RETRY_STATUSES)
+
+class ResultDownloader():
+    '''Fetches `IMAGE_URL` results before handles are resolved and done handlers run.\n
+    Results are streamed over a pooled keep-alive session on `concurrency`
+    threads, into `result.data` or with `directory` into a file at `result.path`.
+    Connection errors and retryable statuses are retried `retries` times
+    with exponential `backoff`. A result which cannot be fetched is delivered
+    as is, with `data` and `path` left None.\n
+    `timeout` - seconds to connect and between received chunks\n
+    `max_size` - larger results are not fetched, unlimited if None
+    '''
+    tasks: Set[asyncio.Task]
+
+    def __init__(
+            self,
+            concurrency: int = 8,
+            directory: str = None,
+            retries: int = 3,
+            backoff: float = 0.5,
+            timeout: float = 30.0,
+            max_size: int = None,
+            chunk_size: int = 64 * 1024
+        ) -> None:
+        if concurrency < 1:
+            raise ValueError(f'concurrency must be positive, got {concurrency}')
+        self.concurrency = concurrency
+        self.directory = directory
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=concurrency, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(concurrency, thread_name_prefix='devoid-download')
+        self.tasks = set()
+        self.fetched = 0
+        self.failed = 0
+        self.retried = 0
+        self.bytes = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def accepts(self, response: GenerationResponse) -> bool:
+        result = response.result
+        return (response.gen_status == GenStatus.OK and result is not None and bool(result.content)
+                and getattr(result.content_type, 'value', result.content_type) == ContentType.IMAGE_URL.value)
+
+    def schedule(self, response: GenerationResponse, deliver: Callable[[GenerationResponse], None]):
+        '''Fetch result of `response` in background and pass it to `deliver`'''
+        task = asyncio.get_running_loop().create_task(self.fetch_and_deliver(response, deliver))
+        # tasks are referenced until done, so they are not garbage collected while running
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def fetch_and_deliver(self, response: GenerationResponse, deliver: Callable[[GenerationResponse], None]):
+        try:
+            await self.fetch(response)
+        except Exception as e:
+            self.failed += 1
+            logging.warning(f'Cannot download result of {response.object_id} [{type(e)}] {e}')
+        deliver(response)
+
+    async def fetch(self, response: GenerationResponse):
+        '''Fetch result of `response` into `result.data` or `result.path`'''
+        result = response.result
+        if result.path is not None and os.path.exists(result.path):
+            # result replayed from cache was already downloaded
+            return
+        data, path = await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.download, result.content, result.file_name)
+        result.data = data
+        result.path = path
+        self.fetched += 1
+
+    def download(self, url: str, file_name: str = None) -> Tuple[Union[bytes, None], Union[str, None]]:
+        '''Blocking download of `url` with retries, returns `(data, path)`'''
+        attempt = 0
+        while True:
+            try:
+                return self.download_once(url, file_name)
+            except DownloadError as e:
+                if not e.retryable or attempt >= self.retries:
+                    raise
+            except requests.RequestException as e:
+                if attempt >= self.retries:
+                    raise DownloadError(url, f'[{type(e).__name__}] {e}') from e
+            self.retried += 1
+            time.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    def download_once(self, url: str, file_name: str = None) -> Tuple[Union[bytes, None], Union[str, None]]:
+        with self.session.get(url, stream=True, timeout=self.timeout) as http_response:
+            if http_response.status_code != 200:
+                # error body is read, so the connection goes back to the pool
+                http_response.content
+                raise DownloadError(url, f'HTTP {http_response.status_code}', http_response.status_code)
+            length = http_response.headers.get('Content-Length')
+            if self.max_size is not None and length is not None and int(length) > self.max_size:
+                raise DownloadError(url, f'is {length} bytes, over max_size {self.max_size}', retryable=False)
+            chunks = http_response.iter_content(self.chunk_size)
+            if self.directory is None:
+                data = b''.join(self.limited(url, chunks))
+                self.bytes += len(data)
+                return data, None
+            path = os.path.join(self.directory, os.path.basename(file_name or url.split('?')[0]))
+            try:
+                # written aside and renamed, so handlers never see a partial file
+                with open(path + '.part', 'wb') as file:
+                    for chunk in self.limited(url, chunks):
+                        file.write(chunk)
+                        self.bytes += len(chunk)
+                os.replace(path + '.part', path)
+            except BaseException:
+                if os.path.exists(path + '.part'):
+                    os.remove(path + '.part')
+                raise
+            return None, path
+
+    def limited(self, url: str, chunks):
+        size = 0
+        for chunk in chunks:
+            size += len(chunk)
+            if self.max_size is not None and size > self.max_size:
+                raise DownloadError(url, f'is over max_size {self.max_size}', retryable=False)
+            yield chunk
+
+    async def drain(self, timeout: float = None) -> bool:
+        '''Wait until running downloads are delivered, returns False on timeout'''
+        if not self.tasks:
+            return True
+        _, pending = await asyncio.wait(set(self.tasks), timeout=timeout)
+        return not pending
+
+    async def close(self, timeout: float = None):
+        '''Wait for running downloads and release pooled connections'''
+        await self.drain(timeout)
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+    def as_dict(self):
+        return {
+            "running": len(self.tasks),
+            "fetched": self.fetched,
+            "failed": self.failed,
+            "retried": self.retried,
+            "bytes": self.bytes
+        }
@@ -28,4 +28,18 @@ class ContentType(Enum):
 
 class Executor(Enum):
     KANDINSKY = "kandinsky"
-    AUTOMATIC1111 = "automatic1111"
\ No newline at end of file
+    AUTOMATIC1111 = "automatic1111"
+    
+class AdmissionMode(Enum):
+    WAIT = "wait"
+    FAIL = "fail"
+    TIMEOUT = "timeout"
+
+class HandlerOverflow(Enum):
+    BLOCK = "block"
+    DROP = "drop"
+
+class HandlerMode(Enum):
+    INLINE = "inline"
+    THREAD = "thread"
+    PROCESS = "process"
@@ -1,13 +1,29 @@
-import json
+import time
 import logging
 import asyncio
 
-from typing import List
+from collections import deque
+from typing import AsyncIterable, Dict, Iterable, List, Union
 from websockets.client import connect
 from websockets.exceptions import *
+from websockets.frames import Opcode
+try:
+    from websockets.legacy.exceptions import InvalidStatusCode
+except ImportError:
+    # websockets before 14 keep it with the other exceptions
+    from websockets.exceptions import InvalidStatusCode
 
 from .messages import *
 from .enums import *
+from .codec import JsonCodec, get_codec
+from .attachments import *
+from .tracker import RequestTracker, _consume_exception
+from .reconnect import ConnectionMetrics, ReconnectPolicy
+from .writer import OutboundMessage, OutboundMetrics, OutboundWriteError
+from .dispatch import HandlerDispatcher
+from .download import ResultDownloader
+from .recording import TrafficRecorder, INBOUND, OUTBOUND
+from .tracing import Tracer, JSON_ENCODE, WEBSOCKET_SEND, JSON_DECODE, RESPONSE_BUILD, RESPONSE_DISPATCH
 
 class GeneratorWebSocket():    
     req_done_handlers: List
@@ -19,13 +35,56 @@ class GeneratorWebSocket():
             self, 
             endpoint: str,
             service: Service,
-            token: str
+            token: str,
+            codec: Union[str, JsonCodec, None] = None,
+            binary_frames: bool = False,
+            lazy_responses: bool = True,
+            binary_attachments: bool = True,
+            reconnect_policy: ReconnectPolicy = None,
+            max_outbound: int = 1000,
+            write_batch: int = 64,
+            handler_dispatcher: HandlerDispatcher = None,
+            downloader: ResultDownloader = None,
+            tracer: Tracer = None,
+            recorder: TrafficRecorder = None
         ) -> None:
+        '''`codec` - json codec instance or name, fastest installed one by default\n
+        `binary_frames` - send bytes produced by a binary codec in binary frames,
+        otherwise the same bytes are sent as text frames without a copy to `str`\n
+        `lazy_responses` - decode sub-objects of `GenerationResponse` on first access\n
+        `binary_attachments` - send raw image buffers from payloads as separate
+        binary frames if generator supports it, otherwise they are base64 encoded\n
+        `reconnect_policy` - backoff between connection attempts, `ReconnectPolicy()` by default\n
+        `max_outbound` - number of messages buffered for the writer task, senders
+        wait for free space beyond it. It does not limit bytes, a message holds
+        its encoded envelope while streamed `ImageSource` attachments are read on write\n
+        `write_batch` - max messages written before waiting for the socket to drain\n
+        `handler_dispatcher` - runs response handlers, `HandlerDispatcher()` by default\n
+        `downloader` - fetches `IMAGE_URL` results before done handlers, disabled if None\n
+        `tracer` - receives timings of encode, send, decode and dispatch stages, disabled if None\n
+        `recorder` - captures sent and received frames for replay, disabled if None
+        '''
         self.endpoint = endpoint
         self.service = service
         self.token = token
+        self.codec = get_codec(codec)
+        self.binary_frames = binary_frames
+        self.lazy_responses = lazy_responses
+        self.binary_attachments = binary_attachments
+        self.reconnect_policy = reconnect_policy or ReconnectPolicy()
+        self.metrics = ConnectionMetrics()
         self.websocket = None
         self.connected = False
+        self.peer_features = set()
+        self.outbound = deque()
+        self.outbound_keys: Dict[str, OutboundMessage] = {}
+        self.outbound_waiters = deque()
+        self.outbound_metrics = OutboundMetrics()
+        self.max_outbound = max_outbound
+        self.write_batch = write_batch
+        self.writer = None
+        self.receiver = None
+        self.writer_wakeup = asyncio.Event()
         
         self.req_done_handlers = []
         self.req_error_handlers = []
@@ -33,60 +92,346 @@ class GeneratorWebSocket():
         self.req_generating_handlers = []
         
         self.con_error_handlers = []
+        self.connected_handlers = []
+        # plain functions called inline with every response before handlers
+        self.response_listeners = []
+        # plain functions called with `idempotency_key` of every message once its frames are written
+        self.written_listeners = []
+        # plain functions called with `(idempotency_key, exception)` of messages which could not be written
+        self.write_error_listeners = []
+        
+        self.tracker = RequestTracker()
+        self.handler_dispatcher = handler_dispatcher or HandlerDispatcher()
+        self.downloader = downloader
+        self.tracer = tracer
+        self.recorder = recorder
+        if tracer is not None and self.handler_dispatcher.tracer is None:
+            self.handler_dispatcher.tracer = tracer
     
     def run(self, loop = None):
         if loop is None:
             loop = asyncio.get_event_loop()
-        loop.create_task(self.receiver_loop())
+        self.receiver = loop.create_task(self.receiver_loop())
+
+    async def close(self):
+        '''Stop reconnecting, close the connection and fail unfinished handles with `ConnectionError`'''
+        tasks = [task for task in (self.receiver, self.writer) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.connected = False
+        if self.websocket is not None:
+            await self.websocket.close()
+        self.tracker.fail_all(ConnectionError('Client is closed'))
+    
+    def shard_for(self, user_id: str):
+        '''Connection serving `user_id`, same interface as `GatewayPool`'''
+        return self
     
-    async def send_message(self, message: dict):
-        await self.websocket.send(json.dumps(message))
+    @property
+    def peer_binary_attachments(self) -> bool:
+        return self.binary_attachments and BINARY_ATTACHMENTS in self.peer_features
+    
+    async def wait_writable(self):
+        '''Wait until outbound queue has free space'''
+        if len(self.outbound) < self.max_outbound:
+            return
+        self.outbound_metrics.blocked_senders += 1
+        while len(self.outbound) >= self.max_outbound:
+            waiter = asyncio.get_running_loop().create_future()
+            self.outbound_waiters.append(waiter)
+            await waiter
+
+    def encode(self, message: dict) -> OutboundMessage:
+        key = message.get('idempotency_key')
+        message, attachments = extract_attachments(message, self.peer_binary_attachments)
+        tracer = self.tracer
+        started = time.perf_counter() if tracer is not None else 0.0
+        data = self.codec.encode(message)
+        if tracer is not None:
+            tracer.record(JSON_ENCODE, started, time.perf_counter(), {"bytes": len(data)})
+        return OutboundMessage(data, attachments, key, asyncio.get_running_loop().create_future())
+
+    async def send_message(self, message: dict, wait: bool = False):
+        '''Queue `message` for the writer task, waits while outbound queue is full.\n
+        `wait` - also wait until the message is written to the socket
+        '''
+        outbound = await self.enqueue(self.encode(message))
+        if wait:
+            await outbound.future
+
+    async def send_messages(self, messages: List[dict]) -> List[Union[Exception, None]]:
+        '''Queue all `messages` for the writer task, which writes them in
+        batches with a single drain. Returns the encoding error of every
+        message or None.
+        '''
+        errors = []
+        for message in messages:
+            try:
+                outbound = self.encode(message)
+            except Exception as e:
+                errors.append(e)
+                continue
+            await self.enqueue(outbound)
+            errors.append(None)
+        return errors
+
+    async def enqueue(self, outbound: OutboundMessage) -> OutboundMessage:
+        # resent request which is still waiting to be written is not queued twice
+        if outbound.key is not None:
+            queued = self.outbound_keys.get(outbound.key)
+            if queued is not None:
+                self.outbound_metrics.coalesced += 1
+                return queued
+        await self.wait_writable()
+        outbound.future.add_done_callback(_consume_exception)
+        self.outbound.append(outbound)
+        if outbound.key is not None:
+            self.outbound_keys[outbound.key] = outbound
+        self.outbound_metrics.on_enqueue(len(self.outbound))
+        self.wake_writer()
+        return outbound
+
+    def discard_outbound(self, keys: Iterable[str]) -> int:
+        '''Drop queued messages of `keys`, e.g. requests moved to another pool member.\n
+        Their futures fail with `ConnectionError` and write error listeners are
+        not called, a dropped message which is being written is skipped when
+        its batch is written again after reconnect. Returns dropped count.
+        '''
+        dropped = 0
+        for key in keys:
+            outbound = self.outbound_keys.pop(key, None)
+            if outbound is None:
+                continue
+            if not outbound.future.done():
+                outbound.future.set_exception(ConnectionError('Message was moved to another connection'))
+            dropped += 1
+        if dropped:
+            self.outbound = deque(outbound for outbound in self.outbound if not outbound.future.done())
+            self.outbound_metrics.depth = len(self.outbound)
+            self.finish([])
+        return dropped
+
+    def wake_writer(self):
+        if self.writer is None or self.writer.done():
+            self.writer = asyncio.get_running_loop().create_task(self.writer_loop())
+        self.writer_wakeup.set()
+
+    async def writer_loop(self):
+        '''Single task writing outbound queue, messages wait here while disconnected'''
+        while True:
+            if not self.outbound or not self.connected:
+                self.writer_wakeup.clear()
+                await self.writer_wakeup.wait()
+                continue
+            batch = [self.outbound.popleft() for _ in range(min(self.write_batch, len(self.outbound)))]
+            tracer = self.tracer
+            started = time.perf_counter() if tracer is not None else 0.0
+            try:
+                await self.write(batch)
+            except ConnectionClosed:
+                # written frames may be lost, the whole batch is written again after reconnect
+                self.outbound.extendleft(reversed(batch))
+                self.connected = False
+                continue
+            except OutboundWriteError as e:
+                await self.write_failed(batch, e)
+                continue
+            except Exception as e:
+                logging.error(f'Cannot write {len(batch)} messages [{type(e)}] {e}')
+                self.finish(batch)
+                self.fail_outbound(batch, e)
+                continue
+            if tracer is not None:
+                tracer.record(WEBSOCKET_SEND, started, time.perf_counter(), {"messages": len(batch)})
+            self.written(batch)
+
+    def written(self, batch: List[OutboundMessage]):
+        self.finish(batch)
+        self.outbound_metrics.on_written(batch, len(self.outbound))
+        listeners = self.written_listeners
+        for outbound in batch:
+            if not outbound.future.done():
+                outbound.future.set_result(None)
+                if outbound.key is not None:
+                    for listener in listeners:
+                        listener(outbound.key)
+
+    def fail_outbound(self, batch: List[OutboundMessage], exception: Exception):
+        '''Fail futures of `batch` and report its requests to `write_error_listeners`'''
+        for outbound in batch:
+            if not outbound.future.done():
+                outbound.future.set_exception(exception)
+            if outbound.key is not None:
+                for listener in self.write_error_listeners:
+                    listener(outbound.key, exception)
+
+    async def write_failed(self, batch: List[OutboundMessage], error: OutboundWriteError):
+        '''Messages before the failed one are written, the ones after it are queued again'''
+        logging.error(f'Cannot write message {error}')
+        failed = batch[error.index]
+        self.outbound.extendleft(reversed(batch[error.index + 1:]))
+        if error.index:
+            self.written(batch[:error.index])
+        self.finish([failed])
+        self.fail_outbound([failed], error.exception)
+        if error.partial:
+            # the generator waits for the rest of the failed message, the connection is unusable
+            self.connected = False
+            await self.websocket.close(1011, 'Message could not be written')
+
+    def finish(self, batch: List[OutboundMessage]):
+        for outbound in batch:
+            if outbound.key is not None and self.outbound_keys.get(outbound.key) is outbound:
+                del self.outbound_keys[outbound.key]
+        while self.outbound_waiters and len(self.outbound) < self.max_outbound:
+            waiter = self.outbound_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def write(self, batch: List[OutboundMessage]):
+        websocket = self.websocket
+        await websocket.ensure_open()
+        recorder = self.recorder
+        for index, outbound in enumerate(batch):
+            if outbound.future.done():
+                # dropped by `discard_outbound`
+                continue
+            partial = False
+            try:
+                if recorder is not None:
+                    recorder.record(OUTBOUND, outbound.data, not self.binary_frames)
+                    for attachment in outbound.attachments:
+                        if not isinstance(attachment, ImageSource):
+                            recorder.record(OUTBOUND, attachment)
+                # attachments follow their envelope without other frames in between
+                data = outbound.data
+                if isinstance(data, str):
+                    websocket.write_frame_sync(True, Opcode.TEXT, data.encode())
+                else:
+                    # utf-8 json of a binary codec is a valid text frame payload as is
+                    websocket.write_frame_sync(True, Opcode.BINARY if self.binary_frames else Opcode.TEXT, data)
+                partial = bool(outbound.attachments)
+                for attachment in outbound.attachments:
+                    if isinstance(attachment, ImageSource):
+                        # streamed images drain per chunk
+                        await self.send_attachment(attachment)
+                    else:
+                        websocket.write_frame_sync(True, Opcode.BINARY, attachment)
+            except ConnectionClosed:
+                raise
+            except Exception as e:
+                raise OutboundWriteError(index, e, partial) from e
+        await websocket.drain()
+
+    async def send_attachment(self, attachment: Attachment):
+        if isinstance(attachment, ImageSource):
+            # streamed as a fragmented message, one chunk in memory at a time
+            if attachment.size() == 0:
+                attachment = b''
+            else:
+                attachment = attachment.chunks()
+        await self.websocket.send(attachment)
             
     async def connect(self):
+        attempt = 0
+        if self.metrics.disconnected_at is not None:
+            await asyncio.sleep(self.reconnect_policy.delay(attempt))
+            attempt += 1
         while not self.connected:
             try:
-                self.websocket = await connect(self.endpoint, extra_headers=\
-                            {'authorization': self.token, 'service': self.service.value})
+                headers = {'authorization': self.token, 'service': self.service.value}
+                if self.binary_attachments:
+                    headers['features'] = BINARY_ATTACHMENTS
+                self.websocket = await connect(self.endpoint, extra_headers=headers)
+                self.peer_features = parse_features(self.websocket.response_headers.get('features'))
                 self.connected = True
+                self.metrics.on_connect()
+                return
             except ConnectionRefusedError as e:
                 logging.error(e)
-                await asyncio.sleep(5)
             except InvalidStatusCode as e:
-                logging.error('Service or token is not valid')
-                exit()
+                logging.error(f'Service or token is not valid [{e}]')
             except Exception as e:
-                logging.error(type(e))
-                await asyncio.sleep(5)
-        return
+                logging.error(f'Cannot connect [{type(e)}] {e}')
+            self.metrics.on_attempt_failed()
+            await asyncio.sleep(self.reconnect_policy.delay(attempt))
+            attempt += 1
     
+    def on_response(self, response: GenerationResponse):
+        '''Release request of `response`, resolve its handle and queue its handlers'''
+        for listener in self.response_listeners:
+            listener(response)
+        if self.downloader is not None and self.downloader.accepts(response):
+            # handle and handlers get the response once its result is fetched
+            self.downloader.schedule(response, self.deliver)
+        else:
+            self.deliver(response)
+
+    def deliver(self, response: GenerationResponse):
+        self.tracker.on_response(response)
+        if response.gen_status == GenStatus.OK:
+            handlers = self.req_done_handlers
+        elif response.gen_status == GenStatus.ERROR:
+            handlers = self.req_error_handlers
+        elif response.gen_status == GenStatus.QUEUED:
+            handlers = self.req_queued_handlers
+        elif response.gen_status == GenStatus.GENERATING:
+            handlers = self.req_generating_handlers
+        else:
+            return
+        for handler in handlers:
+            self.handler_dispatcher.dispatch(handler, response)
+
+    def receive_traced(self, tracer: Tracer, raw_message: Union[str, bytes]):
+        '''Same as the untraced receive path with every stage recorded'''
+        started = time.perf_counter()
+        json_message = self.codec.decode(raw_message)
+        tracer.record(JSON_DECODE, started, time.perf_counter(), {"bytes": len(raw_message)})
+        if MessageType(json_message.get('message_type')) != MessageType.RESPONSE:
+            return
+        started = time.perf_counter()
+        response = GenerationResponse(json_message, self.lazy_responses)
+        tracer.record(RESPONSE_BUILD, started, time.perf_counter())
+        started = time.perf_counter()
+        self.on_response(response)
+        tracer.record(RESPONSE_DISPATCH, started, time.perf_counter(), {"gen_status": response.gen_status.value})
+
+    async def receive_frames(self, frames: AsyncIterable[Union[str, bytes]]):
+        '''Decode and dispatch `frames` of the connection or of a `TrafficReplay`'''
+        async for raw_message in frames:
+            # stop reading while handlers are behind
+            await self.handler_dispatcher.wait_capacity()
+            if self.recorder is not None:
+                self.recorder.record(INBOUND, raw_message)
+            if self.tracer is not None:
+                self.receive_traced(self.tracer, raw_message)
+                continue
+            json_message = self.codec.decode(raw_message)
+            message_type = MessageType(json_message.get('message_type'))
+            if message_type == MessageType.RESPONSE:
+                self.on_response(GenerationResponse(json_message, self.lazy_responses))
+
     async def receiver_loop(self):
         while True:
             await self.connect()
             logging.info('Connection established!')
+            self.wake_writer()
+            for handler in self.connected_handlers:
+                await handler(self)
+            error = None
             try:
-                async for raw_message in self.websocket:
-                    json_message = json.loads(raw_message)
-                    message_type = MessageType(json_message.get('message_type'))
-                    if message_type == MessageType.RESPONSE:
-                        loop = asyncio.get_running_loop()
-                        response = GenerationResponse(json_message)
-                        if response.gen_status == GenStatus.OK:
-                            for handler in self.req_done_handlers:
-                                loop.create_task(handler(response))
-                        elif response.gen_status == GenStatus.ERROR:
-                            for handler in self.req_error_handlers:
-                                loop.create_task(handler(response))
-                        elif response.gen_status == GenStatus.QUEUED:
-                            for handler in self.req_queued_handlers:
-                                loop.create_task(handler(response))
-                        elif response.gen_status == GenStatus.GENERATING:
-                            for handler in self.req_generating_handlers:
-                                loop.create_task(handler(response))
+                await self.receive_frames(self.websocket)
+                # closed normally, e.g. by a generator restart
+                error = ConnectionError(f'Connection closed by generator with code {self.websocket.close_code}')
             except Exception as e:
                 logging.error(f'[{type(e)}] {e}')
-                for handler in self.con_error_handlers:
-                    await handler(e)
+                error = e
             finally:
                 self.connected = False
-            logging.warning('Connection lost, trying to reconnect')
-            await asyncio.sleep(2)
\ No newline at end of file
+                self.metrics.on_disconnect()
+                # in-flight requests are interrupted by every disconnect, not only by errors
+                if error is not None:
+                    for handler in self.con_error_handlers:
+                        await handler(error)
+            logging.warning('Connection lost, trying to reconnect')
\ No newline at end of file
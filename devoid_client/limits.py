@@ -0,0 +1,40 @@
+import time
+
+class TokenBucket():
+    '''Token bucket rate limiter.\n
+    `rate` - tokens added per second, `burst` - bucket capacity
+    '''
+    __slots__ = ('rate', 'burst', 'tokens', 'updated_at')
+    rate: float
+    burst: float
+    tokens: float
+    updated_at: float
+
+    def __init__(self, rate: float, burst: float = None) -> None:
+        if rate <= 0:
+            raise ValueError(f'rate must be positive, got {rate}')
+        self.rate = rate
+        self.burst = max(1.0, rate if burst is None else burst)
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float = None):
+        if now is None:
+            now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self, now: float = None) -> float:
+        '''Seconds until a token is available, 0 if there is one already'''
+        self.refill(now)
+        if self.tokens >= 1.0:
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+    def consume(self, now: float = None) -> float:
+        '''Take a token, returns 0 on success or seconds until a token is available'''
+        self.refill(now)
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
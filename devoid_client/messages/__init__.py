@@ -1 +1,2 @@
-from .message import GenerationRequest, GenerationResponse
\ No newline at end of file
+from .message import GenerationRequest, GenerationResponse
+from .template import RequestTemplate, TemplateRequest
\ No newline at end of file
@@ -5,19 +5,26 @@ from typing import Dict, Union
 from ..enums import *
 
 class Result():
+    '''`data`, `path` - local copy of `IMAGE_URL` result fetched by `ResultDownloader`'''
+    __slots__ = ('content_type', 'content', 'file_name', 'data', 'path')
     content_type: ContentType
     content: str
     file_name: str
+    data: Union[bytes, None]
+    path: Union[str, None]
     
     def __init__(
             self, 
             content_type: ContentType, 
             content: str,
-            file_name: str
+            file_name: str,
+            path: str = None
         ) -> None:
         self.content_type = content_type
         self.content = content
         self.file_name = file_name
+        self.data = None
+        self.path = path
         
     @classmethod
     def from_dict(
@@ -29,15 +36,21 @@ class Result():
         content_type = data.get('content_type')
         content = data.get('content')
         file_name = data.get('file_name')
-        return Result(content_type, content, file_name)
+        return Result(content_type, content, file_name, data.get('path'))
     
     def as_dict(self):
-        return {
-            "content_type": self.content_type.value,
-            "content": self.content
+        data = {
+            "content_type": getattr(self.content_type, 'value', self.content_type),
+            "content": self.content,
+            "file_name": self.file_name
         }
+        # downloaded bytes stay in memory only
+        if self.path is not None:
+            data["path"] = self.path
+        return data
 
 class Settings():
+    __slots__ = ('premium', 'moderate', 'sync_with_s3')
     premium: bool
     moderate: bool
     sync_with_s3: bool
@@ -71,15 +84,37 @@ class Settings():
             "sync_with_s3": self.sync_with_s3
         }
 
+_SERVICE_INFO_FIELDS = ('user_id', 'chat_id', 'message_id', 'request_id')
+
 class ServiceInfo():
+    __slots__ = ('user_id', 'chat_id', 'message_id', 'request_id', 'extra')
     user_id: str
+    chat_id: int
+    message_id: int
+    request_id: str
+    extra: Union[Dict, None]
 
     def __init__(self, **kwargs) -> None:
-        '''`user_id` is required field!'''
+        '''`user_id` is required field!\n
+        Fields other than the slotted ones are kept in `extra`
+        and are still readable as attributes
+        '''
         if kwargs.get('user_id') is None:
             raise ValueError("Invalid args: user_id is required field")
+        self.extra = None
         for key, value in kwargs.items():
-            setattr(self, key, value)
+            if key in _SERVICE_INFO_FIELDS:
+                setattr(self, key, value)
+            else:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[key] = value
+    
+    def __getattr__(self, name: str):
+        # only called for unset slots and names kept in `extra`
+        if name != 'extra' and self.extra is not None and name in self.extra:
+            return self.extra[name]
+        raise AttributeError(f"'ServiceInfo' object has no attribute '{name}'")
     
     @classmethod
     def from_dict(
@@ -89,9 +124,16 @@ class ServiceInfo():
         return ServiceInfo(**data)
         
     def as_dict(self) -> Dict:
-        return self.__dict__
+        data = {}
+        for key in _SERVICE_INFO_FIELDS:
+            if hasattr(self, key):
+                data[key] = getattr(self, key)
+        if self.extra is not None:
+            data.update(self.extra)
+        return data
 
 class ResponsePayload():
+    __slots__ = ('prompt', 'steps', 'cfg_scale', 'width', 'height', 'seed')
     prompt: str
     steps: int
     cfg_scale: int
@@ -140,18 +182,20 @@ class ResponsePayload():
         }
 
 class KandinskyPayload():
+    __slots__ = ('images_texts', 'weights', 'prompt', 'steps', 'guidance_scale', 'height', 'width',
+                 'sampler', 'prior_cf_scale', 'prior_steps', 'negative_prior_prompt', 'negative_decoder_prompt')
     images_texts: list  # MIX2IMG
     weights: list       # MIX2IMG
     prompt: str         # TEXT2IMG
-    steps: int = 30,
-    guidance_scale: int = 4, #(1 - Prompt игнорируется; 30 - Четко следовать запросу)
-    height = 512,
-    width = 512,
-    sampler = 'p_sampler',
-    prior_cf_scale = 4,
-    prior_steps = '5',
-    negative_prior_prompt = '',
-    negative_decoder_prompt = ''
+    steps: int
+    guidance_scale: int #(1 - Prompt игнорируется; 30 - Четко следовать запросу)
+    height: int
+    width: int
+    sampler: str
+    prior_cf_scale: int
+    prior_steps: str
+    negative_prior_prompt: str
+    negative_decoder_prompt: str
 
     def __init__(
             self,
@@ -233,11 +277,19 @@ class KandinskyPayload():
             self.negative_prior_prompt = ''
         if self.negative_decoder_prompt is None:
             self.negative_decoder_prompt = ''
+
+    @property
+    def cost(self) -> int:
+        '''Estimated generation cost, steps × width × height'''
+        return (self.steps or 0) * (self.width or 0) * (self.height or 0)
     
     def as_dict(self):
-        return self.__dict__
+        return {key: getattr(self, key) for key in self.__slots__}
 
 class Automatic1111Payload():
+    __slots__ = ('prompt', 'init_images', 'steps', 'cfg_scale', 'sampler_index', 'width', 'height', 'seed',
+                 'hr_scale', 'hr_upscaler', 'hr_second_pass_steps', 'hr_resize_x', 'hr_resize_y',
+                 'denoising_strength', 'negative_prompt')
     prompt: str
     init_images: list
     steps: int
@@ -345,6 +397,15 @@ class Automatic1111Payload():
             self.denoising_strength = 0.7
         if self.negative_prompt is None:
             self.negative_prompt = "child, childish"
+
+    @property
+    def cost(self) -> int:
+        '''Estimated generation cost, steps × width × height plus the hires pass'''
+        cost = (self.steps or 0) * (self.width or 0) * (self.height or 0)
+        if self.hr_scale is not None and self.hr_scale > 1:
+            steps = self.hr_second_pass_steps or self.steps or 0
+            cost += steps * (self.hr_resize_x or 0) * (self.hr_resize_y or 0)
+        return cost
             
     def as_dict(self):
-        return self.__dict__
\ No newline at end of file
+        return {key: getattr(self, key) for key in self.__slots__}
\ No newline at end of file
@@ -3,7 +3,17 @@ from typing import Dict, Union
 from .components import *
 from ..enums import *
 
+def check_executor(gen_type: GenType, executor: Executor):
+    '''Raise ValueError if `executor` cannot process `gen_type` requests'''
+    if not isinstance(executor, Executor):
+        raise ValueError(f'Unknown type of executor "{executor}"')
+    if gen_type == GenType.IMG2IMG and executor == Executor.KANDINSKY:
+        raise ValueError(f'Executor {executor.value} cannot process img2img')
+    if gen_type == GenType.MIX2IMG and executor != Executor.KANDINSKY:
+        raise ValueError(f'Executor {executor.value} cannot process mix2img')
+
 class GenerationRequest():
+    __slots__ = ('message_type', 'executor', 'gen_type', 'settings', 'service_info', 'payload')
     message_type: MessageType
     executor: Executor
     gen_type: GenType
@@ -32,8 +42,12 @@ class GenerationRequest():
         elif self.executor == Executor.KANDINSKY:
             self.payload = KandinskyPayload.from_dict(payload)
     
+    @property
+    def request_id(self) -> Union[str, None]:
+        return getattr(self.service_info, 'request_id', None)
+    
     def as_dict(self):
-        return {
+        data = {
             "message_type": self.message_type.value,
             "executor": self.executor.value,
             "gen_type": self.gen_type.value,
@@ -41,8 +55,17 @@ class GenerationRequest():
             "service_info": self.service_info.as_dict(),
             "payload": self.payload.as_dict()
         }
+        request_id = self.request_id
+        if request_id is not None:
+            # lets generator deduplicate requests resent after reconnect
+            data["idempotency_key"] = request_id
+        return data
+
+_NOT_DECODED = object()
 
 class GenerationResponse():
+    __slots__ = ('object_id', 'message_type', 'executor', 'gen_type', 'gen_status', 'avg_time',
+                 '_data', '_result', '_settings', '_service_info', '_payload')
     object_id: str
     message_type: str
     executor: Executor
@@ -57,7 +80,10 @@ class GenerationResponse():
     service_info: ServiceInfo
     payload: Union[Automatic1111Payload, KandinskyPayload, None]
     
-    def __init__(self, data: dict):
+    def __init__(self, data: dict, lazy: bool = False):
+        '''`lazy` - decode only header fields, `result`, `settings`,
+        `service_info` and `payload` are built on first access
+        '''
         self.object_id = data.get('object_id')
         self.message_type = data.get('message_type')
         self.executor = Executor(data.get('executor'))
@@ -65,30 +91,122 @@ class GenerationResponse():
         self.gen_status = GenStatus(data.get('gen_status'))
         self.avg_time = data.get('avg_time')
         
-        self.result = None
-        self.settings = None
-        self.service_info = None
-        self.payload = None
-        
-        # result
-        data_ = data.get('result')
-        if not data_ is None:
-            self.result = Result.from_dict(data_)
-        # settings
-        data_ = data.get('settings')
-        if not data_ is None:
-            self.settings = Settings.from_dict(data_)
-        # service info
-        data_ = data.get('service_info')
-        if not data_ is None:
-            self.service_info = ServiceInfo.from_dict(data_)
-        # payload
-        data_ = data.get('payload')
-        if not data_ is None:
-            if self.executor == Executor.AUTOMATIC1111:
-                self.payload = Automatic1111Payload.from_dict(data_, True)
-            elif self.executor == Executor.KANDINSKY:
-                self.payload = KandinskyPayload.from_dict(data_, True)
+        self._data = data
+        self._result = _NOT_DECODED
+        self._settings = _NOT_DECODED
+        self._service_info = _NOT_DECODED
+        self._payload = _NOT_DECODED
+        if not lazy:
+            self.decode()
+    
+    def decode(self):
+        '''Build all not yet decoded sub-objects and release raw message'''
+        if self._data is None:
+            return
+        self.result
+        self.settings
+        self.service_info
+        self.payload
+        self._data = None
+    
+    @property
+    def result(self) -> Union[Result, None]:
+        if self._result is _NOT_DECODED:
+            data_ = self._data.get('result')
+            self._result = None if data_ is None else Result.from_dict(data_)
+        return self._result
+    
+    @result.setter
+    def result(self, value: Union[Result, None]):
+        self._result = value
+    
+    @property
+    def settings(self) -> Union[Settings, None]:
+        if self._settings is _NOT_DECODED:
+            data_ = self._data.get('settings')
+            self._settings = None if data_ is None else Settings.from_dict(data_)
+        return self._settings
+    
+    @settings.setter
+    def settings(self, value: Union[Settings, None]):
+        self._settings = value
+    
+    @property
+    def service_info(self) -> Union[ServiceInfo, None]:
+        if self._service_info is _NOT_DECODED:
+            data_ = self._data.get('service_info')
+            self._service_info = None if data_ is None else ServiceInfo.from_dict(data_)
+        return self._service_info
+    
+    @service_info.setter
+    def service_info(self, value: Union[ServiceInfo, None]):
+        self._service_info = value
+    
+    @property
+    def payload(self) -> Union[Automatic1111Payload, KandinskyPayload, None]:
+        if self._payload is _NOT_DECODED:
+            self._payload = None
+            data_ = self._data.get('payload')
+            if not data_ is None:
+                if self.executor == Executor.AUTOMATIC1111:
+                    self._payload = Automatic1111Payload.from_dict(data_, True)
+                elif self.executor == Executor.KANDINSKY:
+                    self._payload = KandinskyPayload.from_dict(data_, True)
+        return self._payload
+    
+    @payload.setter
+    def payload(self, value: Union[Automatic1111Payload, KandinskyPayload, None]):
+        self._payload = value
+    
+    def _service_info_field(self, name: str):
+        if self._service_info is _NOT_DECODED:
+            data_ = self._data.get('service_info')
+            return None if data_ is None else data_.get(name)
+        return getattr(self._service_info, name, None)
+    
+    @property
+    def user_id(self) -> Union[str, None]:
+        '''`service_info.user_id` without decoding `service_info`'''
+        return self._service_info_field('user_id')
+    
+    @property
+    def request_id(self) -> Union[str, None]:
+        '''Client generated id echoed back by generator in `service_info`'''
+        return self._service_info_field('request_id')
         
+    def _part_as_dict(self, name: str):
+        value = getattr(self, '_' + name)
+        if value is _NOT_DECODED:
+            return self._data.get(name)
+        return None if value is None else value.as_dict()
+
+    def as_dict(self) -> Dict:
+        '''Response message, not decoded parts are copied from the raw message'''
+        return {
+            "object_id": self.object_id,
+            "message_type": self.message_type,
+            "executor": self.executor.value,
+            "gen_type": self.gen_type.value,
+            "gen_status": self.gen_status.value,
+            "avg_time": self.avg_time,
+            "result": self._part_as_dict('result'),
+            "settings": self._part_as_dict('settings'),
+            "service_info": self._part_as_dict('service_info'),
+            "payload": self._part_as_dict('payload')
+        }
+
+    def __reduce__(self):
+        # pickled as the plain message, e.g. for handlers in a process pool,
+        # the copy decodes its parts lazily again, downloaded `result.data` is passed along
+        result = self._result
+        data = None if result is _NOT_DECODED or result is None else result.data
+        return (_unpickle_response, (self.as_dict(), data))
+
     def __str__(self) -> str:
-        return f"GenerationResponse({self.object_id}: {self.gen_type.value})"
\ No newline at end of file
+        return f"GenerationResponse({self.object_id}: {self.gen_type.value})"
+
+def _unpickle_response(message: Dict, data: Union[bytes, None]) -> GenerationResponse:
+    response = GenerationResponse(message, True)
+    if data is not None:
+        response.result.data = data
+    return response
@@ -0,0 +1,117 @@
+import random
+
+from typing import Dict, Union
+
+from .components import *
+from .message import GenerationRequest, check_executor
+from ..enums import *
+
+_PAYLOAD_TYPES = {
+    Executor.AUTOMATIC1111: Automatic1111Payload,
+    Executor.KANDINSKY: KandinskyPayload
+}
+
+class RequestTemplate():
+    '''Fixed part of repeated requests, validated and serialized once.\n
+    `payload` is completed with defaults when the template is created, its
+    settings and payload dicts are then shared by every request built with
+    `request`, which only fills in per-call payload fields such as `prompt`
+    and `seed`. Per-call fields are sent as given, only a missing or None
+    Automatic1111 `seed` is replaced with a random one per request.
+    '''
+    __slots__ = ('gen_type', 'executor', 'settings', 'settings_dict', 'base_payload', 'fields', 'random_seed')
+    gen_type: GenType
+    executor: Executor
+    settings: Settings
+    settings_dict: Dict
+    base_payload: Dict
+    fields: frozenset
+    random_seed: bool
+
+    def __init__(
+            self,
+            gen_type: GenType,
+            executor: Executor,
+            premium: bool,
+            moderate: bool,
+            sync_with_s3: bool,
+            payload: dict
+        ) -> None:
+        gen_type = GenType(gen_type)
+        check_executor(gen_type, executor)
+        self.gen_type = gen_type
+        self.executor = executor
+        self.settings = Settings(premium, moderate, sync_with_s3)
+        self.settings_dict = self.settings.as_dict()
+        payload_type = _PAYLOAD_TYPES[executor]
+        self.base_payload = payload_type.from_dict(payload).as_dict()
+        self.fields = frozenset(payload_type.__slots__)
+        self.random_seed = executor == Executor.AUTOMATIC1111 and payload.get('seed') is None
+        if self.random_seed:
+            # drawn per request, not once for the template
+            self.base_payload['seed'] = None
+
+    def request(self, service_info: ServiceInfo, **fields) -> 'TemplateRequest':
+        '''Request of the template with `fields` of the payload replaced'''
+        if not self.fields.issuperset(fields):
+            unknown = ', '.join(sorted(set(fields) - self.fields))
+            raise ValueError(f'Unknown payload fields of {self.executor.value}: {unknown}')
+        random_seed = False
+        if self.executor == Executor.AUTOMATIC1111 and fields.get('seed', self.base_payload['seed']) is None:
+            fields['seed'] = random.randint(42, 4294967295)
+            random_seed = True
+        return TemplateRequest(self, service_info, fields, random_seed)
+
+class TemplateRequest(GenerationRequest):
+    '''`GenerationRequest` of a `RequestTemplate`, serialized from the template dicts.\n
+    `payload` object is only built when accessed, e.g. by cost based scheduling.
+    `settings` is shared with the template and other requests of it.
+    '''
+    __slots__ = ('template', 'fields', 'random_seed', '_payload')
+    template: RequestTemplate
+    fields: Dict
+    random_seed: bool
+
+    def __init__(
+            self,
+            template: RequestTemplate,
+            service_info: ServiceInfo,
+            fields: Dict,
+            random_seed: bool = False
+        ) -> None:
+        self.message_type = MessageType.REQUEST
+        self.executor = template.executor
+        self.gen_type = template.gen_type
+        self.settings = template.settings
+        self.service_info = service_info
+        self.template = template
+        self.fields = fields
+        self.random_seed = random_seed
+        self._payload = None
+
+    @property
+    def payload(self) -> Union[Automatic1111Payload, KandinskyPayload]:
+        if self._payload is None:
+            self._payload = _PAYLOAD_TYPES[self.executor].from_dict(self.payload_dict(), True)
+        return self._payload
+
+    def payload_dict(self) -> Dict:
+        # copied, attachments replace image lists of the sent payload
+        payload = self.template.base_payload.copy()
+        payload.update(self.fields)
+        return payload
+
+    def as_dict(self):
+        service_info = self.service_info
+        data = {
+            "message_type": self.message_type.value,
+            "executor": self.executor.value,
+            "gen_type": self.gen_type.value,
+            "settings": self.template.settings_dict,
+            "service_info": service_info.as_dict(),
+            "payload": self.payload_dict()
+        }
+        request_id = getattr(service_info, 'request_id', None)
+        if request_id is not None:
+            data["idempotency_key"] = request_id
+        return data
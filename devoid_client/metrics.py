@@ -0,0 +1,256 @@
+import time
+import asyncio
+import logging
+
+from bisect import bisect_left
+from typing import Callable, Dict, List, Tuple, Union
+
+from .enums import *
+from .messages import GenerationRequest, GenerationResponse
+
+# seconds, from a local queue hop to a long generator queue
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+class Histogram():
+    '''Counts of observed values per bucket, `bounds` are bucket upper bounds'''
+    __slots__ = ('bounds', 'counts', 'count', 'sum')
+    bounds: Tuple[float, ...]
+    counts: List[int]
+    count: int
+    sum: float
+
+    def __init__(self, bounds: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.bounds = bounds
+        # last one counts values over the highest bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> Union[float, None]:
+        '''Estimated `q` quantile, interpolated linearly inside its bucket'''
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                if index == len(self.bounds):
+                    return self.bounds[-1]
+                lower = 0.0 if index == 0 else self.bounds[index - 1]
+                return lower + (self.bounds[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.bounds[-1]
+
+    def as_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "avg": self.sum / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99)
+        }
+
+class RequestTimeline():
+    '''Monotonic timestamps of a single request, None until reached'''
+    __slots__ = ('executor', 'gen_type', 'submitted', 'queued', 'sent', 'accepted', 'generating', 'avg_time')
+    executor: str
+    gen_type: str
+    submitted: float
+    queued: Union[float, None]
+    sent: Union[float, None]
+    accepted: Union[float, None]
+    generating: Union[float, None]
+    avg_time: Union[float, None]
+
+    def __init__(self, request: GenerationRequest) -> None:
+        self.executor = request.executor.value
+        self.gen_type = request.gen_type.value
+        self.submitted = time.monotonic()
+        self.queued = None
+        self.sent = None
+        self.accepted = None
+        self.generating = None
+        self.avg_time = None
+
+class LifecycleMetrics():
+    '''Request lifecycle timing aggregated per executor and gen type.\n
+    Stages of every finished request are observed in histograms:
+    `admission` (submit to client queue), `client_queue` (to being sent),
+    `server_ack` (to QUEUED), `server_queue` (to GENERATING), `generation`
+    (to OK or ERROR) and `total`. `estimate_error` is the absolute
+    difference between `avg_time` of the QUEUED response and the actual
+    time from QUEUED to the terminal response.\n
+    Requests answered from cache are not sent and not timed.
+    '''
+    timelines: Dict[str, RequestTimeline]
+    histograms: Dict[Tuple[str, str, str], Histogram]
+    outcomes: Dict[Tuple[str, str, str], int]
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.timelines = dict()
+        self.histograms = dict()
+        self.outcomes = dict()
+
+    def __len__(self) -> int:
+        return len(self.timelines)
+
+    def on_submit(self, handle):
+        '''Start timing request of `handle`, it is forgotten once the handle is resolved'''
+        self.timelines[handle.request_id] = RequestTimeline(handle.request)
+        handle.add_done_callback(self.on_handle_done)
+
+    def on_queued(self, request_id: str):
+        timeline = self.timelines.get(request_id)
+        if timeline is not None:
+            timeline.queued = time.monotonic()
+
+    def on_sent(self, request_id: str):
+        '''Written listener, called once all frames of the request are written'''
+        # resent requests are timed from the last send
+        timeline = self.timelines.get(request_id)
+        if timeline is not None:
+            timeline.sent = time.monotonic()
+
+    def on_response(self, response: GenerationResponse):
+        '''Response listener recording status transitions'''
+        request_id = response.request_id
+        if request_id is None:
+            return
+        timeline = self.timelines.get(request_id)
+        if timeline is None:
+            return
+        now = time.monotonic()
+        gen_status = response.gen_status
+        if gen_status == GenStatus.QUEUED:
+            timeline.accepted = now
+            timeline.avg_time = response.avg_time
+        elif gen_status == GenStatus.GENERATING:
+            timeline.generating = now
+        elif gen_status in (GenStatus.OK, GenStatus.ERROR):
+            del self.timelines[request_id]
+            self.finish(timeline, gen_status.value, now)
+
+    def on_handle_done(self, handle):
+        # still timed only if the request failed or was cancelled before a terminal response
+        timeline = self.timelines.pop(handle.request_id, None)
+        if timeline is not None:
+            self.count(timeline, 'failed')
+
+    def finish(self, timeline: RequestTimeline, outcome: str, now: float):
+        self.count(timeline, outcome)
+        self.observe(timeline, 'admission', timeline.submitted, timeline.queued)
+        self.observe(timeline, 'client_queue', timeline.queued, timeline.sent)
+        self.observe(timeline, 'server_ack', timeline.sent, timeline.accepted)
+        self.observe(timeline, 'server_queue', timeline.accepted, timeline.generating)
+        self.observe(timeline, 'generation', timeline.generating, now)
+        self.observe(timeline, 'total', timeline.submitted, now)
+        if timeline.accepted is not None and timeline.avg_time is not None:
+            self.histogram(timeline, 'estimate_error').observe(abs(now - timeline.accepted - timeline.avg_time))
+
+    def observe(self, timeline: RequestTimeline, stage: str, start: Union[float, None], end: Union[float, None]):
+        if start is not None and end is not None:
+            self.histogram(timeline, stage).observe(end - start)
+
+    def histogram(self, timeline: RequestTimeline, stage: str) -> Histogram:
+        key = (stage, timeline.executor, timeline.gen_type)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(self.buckets)
+        return histogram
+
+    def count(self, timeline: RequestTimeline, outcome: str):
+        key = (timeline.executor, timeline.gen_type, outcome)
+        self.outcomes[key] = self.outcomes.get(key, 0) + 1
+
+    def as_dict(self) -> Dict:
+        '''`{stage: {"executor/gen_type": histogram}}` with request outcomes and timed requests'''
+        stages = {}
+        for (stage, executor, gen_type), histogram in self.histograms.items():
+            stages.setdefault(stage, {})[f'{executor}/{gen_type}'] = histogram.as_dict()
+        outcomes = {}
+        for (executor, gen_type, outcome), count in self.outcomes.items():
+            outcomes.setdefault(f'{executor}/{gen_type}', {})[outcome] = count
+        return {
+            "timed": len(self.timelines),
+            "outcomes": outcomes,
+            "stages": stages
+        }
+
+def _labels(**labels) -> str:
+    return ','.join(f'{name}="{value}"' for name, value in labels.items())
+
+def _number(value) -> Union[float, None]:
+    if isinstance(value, bool):
+        return float(value)
+    if isinstance(value, (int, float)):
+        return value
+    return None
+
+def prometheus_text(lifecycle: LifecycleMetrics, gauges: Dict[str, Dict], prefix: str = 'devoid') -> str:
+    '''Prometheus text exposition of `lifecycle` histograms and `gauges`.\n
+    `gauges` - `{section: {name: value}}` or `{section: [{name: value}, ...]}`
+    for several connections, values which are not numbers are skipped
+    '''
+    lines = [
+        f'# HELP {prefix}_request_stage_seconds Time spent in request lifecycle stages',
+        f'# TYPE {prefix}_request_stage_seconds histogram'
+    ]
+    for (stage, executor, gen_type), histogram in sorted(lifecycle.histograms.items()):
+        labels = _labels(stage=stage, executor=executor, gen_type=gen_type)
+        cumulative = 0
+        for bound, count in zip(histogram.bounds, histogram.counts):
+            cumulative += count
+            lines.append(f'{prefix}_request_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{prefix}_request_stage_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+        lines.append(f'{prefix}_request_stage_seconds_sum{{{labels}}} {histogram.sum}')
+        lines.append(f'{prefix}_request_stage_seconds_count{{{labels}}} {histogram.count}')
+    lines.append(f'# HELP {prefix}_requests_total Finished requests by outcome')
+    lines.append(f'# TYPE {prefix}_requests_total counter')
+    for (executor, gen_type, outcome), count in sorted(lifecycle.outcomes.items()):
+        lines.append(f'{prefix}_requests_total{{{_labels(executor=executor, gen_type=gen_type, outcome=outcome)}}} {count}')
+    for section, values in gauges.items():
+        members = values if isinstance(values, list) else [values]
+        for index, member in enumerate(members):
+            labels = f'{{{_labels(connection=index)}}}' if isinstance(values, list) else ''
+            for name, value in member.items():
+                value = _number(value)
+                if value is not None:
+                    lines.append(f'{prefix}_{section}_{name}{labels} {value}')
+    return '\n'.join(lines) + '\n'
+
+async def start_metrics_server(
+        render: Callable[[], str],
+        host: str = '127.0.0.1',
+        port: int = 9100
+    ) -> asyncio.AbstractServer:
+    '''Serve `render()` text on `GET /metrics` for Prometheus scraping'''
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            # headers are not used
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] in ('/', '/metrics'):
+                status, body = '200 OK', render().encode()
+            else:
+                status, body = '404 Not Found', b'not found\n'
+            writer.write((f'HTTP/1.1 {status}\r\n'
+                          f'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                          f'Content-Length: {len(body)}\r\n'
+                          f'Connection: close\r\n\r\n').encode() + body)
+            await writer.drain()
+        except Exception as e:
+            logging.warning(f'Cannot serve metrics [{type(e)}] {e}')
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -0,0 +1,142 @@
+import asyncio
+import hashlib
+import logging
+
+from bisect import bisect
+from functools import partial
+from typing import Dict, List, Tuple
+
+from .enums import *
+from .gateway import GeneratorWebSocket
+from .tracker import RequestTracker
+from .reconnect import ConnectionMetrics
+from .writer import OutboundMetrics
+from .dispatch import HandlerDispatcher
+
+class ShardConnectionError(ConnectionError):
+    '''Connection error of a single pool member.\n
+    `shard` - failed `GeneratorWebSocket`, `exception` - original error
+    '''
+    def __init__(self, shard: GeneratorWebSocket, exception: Exception) -> None:
+        super().__init__(f'{shard.endpoint} [{type(exception).__name__}] {exception}')
+        self.shard = shard
+        self.exception = exception
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+class GatewayPool():
+    '''Pool of `size` generator websockets sharing one set of handlers.\n
+    Users are assigned to connections by consistent hashing of `user_id`,
+    so all requests of a user go through the same connection. While a
+    connection is down its users are served by the next connection on
+    the hash ring, other users keep their connections.
+    '''
+    members: List[GeneratorWebSocket]
+    req_done_handlers: List
+    req_error_handlers: List
+    req_queued_handlers: List
+    req_generating_handlers: List
+
+    def __init__(
+            self,
+            endpoint: str,
+            service: Service,
+            token: str,
+            size: int,
+            replicas: int = 64,
+            **gateway_kwargs
+        ) -> None:
+        '''`replicas` - points of each connection on the hash ring\n
+        `gateway_kwargs` - passed to every `GeneratorWebSocket`
+        '''
+        if size < 1:
+            raise ValueError(f'Pool size must be positive, got {size}')
+        self.req_done_handlers = []
+        self.req_error_handlers = []
+        self.req_queued_handlers = []
+        self.req_generating_handlers = []
+
+        self.con_error_handlers = []
+        self.connected_handlers = []
+
+        self.response_listeners = []
+        self.written_listeners = []
+        self.write_error_listeners = []
+        self.tracker = RequestTracker()
+        self.handler_dispatcher = gateway_kwargs.pop('handler_dispatcher', None) or HandlerDispatcher()
+        self.downloader = gateway_kwargs.get('downloader')
+        self.tracer = gateway_kwargs.get('tracer')
+        self.recorder = gateway_kwargs.get('recorder')
+        self.members = []
+        for _ in range(size):
+            member = GeneratorWebSocket(endpoint, service, token,
+                                        handler_dispatcher=self.handler_dispatcher, **gateway_kwargs)
+            member.req_done_handlers = self.req_done_handlers
+            member.req_error_handlers = self.req_error_handlers
+            member.req_queued_handlers = self.req_queued_handlers
+            member.req_generating_handlers = self.req_generating_handlers
+            member.con_error_handlers = [partial(self.shard_error_handler, member)]
+            member.connected_handlers = self.connected_handlers
+            member.response_listeners = self.response_listeners
+            member.written_listeners = self.written_listeners
+            member.write_error_listeners = self.write_error_listeners
+            member.tracker = self.tracker
+            self.members.append(member)
+
+        ring: List[Tuple[int, int]] = []
+        for index in range(size):
+            for replica in range(replicas):
+                ring.append((_hash(f'{index}:{replica}'), index))
+        ring.sort()
+        self.ring_points = [point for point, _ in ring]
+        self.ring_members = [self.members[index] for _, index in ring]
+
+    @property
+    def connected(self) -> bool:
+        return any(member.connected for member in self.members)
+
+    @property
+    def metrics(self) -> List[ConnectionMetrics]:
+        '''Connection metrics of every member'''
+        return [member.metrics for member in self.members]
+
+    @property
+    def outbound_metrics(self) -> List[OutboundMetrics]:
+        '''Outbound queue metrics of every member'''
+        return [member.outbound_metrics for member in self.members]
+
+    def run(self, loop = None):
+        for member in self.members:
+            member.run(loop)
+
+    async def close(self):
+        '''Close every member, unfinished handles fail with `ConnectionError`'''
+        await asyncio.gather(*(member.close() for member in self.members))
+
+    def shard_for(self, user_id: str) -> GeneratorWebSocket:
+        '''Connection of `user_id`: its ring owner or, if it is down, the next connected one'''
+        start = bisect(self.ring_points, _hash(str(user_id))) % len(self.ring_points)
+        owner = self.ring_members[start]
+        if owner.connected:
+            return owner
+        for offset in range(1, len(self.ring_members)):
+            member = self.ring_members[(start + offset) % len(self.ring_members)]
+            if member.connected:
+                return member
+        return owner
+
+    async def send_message(self, message: Dict):
+        user_id = message['service_info']['user_id']
+        await self.shard_for(user_id).send_message(message)
+
+    def on_response(self, response):
+        # members share handlers and tracker, any of them delivers the response
+        self.members[0].on_response(response)
+
+    async def shard_error_handler(self, shard: GeneratorWebSocket, exception: Exception):
+        shard.connected = False
+        logging.warning(f'Pool connection {self.members.index(shard)} lost, its users are moved to other connections')
+        error = ShardConnectionError(shard, exception)
+        for handler in self.con_error_handlers:
+            await handler(error)
@@ -1,117 +1,527 @@
+import time
+import asyncio
 import logging
 
-from asyncio.locks import Lock
+from websockets.exceptions import ConnectionClosed
 from .gateway import GeneratorWebSocket
-from queue import Queue
-from typing import Dict
+from .pool import ShardConnectionError
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Tuple, Union
 from .messages import GenerationRequest, GenerationResponse
+from .limits import TokenBucket
+from .enums import AdmissionMode, GenStatus
+from .scheduling import SchedulingPolicy, RoundRobinPolicy
+from .metrics import LifecycleMetrics
+from .tracing import REQUEST_AS_DICT
 
 class QueueIsFullError(Exception):
     pass
 
+class AdmissionTimeoutError(QueueIsFullError):
+    pass
+
 class UserRequestBuffer:
+    '''Requests of a single user, plain state owned by `GenerationQueue`.\n
+    Only the queue dispatcher sends requests, so no locking is needed.
+    In-flight requests are kept by `request_id` in send order, `sends`
+    counts how many times each of them was handed to a connection.
+    '''
+    __slots__ = ('id', 'max_size', 'cur_size', 'queue', 'max_in_flight', 'ready',
+                 'in_flight', 'sends', 'needs_resend', 'gateway', 'idle_since')
     id: str
     max_size: int
     cur_size: int
-    queue: Queue
-    
-    lock: Lock
-    generating: bool
+    queue: deque
+
+    max_in_flight: Union[int, None]
+    ready: bool
+    in_flight: Dict[str, GenerationRequest]
+    sends: Dict[str, int]
+    needs_resend: bool
     gateway: GeneratorWebSocket
+    idle_since: Union[float, None]
 
     def __init__(
-            self, 
-            id: str, 
+            self,
+            id: str,
             max_size: int,
             gateway: GeneratorWebSocket
         ) -> None:
         self.id = id
         self.cur_size = 0
         self.max_size = max_size
-        self.queue = Queue()
-        self.lock = Lock()
-        self.generating = False
+        self.queue = deque()
+        self.max_in_flight = None
+        self.ready = False
+        self.in_flight = dict()
+        self.sends = dict()
+        self.needs_resend = False
         self.gateway = gateway
-        
-    async def add_request(
-            self, 
+        self.idle_since = None
+
+    def add_request(
+            self,
             request: GenerationRequest
         ) -> None:
-        async with self.lock:
-            if self.cur_size >= self.max_size:
-                raise QueueIsFullError("Cannot add new request, because user's queue is full")
-            logging.debug(f'Adding new request of user `{self.id}`')
-            self.queue.put_nowait(request)
-            self.cur_size += 1
-            if self.generating == False:
-                logging.debug(f'Starting generating for user `{self.id}`')
-                request = self.queue.get_nowait()
-                self.generating = True
-                await self.gateway.send_message(request.as_dict())
-            return True
-    
-    async def on_response(self, response: GenerationResponse):
-        async with self.lock:
-            self.cur_size -= 1
-            if self.cur_size < 1:
-                self.generating = False
-                logging.debug(f'ReqBuffer for user `{self.id}` is empty, not sending request')
-                return
-            request: GenerationRequest = self.queue.get_nowait()
-            logging.debug(f'Sending another request for user `{self.id}`')
-            await self.gateway.send_message(request.as_dict())
-        
+        if self.cur_size >= self.max_size:
+            raise QueueIsFullError("Cannot add new request, because user's queue is full")
+        logging.debug(f'Adding new request of user `{self.id}`')
+        self.queue.append(request)
+        self.cur_size += 1
+
+    def on_response(self, response: GenerationResponse) -> bool:
+        '''Release in-flight slot, returns False for unexpected responses'''
+        request_id = response.request_id
+        if request_id is not None and request_id not in self.in_flight:
+            # answer to a request resent after reconnect which was already answered
+            logging.debug(f'Ignoring duplicated response for user `{self.id}`')
+            return False
+        if request_id is None and not self.in_flight:
+            return False
+        self.release(request_id)
+        return True
+
+    def release(self, request_id: str = None):
+        '''Free slot of in-flight `request_id`, the oldest one if it is unknown'''
+        self.cur_size -= 1
+        if request_id is None:
+            request_id = next(iter(self.in_flight))
+        del self.in_flight[request_id]
+        self.sends.pop(request_id, None)
+        if not self.in_flight:
+            self.needs_resend = False
+        if self.cur_size < 1:
+            logging.debug(f'ReqBuffer for user `{self.id}` is empty, not sending request')
+
     async def get_size(self, request) -> bool:
-        async with self.lock:
-            return self.cur_size
-    
+        return self.cur_size
+
 class GenerationQueue:
+    '''Per-user request buffers served by a single dispatcher task.\n
+    `put` and responses only update buffers and mark users ready, every
+    send decision is made by `dispatcher_loop` which serves ready users
+    in order of `ready` scheduling policy.
+    '''
     users_bufs: Dict[str, UserRequestBuffer]
+    idle_bufs: OrderedDict
     gateway: GeneratorWebSocket
+    ready: SchedulingPolicy
+    resend_ready: deque
+    admission_waiters: deque
 
     def __init__(
             self,
-            gateway: GeneratorWebSocket
+            gateway: GeneratorWebSocket,
+            resend_burst: int = 100,
+            resend_interval: float = 0.1,
+            max_send_attempts: int = 3,
+            max_idle_buffers: int = 10000,
+            idle_ttl: float = 300.0,
+            max_in_flight: int = None,
+            max_pending: int = None,
+            rate_limit: float = None,
+            rate_burst: float = None,
+            admission: Union[AdmissionMode, str] = AdmissionMode.WAIT,
+            admission_timeout: float = None,
+            user_max_in_flight: Union[int, Callable[[str, GenerationRequest], int]] = 1,
+            scheduling: SchedulingPolicy = None,
+            send_batch: int = 64,
+            lifecycle: LifecycleMetrics = None
         ) -> None:
+        '''In-flight requests survive connection loss and are resent after
+        reconnect in bursts of `resend_burst` requests every `resend_interval` seconds.
+        A request interrupted after `max_send_attempts` sends fails with
+        `ConnectionError` instead, e.g. one the generator closes the connection
+        on because it is too big (close code 1009).\n
+        Empty user buffers are evicted after `idle_ttl` seconds, at most
+        `max_idle_buffers` least recently used empty buffers are kept.\n
+        `max_in_flight` - max requests sent and not answered yet across all users\n
+        `rate_limit`, `rate_burst` - token bucket limit of sent requests per second\n
+        `max_pending` - max queued and in-flight requests across all users,
+        `put` beyond it waits, fails with `QueueIsFullError` or waits at most
+        `admission_timeout` seconds and fails with `AdmissionTimeoutError`
+        depending on `admission`, `admission_timeout` is required for the latter\n
+        `user_max_in_flight` - requests of a single user generated in parallel,
+        an int or a function of `(user_id, next_request)` evaluated before every
+        send. Requests of a user are always sent in submission order, but with
+        more than 1 in flight they may finish out of order\n
+        `scheduling` - order of serving ready users, round robin by default\n
+        `send_batch` - max requests written to a connection before waiting for it to drain\n
+        `lifecycle` - records when requests are queued, not timed if None
+        '''
         self.users_bufs = dict()
+        self.idle_bufs = OrderedDict()
+        self.max_idle_buffers = max_idle_buffers
+        self.idle_ttl = idle_ttl
         self.gateway = gateway
-        self.gateway.req_done_handlers.append(self.req_done_handler)
-        self.gateway.req_error_handlers.append(self.req_error_handler)
+        self.resend_burst = resend_burst
+        self.resend_interval = resend_interval
+        self.max_send_attempts = max_send_attempts
+        self.ready = RoundRobinPolicy() if scheduling is None else scheduling
+        self.resend_ready = deque()
+        self.resend_at = 0.0
+        self.resend_timer = None
+        self.wakeup = asyncio.Event()
+        self.dispatcher = None
+        self.max_in_flight = max_in_flight
+        self.max_pending = max_pending
+        self.rate_limiter = None if rate_limit is None else TokenBucket(rate_limit, rate_burst)
+        self.admission = AdmissionMode(admission)
+        if self.admission == AdmissionMode.TIMEOUT and admission_timeout is None:
+            raise ValueError('admission_timeout is required with `timeout` admission')
+        self.admission_timeout = admission_timeout
+        self.admission_waiters = deque()
+        self.in_flight_count = 0
+        self.pending_count = 0
+        self.user_max_in_flight = user_max_in_flight
+        self.send_batch = send_batch
+        self.lifecycle = lifecycle
+        # bookkeeping runs inline, it must not wait behind slow user handlers
+        self.gateway.response_listeners.append(self.response_listener)
+        self.gateway.write_error_listeners.append(self.write_error_listener)
         self.gateway.con_error_handlers.append(self.con_error_handler)
-    
+        self.gateway.connected_handlers.append(self.connected_handler)
+
     async def put(
-            self, 
-            user_id: str, 
+            self,
+            user_id: str,
             request: GenerationRequest,
-            max_user_queue_size: int
+            max_user_queue_size: int,
+            max_user_in_flight: int = None
         ) -> bool:
+        '''`max_user_in_flight` - overrides `user_max_in_flight` for this user'''
+        admitted = False
+        if self.max_pending is not None and self.pending_count >= self.max_pending:
+            await self.admit()
+            admitted = True
+        try:
+            user_buf = self.add(user_id, request, max_user_queue_size, max_user_in_flight)
+        except QueueIsFullError:
+            if admitted:
+                # the slot this caller was woken for goes to the next waiter
+                self.wake_admission()
+            raise
+        self.mark_ready(user_buf)
+        return True
+
+    async def put_many(self, items: List[Tuple[str, GenerationRequest, int, int]]) -> List[Union[Exception, None]]:
+        '''Add `(user_id, request, max_user_queue_size, max_user_in_flight)` items in one pass.\n
+        Users are marked ready after the whole batch is added, so the dispatcher
+        sends it in pipelined batches. Returns the error of every item or None.
+        '''
+        errors = []
+        added = []
+        for user_id, request, max_user_queue_size, max_user_in_flight in items:
+            admitted = False
+            try:
+                if self.max_pending is not None and self.pending_count >= self.max_pending:
+                    # added requests must be dispatchable to ever free a slot
+                    for user_buf in added:
+                        self.mark_ready(user_buf)
+                    added.clear()
+                    await self.admit()
+                    admitted = True
+                added.append(self.add(user_id, request, max_user_queue_size, max_user_in_flight))
+                errors.append(None)
+            except QueueIsFullError as e:
+                if admitted:
+                    self.wake_admission()
+                errors.append(e)
+        for user_buf in added:
+            self.mark_ready(user_buf)
+        return errors
+
+    def add(
+            self,
+            user_id: str,
+            request: GenerationRequest,
+            max_user_queue_size: int,
+            max_user_in_flight: int = None
+        ) -> UserRequestBuffer:
         user_buf = self.users_bufs.get(user_id)
         if user_buf is None:
-            user_buf = UserRequestBuffer(user_id, max_user_queue_size, self.gateway)
+            user_buf = UserRequestBuffer(user_id, max_user_queue_size, self.gateway.shard_for(user_id))
             self.users_bufs[user_id] = user_buf
+        elif user_buf.cur_size == 0:
+            # idle buffer is free to move back to the user's own connection
+            user_buf.gateway = self.gateway.shard_for(user_id)
+            self.idle_bufs.pop(user_id, None)
+            user_buf.idle_since = None
         user_buf.max_size = max_user_queue_size
-        await user_buf.add_request(request)
-        
+        user_buf.max_in_flight = max_user_in_flight
+        try:
+            user_buf.add_request(request)
+        finally:
+            if user_buf.cur_size == 0:
+                self.mark_idle(user_buf)
+        self.pending_count += 1
+        if self.lifecycle is not None:
+            self.lifecycle.on_queued(request.request_id)
+        return user_buf
+
+    async def admit(self):
+        '''Wait for a free slot below `max_pending` according to `admission`'''
+        if self.admission == AdmissionMode.FAIL:
+            raise QueueIsFullError("Cannot add new request, because client queue is full")
+        loop = asyncio.get_running_loop()
+        deadline = None
+        if self.admission == AdmissionMode.TIMEOUT:
+            deadline = loop.time() + self.admission_timeout
+        while self.pending_count >= self.max_pending:
+            waiter = loop.create_future()
+            self.admission_waiters.append(waiter)
+            try:
+                if deadline is None:
+                    await waiter
+                else:
+                    await asyncio.wait_for(waiter, max(0.0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                raise AdmissionTimeoutError(f"Client queue is still full after {self.admission_timeout}s") from None
+
+    def wake_admission(self):
+        while self.admission_waiters:
+            waiter = self.admission_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    def utilization(self) -> Dict:
+        '''Current load against configured global limits'''
+        return {
+            "in_flight": self.in_flight_count,
+            "max_in_flight": self.max_in_flight,
+            "in_flight_utilization": None if not self.max_in_flight else self.in_flight_count / self.max_in_flight,
+            "pending": self.pending_count,
+            "max_pending": self.max_pending,
+            "pending_utilization": None if not self.max_pending else self.pending_count / self.max_pending,
+            "admission_waiters": sum(not waiter.done() for waiter in self.admission_waiters),
+            "ready_users": len(self.ready),
+            "users": len(self.users_bufs),
+            "rate_tokens": None if self.rate_limiter is None else self.rate_limiter.tokens
+        }
+
+    def user_limit(self, user_buf: UserRequestBuffer) -> int:
+        if user_buf.max_in_flight is not None:
+            return user_buf.max_in_flight
+        if callable(self.user_max_in_flight):
+            return self.user_max_in_flight(user_buf.id, user_buf.queue[0])
+        return self.user_max_in_flight
+
+    def can_send(self, user_buf: UserRequestBuffer) -> bool:
+        return bool(user_buf.queue) and len(user_buf.in_flight) < self.user_limit(user_buf)
+
+    def mark_ready(self, user_buf: UserRequestBuffer):
+        if user_buf.ready or not self.can_send(user_buf):
+            return
+        user_buf.ready = True
+        self.ready.push(user_buf)
+        self.wake_dispatcher()
+
+    def wake_dispatcher(self):
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.get_running_loop().create_task(self.dispatcher_loop())
+        self.wakeup.set()
+
+    async def dispatcher_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if self.resend_ready and loop.time() >= self.resend_at:
+                await self.resend_burst_once()
+                self.resend_at = loop.time() + self.resend_interval
+                continue
+            batch = []
+            delay = 0.0
+            while self.ready and len(batch) < self.send_batch and not self.dispatch_blocked():
+                if self.rate_limiter is not None:
+                    delay = self.rate_limiter.delay(time.monotonic())
+                    if delay:
+                        break
+                user_buf: UserRequestBuffer = self.ready.pop()
+                user_buf.ready = False
+                if not self.can_send(user_buf):
+                    continue
+                if self.rate_limiter is not None:
+                    self.rate_limiter.consume(time.monotonic())
+                logging.debug(f'Starting generating for user `{user_buf.id}`')
+                self.in_flight_count += 1
+                request = user_buf.queue.popleft()
+                request_id = request.request_id
+                user_buf.in_flight[id(request) if request_id is None else request_id] = request
+                batch.append((user_buf, request))
+                # user still below its limit goes to the end of the round
+                self.mark_ready(user_buf)
+            if batch:
+                await self.send_many(batch)
+                continue
+            if delay:
+                loop.call_later(delay, self.wakeup.set)
+            if self.resend_ready:
+                # deferred burst, e.g. a reconnect within `resend_interval` of the previous one
+                if self.resend_timer is not None:
+                    self.resend_timer.cancel()
+                self.resend_timer = loop.call_at(self.resend_at, self.wakeup.set)
+            self.wakeup.clear()
+            await self.wakeup.wait()
+
+    def dispatch_blocked(self) -> bool:
+        '''Global in-flight cap reached, dispatcher is woken by the next response'''
+        return self.max_in_flight is not None and self.in_flight_count >= self.max_in_flight
+
+    async def send_many(self, batch: List[Tuple[UserRequestBuffer, GenerationRequest]]):
+        '''Send in-flight requests of `batch` pipelined per connection,
+        postpone them until reconnect if connection is down
+        '''
+        by_gateway: Dict[GeneratorWebSocket, List] = {}
+        for user_buf, request in batch:
+            if not user_buf.gateway.connected:
+                user_buf.needs_resend = True
+                continue
+            by_gateway.setdefault(user_buf.gateway, []).append((user_buf, request))
+        for gateway, items in by_gateway.items():
+            tracer = gateway.tracer
+            started = time.perf_counter() if tracer is not None else 0.0
+            try:
+                messages = [request.as_dict() for _, request in items]
+                if tracer is not None:
+                    tracer.record(REQUEST_AS_DICT, started, time.perf_counter(), {"requests": len(items)})
+                errors = await gateway.send_messages(messages)
+            except ConnectionClosed:
+                for user_buf, _ in items:
+                    user_buf.needs_resend = True
+                continue
+            except Exception as e:
+                errors = [e] * len(items)
+            for (user_buf, request), error in zip(items, errors):
+                if error is not None:
+                    self.fail(user_buf, request, error)
+                    continue
+                key = id(request) if request.request_id is None else request.request_id
+                user_buf.sends[key] = user_buf.sends.get(key, 0) + 1
+
+    def fail(self, user_buf: UserRequestBuffer, request: GenerationRequest, exception: Exception):
+        logging.error(f'Cannot send request of user `{user_buf.id}` [{type(exception)}] {exception}')
+        request_id = request.request_id
+        self.gateway.tracker.fail(request_id, exception)
+        self.release(user_buf, id(request) if request_id is None else request_id)
+
+    def write_error_listener(self, request_id: str, exception: Exception):
+        '''Fail in-flight request whose frames the writer could not write'''
+        handle = self.gateway.tracker.get(request_id)
+        if handle is not None:
+            user_buf = self.users_bufs.get(handle.request.service_info.user_id)
+            user_bufs = () if user_buf is None else (user_buf,)
+        else:
+            # request queued without a handle, rare enough to search
+            user_bufs = list(self.users_bufs.values())
+        for user_buf in user_bufs:
+            request = user_buf.in_flight.get(request_id)
+            if request is not None:
+                self.fail(user_buf, request, exception)
+                return
+
+    async def resend_burst_once(self):
+        batch = []
+        while self.resend_ready and len(batch) < self.resend_burst:
+            user_buf: UserRequestBuffer = self.resend_ready.popleft()
+            if not user_buf.needs_resend or not user_buf.in_flight or not user_buf.gateway.connected:
+                continue
+            logging.debug(f'Resending {len(user_buf.in_flight)} in-flight requests of user `{user_buf.id}`')
+            user_buf.needs_resend = False
+            batch.extend((user_buf, request) for request in user_buf.in_flight.values())
+        await self.send_many(batch)
+
+    def release(self, user_buf: UserRequestBuffer, request_id: str = None):
+        user_buf.release(request_id)
+        self.after_response(user_buf)
+
+    def after_response(self, user_buf: UserRequestBuffer):
+        self.in_flight_count -= 1
+        self.pending_count -= 1
+        if self.admission_waiters:
+            self.wake_admission()
+        if self.ready and self.max_in_flight is not None:
+            self.wakeup.set()
+        if user_buf.cur_size == 0:
+            if user_buf.idle_since is None:
+                self.mark_idle(user_buf)
+        else:
+            self.mark_ready(user_buf)
+
+    def mark_idle(self, user_buf: UserRequestBuffer):
+        '''Put empty `user_buf` to the end of eviction order and evict expired buffers'''
+        user_buf.idle_since = time.monotonic()
+        self.idle_bufs[user_buf.id] = None
+        self.idle_bufs.move_to_end(user_buf.id)
+        self.evict_idle(user_buf.idle_since)
+
+    def evict_idle(self, now: float = None):
+        if now is None:
+            now = time.monotonic()
+        deadline = now - self.idle_ttl
+        while self.idle_bufs:
+            user_id = next(iter(self.idle_bufs))
+            user_buf = self.users_bufs.get(user_id)
+            if user_buf is not None and len(self.idle_bufs) <= self.max_idle_buffers \
+                    and user_buf.idle_since > deadline:
+                break
+            del self.idle_bufs[user_id]
+            if user_buf is not None and user_buf.cur_size == 0:
+                del self.users_bufs[user_id]
+
     async def remove(
         self
     ) -> bool:
         raise NotImplementedError('`remove` method not implemented')
-    
-    async def req_error_handler(self, response: GenerationResponse):
-        user_id = response.service_info.user_id
-        user_buf = self.users_bufs.get(user_id)
+
+    def response_listener(self, response: GenerationResponse):
+        if response.gen_status in (GenStatus.OK, GenStatus.ERROR):
+            self.on_response(response)
+
+    def on_response(self, response: GenerationResponse):
+        user_buf = self.users_bufs.get(response.user_id)
         if user_buf is None:
             return
-        await user_buf.on_response(response)
-    
-    async def req_done_handler(self, response: GenerationResponse):
-        user_id = response.service_info.user_id
-        user_buf = self.users_bufs.get(user_id)
-        if user_buf is None:
+        if user_buf.on_response(response):
+            self.after_response(user_buf)
+
+    async def con_error_handler(self, exception: Exception):
+        shard = exception.shard if isinstance(exception, ShardConnectionError) else None
+        targets = set()
+        interrupted = 0
+        exhausted = []
+        for user_buf in self.users_bufs.values():
+            if shard is not None and user_buf.gateway is not shard:
+                continue
+            if user_buf.in_flight:
+                user_buf.needs_resend = True
+                interrupted += len(user_buf.in_flight)
+                exhausted.extend((user_buf, request) for key, request in user_buf.in_flight.items()
+                                 if user_buf.sends.get(key, 0) >= self.max_send_attempts)
+            if shard is not None:
+                # failed pool member, move its users to the remaining connections,
+                # their messages still queued on it would be written twice after it reconnects
+                shard.discard_outbound(user_buf.in_flight)
+                user_buf.gateway = self.gateway.shard_for(user_buf.id)
+                targets.add(user_buf.gateway)
+        for user_buf, request in exhausted:
+            # releasing the last in-flight request clears `needs_resend`
+            self.fail(user_buf, request, ConnectionError(
+                f'Request was not answered after {self.max_send_attempts} sends, last connection error: {exception}'))
+        interrupted -= len(exhausted)
+        logging.warning(f'Got WebsocketConnectionError {interrupted} in-flight requests will be resent')
+        for gateway in targets:
+            if gateway.connected:
+                self.schedule_resend(gateway)
+
+    async def connected_handler(self, gateway: GeneratorWebSocket):
+        self.schedule_resend(gateway)
+
+    def schedule_resend(self, gateway: GeneratorWebSocket):
+        '''Queue interrupted in-flight requests of `gateway` users for paced resending'''
+        user_bufs = [user_buf for user_buf in self.users_bufs.values()
+                     if user_buf.needs_resend and user_buf.gateway is gateway]
+        if not user_bufs:
             return
-        await user_buf.on_response(response)
-        
-    async def con_error_handler(self, response: GenerationResponse):
-        logging.warning('Got WebsocketConnectionError all buffers has been cleaned!')
-        self.users_bufs = dict()
-    
+        logging.info(f'Resending {len(user_bufs)} in-flight requests')
+        self.resend_ready.extend(user_bufs)
+        self.wake_dispatcher()
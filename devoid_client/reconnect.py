@@ -0,0 +1,91 @@
+import time
+import random
+
+from typing import Dict, Union
+
+class ReconnectPolicy():
+    '''Exponential backoff with jitter between connection attempts.\n
+    `first_delay` - delay before the first retry after a connection loss\n
+    `base_delay`, `multiplier`, `max_delay` - delay before retry `n` is
+    `min(max_delay, base_delay * multiplier ** (n - 1))`\n
+    `jitter` - randomized part of each delay, 1.0 is "full jitter", so
+    replicas losing connection together do not reconnect in lockstep
+    '''
+    __slots__ = ('first_delay', 'base_delay', 'multiplier', 'max_delay', 'jitter')
+
+    def __init__(
+            self,
+            first_delay: float = 0.1,
+            base_delay: float = 0.5,
+            multiplier: float = 2.0,
+            max_delay: float = 30.0,
+            jitter: float = 1.0
+        ) -> None:
+        if not 0.0 <= jitter <= 1.0:
+            raise ValueError(f'jitter must be in [0, 1], got {jitter}')
+        self.first_delay = first_delay
+        self.base_delay = base_delay
+        self.multiplier = multiplier
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def delay(self, attempt: int) -> float:
+        '''Seconds to wait before retry number `attempt`, starting from 0'''
+        if attempt == 0:
+            delay = self.first_delay
+        else:
+            delay = min(self.max_delay, self.base_delay * self.multiplier ** (attempt - 1))
+        return delay * (1.0 - self.jitter) + random.uniform(0.0, delay * self.jitter)
+
+class ConnectionMetrics():
+    '''Connection counters of a single websocket.\n
+    Time to recover is measured from connection loss to the next
+    established connection.
+    '''
+    __slots__ = ('connects', 'reconnects', 'failed_attempts', 'disconnected_at',
+                 'last_time_to_recover', 'max_time_to_recover', 'total_downtime')
+    connects: int
+    reconnects: int
+    failed_attempts: int
+    disconnected_at: Union[float, None]
+    last_time_to_recover: Union[float, None]
+    max_time_to_recover: float
+    total_downtime: float
+
+    def __init__(self) -> None:
+        self.connects = 0
+        self.reconnects = 0
+        self.failed_attempts = 0
+        self.disconnected_at = None
+        self.last_time_to_recover = None
+        self.max_time_to_recover = 0.0
+        self.total_downtime = 0.0
+
+    def on_connect(self):
+        self.connects += 1
+        if self.disconnected_at is None:
+            return
+        time_to_recover = time.monotonic() - self.disconnected_at
+        self.disconnected_at = None
+        self.reconnects += 1
+        self.last_time_to_recover = time_to_recover
+        self.max_time_to_recover = max(self.max_time_to_recover, time_to_recover)
+        self.total_downtime += time_to_recover
+
+    def on_attempt_failed(self):
+        self.failed_attempts += 1
+
+    def on_disconnect(self):
+        if self.disconnected_at is None:
+            self.disconnected_at = time.monotonic()
+
+    def as_dict(self) -> Dict:
+        return {
+            "connects": self.connects,
+            "reconnects": self.reconnects,
+            "failed_attempts": self.failed_attempts,
+            "connected": self.disconnected_at is None and self.connects > 0,
+            "last_time_to_recover": self.last_time_to_recover,
+            "max_time_to_recover": self.max_time_to_recover,
+            "total_downtime": self.total_downtime
+        }
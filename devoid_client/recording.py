@@ -0,0 +1,173 @@
+import gzip
+import time
+import struct
+import asyncio
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import BinaryIO, Iterator, List, Union
+
+MAGIC = b'DVCAP1\n'
+# direction, kind, seconds since recording started, payload length
+RECORD = struct.Struct('<ccdI')
+
+INBOUND = b'<'
+OUTBOUND = b'>'
+TEXT = b't'
+BINARY = b'b'
+
+def _open(path: str, mode: str) -> BinaryIO:
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+class Frame():
+    '''Single captured websocket frame, text frames keep `data` as `str`'''
+    __slots__ = ('direction', 'time', 'data')
+    direction: bytes
+    time: float
+    data: Union[str, bytes]
+
+    def __init__(self, direction: bytes, time: float, data: Union[str, bytes]) -> None:
+        self.direction = direction
+        self.time = time
+        self.data = data
+
+    @property
+    def inbound(self) -> bool:
+        return self.direction == INBOUND
+
+class TrafficRecorder():
+    '''Captures websocket frames of `GeneratorWebSocket` with timestamps to `path`.\n
+    Every frame is a fixed 14 byte record header followed by its payload,
+    paths ending with `.gz` are gzip compressed. The event loop only appends
+    frames to an in-memory buffer, full buffers are compressed and written
+    by a single background thread in recorded order. Attachments streamed
+    from `ImageSource` are not captured.\n
+    `inbound`, `outbound` - directions to capture\n
+    `buffer_size` - bytes buffered before they are handed to the writer thread
+    '''
+    def __init__(self, path: str, inbound: bool = True, outbound: bool = True, buffer_size: int = 1 << 20) -> None:
+        self.path = path
+        self.inbound = inbound
+        self.outbound = outbound
+        self.buffer_size = buffer_size
+        self.file = _open(path, 'wb')
+        self.file.write(MAGIC)
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix='devoid-recorder')
+        self.buffer = []
+        self.buffered = 0
+        self.pending = []
+        self.started = time.monotonic()
+        self.frames = 0
+        self.bytes = 0
+
+    def record(self, direction: bytes, data: Union[str, bytes], text: bool = None):
+        '''`text` - kind of the frame, text for `str` data and binary for bytes if None'''
+        if self.file is None:
+            return
+        if direction == INBOUND and not self.inbound or direction == OUTBOUND and not self.outbound:
+            return
+        if isinstance(data, str):
+            kind, data = TEXT, data.encode()
+        else:
+            kind, data = TEXT if text else BINARY, bytes(data)
+        self.buffer.append(RECORD.pack(direction, kind, time.monotonic() - self.started, len(data)))
+        self.buffer.append(data)
+        self.buffered += RECORD.size + len(data)
+        self.frames += 1
+        self.bytes += len(data)
+        if self.buffered >= self.buffer_size:
+            self.submit()
+
+    def submit(self):
+        '''Hand buffered frames to the writer thread'''
+        if self.buffer:
+            self.pending = [future for future in self.pending if not future.done() or future.exception()]
+            self.pending.append(self.executor.submit(self.write, self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+    def write(self, chunks: List[bytes]):
+        self.file.write(b''.join(chunks))
+
+    def flush(self):
+        '''Write buffered frames to the file, blocks until the writer thread is done.
+        Raises the error of a failed write.
+        '''
+        if self.file is None:
+            return
+        self.submit()
+        pending, self.pending = self.pending, []
+        for future in pending:
+            future.result()
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            try:
+                self.flush()
+            finally:
+                self.executor.shutdown()
+                self.file.close()
+                self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def read_frames(path: str) -> Iterator[Frame]:
+    '''Frames of a capture written by `TrafficRecorder` in recorded order'''
+    with _open(path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not a traffic capture')
+        while True:
+            header = file.read(RECORD.size)
+            if len(header) < RECORD.size:
+                # capture of a process which was killed may end with a partial record
+                return
+            direction, kind, timestamp, length = RECORD.unpack(header)
+            data = file.read(length)
+            if len(data) < length:
+                return
+            yield Frame(direction, timestamp, data.decode() if kind == TEXT else data)
+
+class TrafficReplay():
+    '''Async iterator over inbound frames of a capture, usable in place of a websocket.\n
+    `speed` - 1.0 keeps recorded gaps between frames, 2.0 halves them,
+    None replays as fast as possible
+    '''
+    def __init__(self, path: str, speed: Union[float, None] = 1.0) -> None:
+        if speed is not None and speed <= 0:
+            raise ValueError(f'speed must be positive or None, got {speed}')
+        self.path = path
+        self.speed = speed
+        self.frames = 0
+        self.bytes = 0
+        self.skipped = 0
+
+    async def __aiter__(self):
+        loop = asyncio.get_running_loop()
+        started = None
+        for frame in read_frames(self.path):
+            if not frame.inbound:
+                self.skipped += 1
+                continue
+            if self.speed is not None:
+                if started is None:
+                    started = loop.time() - frame.time / self.speed
+                delay = started + frame.time / self.speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            self.frames += 1
+            self.bytes += len(frame.data)
+            yield frame.data
+
+async def replay(gateway, path: str, speed: Union[float, None] = None) -> TrafficReplay:
+    '''Feed inbound frames of capture at `path` through `gateway` receive path and handlers,
+    returns the finished `TrafficReplay` with frame counts
+    '''
+    frames = TrafficReplay(path, speed)
+    await gateway.receive_frames(frames)
+    return frames
@@ -0,0 +1,172 @@
+from collections import deque
+from typing import Callable, Dict
+
+from .enums import *
+from .messages import GenerationRequest
+
+# cost of 30 steps 512x512 image, the unit of `request_cost`
+REFERENCE_COST = 30 * 512 * 512
+# least cost a request is charged, a free request would keep its user's turn forever
+MIN_COST = 1.0
+
+def request_cost(request: GenerationRequest) -> float:
+    '''Estimated cost of `request` relative to a 30 steps 512x512 image'''
+    cost = getattr(request.payload, 'cost', 0)
+    return max(cost, 1) / REFERENCE_COST
+
+class SchedulingPolicy():
+    '''Order in which `GenerationQueue` dispatcher serves ready users.\n
+    `push` is called when a user has a request that can be sent, `pop`
+    returns the next user to serve. A popped user may turn out to have
+    nothing to send anymore, the dispatcher skips such users.
+    '''
+    __slots__ = ()
+
+    def push(self, user_buf):
+        raise NotImplementedError('`push` method not implemented')
+
+    def pop(self):
+        raise NotImplementedError('`pop` method not implemented')
+
+    def __len__(self) -> int:
+        raise NotImplementedError('`__len__` method not implemented')
+
+class RoundRobinPolicy(SchedulingPolicy):
+    '''One request per ready user in turn, regardless of its cost'''
+    __slots__ = ('users',)
+    users: deque
+
+    def __init__(self) -> None:
+        self.users = deque()
+
+    def push(self, user_buf):
+        self.users.append(user_buf)
+
+    def pop(self):
+        return self.users.popleft()
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+class DeficitRoundRobinPolicy(SchedulingPolicy):
+    '''Weighted deficit round robin over users by estimated request cost.\n
+    Every round a user earns `quantum` multiplied by the weight of its next
+    request and spends the cost of every sent request, so users with heavy
+    requests get the same share of generator time as users with light ones
+    instead of the same number of requests.\n
+    `premium_weight` - weight of premium requests\n
+    `executor_weights` - weight of requests by `Executor`, 1 by default\n
+    `cost` - function estimating request cost in quantum units, requests are
+    charged at least `MIN_COST`, i.e. lighter ones than the reference image
+    count as one
+    '''
+    __slots__ = ('users', 'deficits', 'quantum', 'premium_weight', 'executor_weights', 'cost')
+    users: deque
+    deficits: Dict[str, float]
+
+    def __init__(
+            self,
+            quantum: float = 1.0,
+            premium_weight: float = 4.0,
+            executor_weights: Dict[Executor, float] = None,
+            cost: Callable[[GenerationRequest], float] = request_cost
+        ) -> None:
+        if quantum <= 0:
+            raise ValueError(f'quantum must be positive, got {quantum}')
+        # a user whose weight is not positive never earns its next request
+        if premium_weight <= 0:
+            raise ValueError(f'premium_weight must be positive, got {premium_weight}')
+        for executor, weight in (executor_weights or {}).items():
+            if weight <= 0:
+                raise ValueError(f'Weight of {executor} must be positive, got {weight}')
+        self.users = deque()
+        self.deficits = dict()
+        self.quantum = quantum
+        self.premium_weight = premium_weight
+        self.executor_weights = executor_weights or {}
+        self.cost = cost
+
+    def weight(self, request: GenerationRequest) -> float:
+        weight = self.executor_weights.get(request.executor, 1.0)
+        if request.settings.premium:
+            weight *= self.premium_weight
+        return weight
+
+    def request_cost(self, request: GenerationRequest) -> float:
+        return max(self.cost(request), MIN_COST)
+
+    def push(self, user_buf):
+        # user which can still afford its next request keeps its turn
+        if user_buf.queue and self.deficits.get(user_buf.id, 0.0) >= self.request_cost(user_buf.queue[0]):
+            self.users.appendleft(user_buf)
+        else:
+            self.users.append(user_buf)
+
+    def pop(self):
+        users = self.users
+        while True:
+            user_buf = users[0]
+            if not user_buf.queue:
+                users.popleft()
+                self.deficits.pop(user_buf.id, None)
+                return user_buf
+            request = user_buf.queue[0]
+            cost = self.request_cost(request)
+            deficit = self.deficits.get(user_buf.id, 0.0)
+            if deficit < cost:
+                # user's turn in a new round
+                deficit += self.quantum * self.weight(request)
+                if deficit < cost:
+                    self.deficits[user_buf.id] = deficit
+                    users.rotate(-1)
+                    continue
+            users.popleft()
+            if len(user_buf.queue) == 1:
+                # user runs out of requests, unused deficit is not kept
+                self.deficits.pop(user_buf.id, None)
+            else:
+                self.deficits[user_buf.id] = deficit - cost
+            return user_buf
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+class PremiumLanePolicy(SchedulingPolicy):
+    '''Separate lanes for users whose next request is premium and the rest.\n
+    Premium lane is served first, but after `premium_streak` premium
+    requests in a row one standard request is sent, so premium users wait
+    at most for a single standard request and standard users are not starved.\n
+    `premium`, `standard` - policies inside lanes, deficit round robin by default
+    '''
+    __slots__ = ('premium', 'standard', 'premium_streak', 'streak')
+    premium: SchedulingPolicy
+    standard: SchedulingPolicy
+
+    def __init__(
+            self,
+            premium: SchedulingPolicy = None,
+            standard: SchedulingPolicy = None,
+            premium_streak: int = 4
+        ) -> None:
+        if premium_streak < 1:
+            raise ValueError(f'premium_streak must be positive, got {premium_streak}')
+        self.premium = DeficitRoundRobinPolicy() if premium is None else premium
+        self.standard = DeficitRoundRobinPolicy() if standard is None else standard
+        self.premium_streak = premium_streak
+        self.streak = 0
+
+    def push(self, user_buf):
+        if user_buf.queue and user_buf.queue[0].settings.premium:
+            self.premium.push(user_buf)
+        else:
+            self.standard.push(user_buf)
+
+    def pop(self):
+        if len(self.premium) and (self.streak < self.premium_streak or not len(self.standard)):
+            self.streak += 1
+            return self.premium.pop()
+        self.streak = 0
+        return self.standard.pop()
+
+    def __len__(self) -> int:
+        return len(self.premium) + len(self.standard)
@@ -0,0 +1,85 @@
+import time
+import logging
+
+from typing import Dict, Tuple
+
+from .metrics import Histogram
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+# hot path stages, recorded with `time.perf_counter` timestamps
+REQUEST_AS_DICT = 'request.as_dict'
+JSON_ENCODE = 'json.encode'
+WEBSOCKET_SEND = 'websocket.send'
+JSON_DECODE = 'json.decode'
+RESPONSE_BUILD = 'response.build'
+RESPONSE_DISPATCH = 'response.dispatch'
+HANDLER_RUN = 'handler.run'
+
+# seconds, from a small message encode to a stalled event loop
+STAGE_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001,
+                 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+class Tracer():
+    '''Sink of hot path stage timings, tracing is disabled with no tracer.\n
+    `record` is called on the event loop right after every stage with its
+    `time.perf_counter` start and end, so it must be cheap. `attributes`
+    describe the stage, e.g. number of messages or handler name.
+    '''
+    def record(self, stage: str, start: float, end: float, attributes: Dict = None):
+        raise NotImplementedError('`record` method not implemented')
+
+class StageTimer(Tracer):
+    '''Histograms of stage durations in process.\n
+    Stages running longer than `stall_after` seconds block the event loop
+    noticeably, they are counted and logged with their attributes.
+    '''
+    histograms: Dict[str, Histogram]
+
+    def __init__(
+            self,
+            stall_after: float = 0.05,
+            buckets: Tuple[float, ...] = STAGE_BUCKETS
+        ) -> None:
+        self.stall_after = stall_after
+        self.buckets = buckets
+        self.histograms = dict()
+        self.stalls = 0
+
+    def record(self, stage: str, start: float, end: float, attributes: Dict = None):
+        duration = end - start
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = Histogram(self.buckets)
+        histogram.observe(duration)
+        if duration > self.stall_after:
+            self.stalls += 1
+            logging.warning(f'Stage `{stage}` took {duration * 1000:.1f}ms {attributes or ""}')
+
+    def as_dict(self) -> Dict:
+        return {
+            "stalls": self.stalls,
+            "stages": {stage: histogram.as_dict() for stage, histogram in self.histograms.items()}
+        }
+
+class OpenTelemetryTracer(Tracer):
+    '''Emits every stage as an OpenTelemetry span, requires `opentelemetry-api`.\n
+    `tracer` - OpenTelemetry tracer, `devoid_client` tracer of the global provider by default\n
+    `min_duration` - shorter stages are not emitted
+    '''
+    def __init__(self, tracer=None, min_duration: float = 0.0) -> None:
+        if otel_trace is None:
+            raise ImportError('opentelemetry-api is not installed, run `pip install opentelemetry-api`')
+        self.tracer = tracer or otel_trace.get_tracer('devoid_client')
+        self.min_duration = min_duration
+        # spans take wall clock nanoseconds
+        self.offset = time.time_ns() - time.perf_counter_ns()
+
+    def record(self, stage: str, start: float, end: float, attributes: Dict = None):
+        if end - start < self.min_duration:
+            return
+        span = self.tracer.start_span(stage, start_time=self.offset + int(start * 1e9), attributes=attributes)
+        span.end(end_time=self.offset + int(end * 1e9))
@@ -0,0 +1,174 @@
+import asyncio
+
+from asyncio import AbstractEventLoop, Future
+from typing import Callable, Dict, List, Union
+
+from .enums import *
+from .messages import GenerationRequest, GenerationResponse
+
+TERMINAL_STATUSES = (GenStatus.OK, GenStatus.ERROR)
+
+def _consume_exception(future: Future):
+    # Handles are optional for callers that still rely on the global
+    # handlers, so a failed handle nobody awaits must not log a warning
+    if not future.cancelled():
+        future.exception()
+
+class RequestHandle():
+    '''Awaitable handle of a single submitted generation request.\n
+    `await handle` returns the terminal `GenerationResponse` (OK or ERROR).
+    Intermediate transitions can be awaited with `wait_for(GenStatus.QUEUED)`
+    and `wait_for(GenStatus.GENERATING)`.
+    '''
+    request_id: str
+    request: GenerationRequest
+    status: Union[GenStatus, None]
+    object_id: Union[str, None]
+    responses: Dict[GenStatus, GenerationResponse]
+
+    def __init__(
+            self,
+            request: GenerationRequest,
+            loop: AbstractEventLoop = None
+        ) -> None:
+        if loop is None:
+            loop = asyncio.get_running_loop()
+        self.loop = loop
+        self.request_id = request.request_id
+        self.request = request
+        self.status = None
+        self.object_id = None
+        self.responses = {}
+        self.result_future = loop.create_future()
+        self.result_future.add_done_callback(_consume_exception)
+        self._waiters: Dict[GenStatus, List[Future]] = {}
+
+    def __await__(self):
+        # the future is shared by every awaiter, a timed out `wait_for` cancels only its own wait
+        return asyncio.shield(self.result_future).__await__()
+
+    def __repr__(self) -> str:
+        status = None if self.status is None else self.status.value
+        return f"RequestHandle({self.request_id}: {status})"
+
+    def done(self) -> bool:
+        return self.result_future.done()
+
+    def result(self) -> GenerationResponse:
+        '''Terminal response, raises `asyncio.InvalidStateError` if not done yet'''
+        return self.result_future.result()
+
+    def add_done_callback(self, callback):
+        '''`callback` - function called with this handle once it is resolved'''
+        self.result_future.add_done_callback(lambda _: callback(self))
+
+    async def wait_for(self, status: GenStatus) -> GenerationResponse:
+        '''Wait until the request reaches `status`.\n
+        If the request finishes without passing through `status`
+        the terminal response is returned instead.
+        '''
+        if status in TERMINAL_STATUSES:
+            return await self
+        response = self.responses.get(status)
+        if response is not None:
+            return response
+        if self.done():
+            return self.result()
+        waiter = self.loop.create_future()
+        waiter.add_done_callback(_consume_exception)
+        self._waiters.setdefault(status, []).append(waiter)
+        return await waiter
+
+    def set_response(self, response: GenerationResponse) -> bool:
+        '''Apply received `response`, returns True if the request is finished'''
+        if self.done():
+            return True
+        self.status = response.gen_status
+        self.object_id = response.object_id
+        if self.status in TERMINAL_STATUSES:
+            self.result_future.set_result(response)
+            for waiters in self._waiters.values():
+                self._wake(waiters, response)
+            self._waiters.clear()
+            return True
+        self.responses[self.status] = response
+        self._wake(self._waiters.pop(self.status, ()), response)
+        return False
+
+    def set_exception(self, exception: BaseException):
+        if self.done():
+            return
+        self.result_future.set_exception(exception)
+        for waiters in self._waiters.values():
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(exception)
+        self._waiters.clear()
+
+    @staticmethod
+    def _wake(waiters: List[Future], response: GenerationResponse):
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(response)
+
+class RequestTracker():
+    '''Index of unfinished requests keyed by client generated `request_id`.\n
+    Watchers are internal callbacks of a request called with its terminal
+    response or failure, independent of what callers do with its handle.
+    '''
+    handles: Dict[str, RequestHandle]
+    watchers: Dict[str, Callable]
+
+    def __init__(self) -> None:
+        self.handles = dict()
+        self.watchers = dict()
+
+    def __len__(self) -> int:
+        return len(self.handles)
+
+    def track(self, request: GenerationRequest) -> RequestHandle:
+        handle = RequestHandle(request)
+        self.handles[handle.request_id] = handle
+        return handle
+
+    def get(self, request_id: str) -> Union[RequestHandle, None]:
+        return self.handles.get(request_id)
+
+    def discard(self, request_id: str):
+        self.handles.pop(request_id, None)
+
+    def watch(self, request_id: str, callback: Callable[[Union[GenerationResponse, None], Union[BaseException, None]], None]):
+        '''Call `callback(response, exception)` once when `request_id` finishes or fails'''
+        self.watchers[request_id] = callback
+
+    def notify(self, request_id: str, response: Union[GenerationResponse, None], exception: BaseException = None):
+        callback = self.watchers.pop(request_id, None)
+        if callback is not None:
+            callback(response, exception)
+
+    def on_response(self, response: GenerationResponse):
+        request_id = response.request_id
+        if request_id is None:
+            return
+        handle = self.handles.get(request_id)
+        if handle is None:
+            return
+        # a handle cancelled by its caller is still finished by the response
+        if handle.set_response(response):
+            del self.handles[request_id]
+            self.notify(request_id, response)
+
+    def fail(self, request_id: str, exception: BaseException):
+        handle = self.handles.pop(request_id, None)
+        if handle is not None:
+            handle.set_exception(exception)
+        self.notify(request_id, None, exception)
+
+    def fail_all(self, exception: BaseException):
+        '''Fail every unfinished request, e.g. when the client is closed'''
+        handles = self.handles
+        self.handles = dict()
+        for handle in handles.values():
+            handle.set_exception(exception)
+        for request_id in list(self.watchers):
+            self.notify(request_id, None, exception)
@@ -0,0 +1,102 @@
+import time
+
+from asyncio import Future
+from typing import Dict, List, Union
+
+from .attachments import Attachment
+
+class OutboundMessage():
+    '''Encoded message waiting in outbound queue with its attachments.\n
+    `future` is resolved once all its frames are written to the socket
+    '''
+    __slots__ = ('data', 'attachments', 'key', 'future', 'enqueued_at')
+    data: Union[str, bytes]
+    attachments: List[Attachment]
+    key: Union[str, None]
+    future: Future
+    enqueued_at: float
+
+    def __init__(
+            self,
+            data: Union[str, bytes],
+            attachments: List[Attachment],
+            key: Union[str, None],
+            future: Future
+        ) -> None:
+        self.data = data
+        self.attachments = attachments
+        self.key = key
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+class OutboundWriteError(Exception):
+    '''Message `index` of a written batch failed with `exception`.\n
+    `partial` - some of its frames were already written, the peer would
+    take the following frames for the rest of it
+    '''
+    def __init__(self, index: int, exception: Exception, partial: bool) -> None:
+        super().__init__(f'[{type(exception).__name__}] {exception}')
+        self.index = index
+        self.exception = exception
+        self.partial = partial
+
+class OutboundMetrics():
+    '''Outbound queue counters of a single websocket.\n
+    Send latency is measured from enqueueing a message to the drain
+    of the batch it was written in, so it includes time spent waiting
+    for a connection.
+    '''
+    __slots__ = ('depth', 'max_depth', 'enqueued', 'written', 'coalesced', 'batches',
+                 'blocked_senders', 'last_latency', 'max_latency', 'total_latency')
+    depth: int
+    max_depth: int
+    enqueued: int
+    written: int
+    coalesced: int
+    batches: int
+    blocked_senders: int
+    last_latency: Union[float, None]
+    max_latency: float
+    total_latency: float
+
+    def __init__(self) -> None:
+        self.depth = 0
+        self.max_depth = 0
+        self.enqueued = 0
+        self.written = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.blocked_senders = 0
+        self.last_latency = None
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+
+    def on_enqueue(self, depth: int):
+        self.enqueued += 1
+        self.depth = depth
+        self.max_depth = max(self.max_depth, depth)
+
+    def on_written(self, batch: List[OutboundMessage], depth: int):
+        now = time.monotonic()
+        self.batches += 1
+        self.written += len(batch)
+        self.depth = depth
+        for message in batch:
+            latency = now - message.enqueued_at
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+        self.last_latency = now - batch[-1].enqueued_at
+
+    def as_dict(self) -> Dict:
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "coalesced": self.coalesced,
+            "batches": self.batches,
+            "blocked_senders": self.blocked_senders,
+            "last_latency": self.last_latency,
+            "max_latency": self.max_latency,
+            "avg_latency": self.total_latency / self.written if self.written else None
+        }
@@ -1,10 +1,7 @@
 import os
-import base64
 import asyncio
-import requests
 
-from datetime import datetime
-from devoid_client import GeneratorClient, GenerationResponse, QueueIsFullError
+from devoid_client import GeneratorClient, GenerationResponse, QueueIsFullError, ResultDownloader
 from devoid_client.enums import Executor
 
 from random import randint
@@ -13,8 +10,6 @@ GENERATOR_ENDPOINT = 'ws://localhost:8080/ws'
 SERVICE_NAME = 'discord'
 SERVICE_TOKEN = 'service-token'
 
-expecting = {}
-
 if not os.path.exists("gens/"):
     os.makedirs("gens/")
 
@@ -22,8 +17,8 @@ if not os.path.exists("gens/"):
 async def connection_error_handler(exception: Exception):
     print(f'[{type(exception)}] {exception}')
 
-# Done handler
-async def request_done_handler(response: GenerationResponse):
+# Done handler, result is already downloaded to gens/, blocking file writes run in the handler thread pool
+def request_done_handler(response: GenerationResponse):
     msg = '\n'
     msg +=  '| REQUEST DONE\n'
     msg += f'| GenerationID: {response.object_id}\n'
@@ -32,21 +27,11 @@ async def request_done_handler(response: GenerationResponse):
     msg += f'| GenerationUser: {response.service_info.user_id}\n'
     msg += f'| GenerationResult: {response.result.content}\n'    
     msg += f'| FILE_NAME: {response.result.file_name}\n'    
+    msg += f'| LOCAL_PATH: {response.result.path}\n'    
     print(msg)
     try:
-        r = requests.get(response.result.content, timeout=3)
-        with open(f'gens/{response.result.content.split("/")[-1]}', 'wb') as f:
-            f.write(r.content)
-            
         with open('stats.txt', 'a') as f:
             f.write(f'{str(response.settings.premium)}\n')
-        
-        expecting[response.object_id].append(datetime.now())
-        td = expecting[response.object_id][2] - expecting[response.object_id][1]
-        td = round(td.total_seconds(), 2)
-        ed = expecting[response.object_id][0]
-        with open('expecting.txt', 'a') as f:
-            f.write(f'{response.object_id} {ed} - {td} = {ed - td}\n')
     except Exception as e:
         print(e)
 
@@ -68,7 +53,6 @@ async def request_queued_handler(response: GenerationResponse):
     msg += f'| GenerationType: {response.gen_status.name}|{response.gen_type.name}\n'
     msg += f'| GenerationUser: {response.service_info.user_id}\n'
     msg += f'| GenerationAvgTime: {response.avg_time}\n'
-    expecting[response.object_id] = [response.avg_time, datetime.now()]
     print(msg)
     
 async def request_generating_handler(response: GenerationResponse):
@@ -85,11 +69,12 @@ async def main():
     client1 = GeneratorClient(
         endpoint=GENERATOR_ENDPOINT,
         service=SERVICE_NAME,
-        token=SERVICE_TOKEN
+        token=SERVICE_TOKEN,
+        downloader=ResultDownloader(concurrency=8, directory='gens/')
     )
 
     # Registering handlers
-    client1.register_req_done_handler(request_done_handler)
+    client1.register_req_done_handler(request_done_handler, mode='thread')
     client1.register_req_error_handler(request_error_handler)
     client1.register_req_generating_handler(request_generating_handler)
     client1.register_req_queued_handler(request_queued_handler)
@@ -99,6 +84,10 @@ async def main():
     loop = asyncio.get_running_loop()
     client1.run(loop)
 
+    # Lifecycle latency histograms on http://127.0.0.1:9100/metrics,
+    # `estimate_error` compares `avg_time` with the actual generation time
+    await client1.serve_metrics(port=9100)
+
     automatic1111_payload= {
         "prompt": "aloha",
         "steps": 30,
@@ -133,12 +122,11 @@ async def main():
     await asyncio.sleep(10)
     
     # СМЕШИВАНИЕ КАРТИНОК
+    # Raw bytes are sent as binary frames (or base64 encoded if generator does not support it)
     with open("1.png", "rb") as image:
-        f1 = base64.b64encode(image.read())
-        f1 = f1.decode('ascii')
+        f1 = image.read()
     with open("2.png", "rb") as image:
-        f2 = base64.b64encode(image.read())
-        f2 = f2.decode('ascii')
+        f2 = image.read()
     mix2img_payload = {
         "images_texts": ['first prompt', f1, f2, 'second prompt'],
         "weights": [0.25, 0.25, 0.25, 0.25],
@@ -14,5 +14,14 @@ setup(
     description="Client for Devoid AI Image generator",
     url='https://devoid.pics',
     packages=find_packages(exclude=['tests', 'tests.']),
-    install_requires=['requests', 'setuptools', 'websockets']
+    # the gateway writes frames through the legacy websockets client protocol
+    install_requires=['requests', 'setuptools', 'websockets>=10.0,<18'],
+    extras_require={
+        'orjson': ['orjson'],
+        'msgspec': ['msgspec'],
+        'opentelemetry': ['opentelemetry-api']
+    },
+    entry_points={
+        'console_scripts': ['devoid-bench=devoid_client.bench.loadtest:main']
+    }
 )
\ No newline at end of file
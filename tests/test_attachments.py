@@ -0,0 +1,52 @@
+import os
+import base64
+import asyncio
+import unittest
+
+from devoid_client import GeneratorClient, ReconnectPolicy
+from devoid_client.enums import *
+from devoid_client.bench.server import MockGenerator
+from devoid_client.bench.payloads import AUTOMATIC1111_PAYLOAD
+
+IMAGE_SIZE = 500_000
+
+class AttachmentTest(unittest.IsolatedAsyncioTestCase):
+    async def send_images(self, generator: MockGenerator, images: list, **client_options):
+        client = GeneratorClient(generator.endpoint, 'test', 'token',
+                                 reconnect_policy=ReconnectPolicy(first_delay=0.01, base_delay=0.01), **client_options)
+        client.run(asyncio.get_running_loop())
+        payload = dict(AUTOMATIC1111_PAYLOAD, init_images=images)
+        handle = await client.img2img(Executor.AUTOMATIC1111, False, False, False, 'user', 1, 1,
+                                      payload, max_user_queue_size=1)
+        try:
+            return await asyncio.wait_for(handle, 10)
+        finally:
+            await client.close()
+
+    async def test_images_are_sent_in_binary_frames(self):
+        images = [os.urandom(IMAGE_SIZE) for _ in range(3)]
+        async with MockGenerator() as generator:
+            response = await self.send_images(generator, images)
+        self.assertEqual(response.gen_status, GenStatus.OK)
+        self.assertEqual(generator.received[0]['payload']['init_images'], images)
+        self.assertEqual(generator.received[0]['attachments'], [{"size": IMAGE_SIZE}] * 3)
+
+    async def test_images_are_base64_encoded_without_the_feature(self):
+        images = [os.urandom(IMAGE_SIZE) for _ in range(3)]
+        async with MockGenerator(features=()) as generator:
+            response = await self.send_images(generator, images)
+        self.assertEqual(response.gen_status, GenStatus.OK)
+        received = generator.received[0]
+        self.assertNotIn('attachments', received)
+        self.assertEqual(received['payload']['init_images'], [base64.b64encode(image).decode() for image in images])
+
+    async def test_too_big_request_fails_after_max_send_attempts(self):
+        # the generator closes the connection with 1009 on every send
+        async with MockGenerator(max_size=100_000) as generator:
+            with self.assertLogs(level='ERROR'), self.assertRaises(ConnectionError) as raised:
+                await self.send_images(generator, [os.urandom(IMAGE_SIZE)], max_send_attempts=2)
+        self.assertIn('1009', str(raised.exception))
+        self.assertEqual(generator.received, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import asyncio
+import tempfile
+import unittest
+
+from devoid_client import GeneratorClient, ResultCache
+from devoid_client.enums import *
+from devoid_client.bench.server import MockGenerator
+from devoid_client.bench.payloads import AUTOMATIC1111_PAYLOAD
+
+class CoalescingTest(unittest.IsolatedAsyncioTestCase):
+    async def test_leader_timeout_does_not_fail_followers(self):
+        async with MockGenerator(generation_time=0.2) as generator:
+            client = GeneratorClient(generator.endpoint, 'test', 'token', cache=ResultCache())
+            client.run(asyncio.get_running_loop())
+            submit = lambda user_id: client.text2img(Executor.AUTOMATIC1111, False, False, False, user_id, 1, 1,
+                                                     AUTOMATIC1111_PAYLOAD, max_user_queue_size=1)
+            leader = await submit('leader')
+            follower = await submit('follower')
+            self.assertEqual(client.cache.coalesced, 1)
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(leader, 0.01)
+            # the shared future survives the cancelled wait
+            self.assertFalse(leader.done())
+            response = await asyncio.wait_for(follower, 5)
+            self.assertEqual(response.gen_status, GenStatus.OK)
+            self.assertEqual(response.user_id, 'follower')
+            self.assertEqual((await leader).gen_status, GenStatus.OK)
+            self.assertEqual(client.cache.stats()["size"], 1)
+            await client.close()
+
+class ResultCacheTest(unittest.TestCase):
+    def test_evicted_entries_are_deleted_from_disk(self):
+        with tempfile.TemporaryDirectory() as path:
+            cache = ResultCache(max_size=2, path=path)
+            for key in ('first', 'second', 'third'):
+                cache.put(key, {"object_id": key})
+            self.assertEqual(list(cache.entries), ['second', 'third'])
+            self.assertEqual(sorted(os.listdir(path)), ['second.json', 'third.json'])
+            self.assertIsNone(cache.get('first'))
+            # a recently used entry is kept
+            self.assertEqual(cache.get('second'), {"object_id": 'second'})
+            cache.put('fourth', {"object_id": 'fourth'})
+            self.assertEqual(sorted(os.listdir(path)), ['fourth.json', 'second.json'])
+
+    def test_entries_survive_restart(self):
+        with tempfile.TemporaryDirectory() as path:
+            ResultCache(path=path).put('key', {"object_id": 'key'})
+            self.assertEqual(ResultCache(path=path).get('key'), {"object_id": 'key'})
+
+if __name__ == '__main__':
+    unittest.main()
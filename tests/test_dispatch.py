@@ -0,0 +1,155 @@
+import time
+import asyncio
+import unittest
+
+from devoid_client import GeneratorClient
+from devoid_client.enums import *
+from devoid_client.dispatch import HandlerDispatcher
+from devoid_client.bench.server import MockGenerator
+from devoid_client.bench.payloads import AUTOMATIC1111_PAYLOAD
+
+async def coroutine_handler(response):
+    pass
+
+def plain_handler(response):
+    pass
+
+class RegisterHandlerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_invalid_handler_is_not_registered(self):
+        client = GeneratorClient('ws://127.0.0.1:9', 'test', 'token')
+        for handler, options in ((coroutine_handler, dict(mode='thread')), (plain_handler, dict(mode='bogus')),
+                                 (plain_handler, dict(timeout=0))):
+            with self.subTest(handler=handler.__name__, **options), self.assertRaises(ValueError):
+                client.register_req_done_handler(handler, **options)
+        self.assertEqual(client.gateway.req_done_handlers, [])
+        self.assertEqual(client.gateway.handler_dispatcher.modes, {})
+
+    async def test_handler_is_registered_with_mode_and_timeout(self):
+        client = GeneratorClient('ws://127.0.0.1:9', 'test', 'token')
+        client.register_req_error_handler(plain_handler, timeout=5, mode='process')
+        dispatcher = client.gateway.handler_dispatcher
+        self.assertEqual(client.gateway.req_error_handlers, [plain_handler])
+        self.assertEqual(dispatcher.modes[plain_handler], HandlerMode.PROCESS)
+        self.assertEqual(dispatcher.timeouts[plain_handler], 5)
+
+class HandlerDispatcherTest(unittest.IsolatedAsyncioTestCase):
+    async def test_drop_overflow(self):
+        dispatcher = HandlerDispatcher(workers=1, max_queue=2, overflow='drop')
+        release = asyncio.Event()
+        handled = []
+
+        async def handler(response):
+            await release.wait()
+            handled.append(response)
+
+        self.assertEqual([dispatcher.dispatch(handler, i) for i in range(5)], [True, True, False, False, False])
+        # the receiver never waits with DROP
+        await asyncio.wait_for(dispatcher.wait_capacity(), 1)
+        await asyncio.sleep(0)
+        # a call taken by a worker frees its place in the queue
+        self.assertTrue(dispatcher.dispatch(handler, 5))
+        self.assertEqual((dispatcher.dispatched, dispatcher.dropped), (3, 3))
+        release.set()
+        self.assertTrue(await dispatcher.close(1))
+        self.assertEqual(handled, [0, 1, 5])
+
+    async def test_block_overflow_waits_for_capacity(self):
+        dispatcher = HandlerDispatcher(workers=1, max_queue=1)
+        release = asyncio.Event()
+
+        async def handler(response):
+            await release.wait()
+
+        dispatcher.dispatch(handler, 0)
+        await asyncio.sleep(0)
+        dispatcher.dispatch(handler, 1)
+        waiting = asyncio.create_task(dispatcher.wait_capacity())
+        await asyncio.sleep(0.01)
+        self.assertFalse(waiting.done())
+        release.set()
+        await asyncio.wait_for(waiting, 1)
+        self.assertEqual(dispatcher.dropped, 0)
+        await dispatcher.close(1)
+
+    async def test_timeouts(self):
+        dispatcher = HandlerDispatcher(timeout=0.05)
+        finished = []
+
+        async def slow(response):
+            await asyncio.sleep(1)
+            finished.append(response)
+
+        async def patient(response):
+            await asyncio.sleep(0.1)
+            finished.append(response)
+
+        def blocking(response):
+            time.sleep(0.2)
+
+        async def failing(response):
+            raise RuntimeError('handler error')
+
+        dispatcher.set_timeout(patient, 0.5)
+        dispatcher.set_timeout(blocking, 0.05)
+        for handler in (slow, patient, blocking, failing):
+            dispatcher.set_mode(handler)
+            dispatcher.dispatch(handler, handler.__name__)
+        self.assertTrue(await dispatcher.drain(1))
+        # per-handler timeout overrides the default, thread calls are abandoned
+        self.assertEqual(finished, ['patient'])
+        self.assertEqual((dispatcher.timed_out, dispatcher.failed), (2, 1))
+        await dispatcher.close()
+
+    async def test_close_drains_queued_calls(self):
+        dispatcher = HandlerDispatcher(workers=2)
+        handled = []
+
+        async def handler(response):
+            await asyncio.sleep(0.01)
+            handled.append(response)
+
+        for i in range(10):
+            dispatcher.dispatch(handler, i)
+        self.assertTrue(await dispatcher.close(1))
+        self.assertEqual(sorted(handled), list(range(10)))
+        self.assertEqual(dispatcher.as_dict()["workers"], 0)
+
+    async def test_close_cancels_handlers_after_timeout(self):
+        dispatcher = HandlerDispatcher(workers=1)
+        cancelled = asyncio.Event()
+
+        async def stuck(response):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        dispatcher.dispatch(stuck, 0)
+        dispatcher.dispatch(stuck, 1)
+        started = time.monotonic()
+        self.assertFalse(await dispatcher.close(0.05))
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertTrue(cancelled.is_set())
+        self.assertEqual(len(dispatcher.workers), 0)
+
+    async def test_client_close_drains_done_handlers(self):
+        async with MockGenerator() as generator:
+            client = GeneratorClient(generator.endpoint, 'test', 'token')
+            handled = []
+
+            async def handler(response):
+                await asyncio.sleep(0.05)
+                handled.append(response.request_id)
+
+            client.register_req_done_handler(handler)
+            client.run(asyncio.get_running_loop())
+            handles = [await client.text2img(Executor.AUTOMATIC1111, False, False, False, f'user{i}', 1, 1,
+                                             AUTOMATIC1111_PAYLOAD, max_user_queue_size=1) for i in range(3)]
+            await asyncio.wait_for(asyncio.gather(*handles), 5)
+            self.assertEqual(handled, [])
+            await client.close(1)
+            self.assertEqual(sorted(handled), sorted(handle.request_id for handle in handles))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import asyncio
+import tempfile
+import unittest
+
+from devoid_client import GeneratorClient, ResultDownloader, DownloadError
+from devoid_client.enums import *
+from devoid_client.bench.server import MockGenerator, MockFileServer
+from devoid_client.bench.payloads import AUTOMATIC1111_PAYLOAD
+
+class DownloaderTest(unittest.TestCase):
+    def test_retryable_statuses_are_retried(self):
+        with MockFileServer(size=1000, fail_first=2) as files:
+            downloader = ResultDownloader(retries=3, backoff=0)
+            data, path = downloader.download(f'{files.url}/retried.png')
+            self.assertEqual(data, files.content('/retried.png'))
+            self.assertIsNone(path)
+            self.assertEqual(files.requests['/retried.png'], 3)
+            self.assertEqual(downloader.retried, 2)
+            downloader.session.close()
+
+    def test_retries_are_limited(self):
+        with MockFileServer(size=1000, fail_first=5) as files:
+            downloader = ResultDownloader(retries=1, backoff=0)
+            with self.assertRaises(DownloadError) as error:
+                downloader.download(f'{files.url}/failed.png')
+            self.assertEqual(error.exception.status, 503)
+            self.assertEqual(files.requests['/failed.png'], 2)
+            downloader.session.close()
+
+    def test_results_are_written_into_directory(self):
+        with MockFileServer(size=200_000) as files, tempfile.TemporaryDirectory() as directory:
+            downloader = ResultDownloader(directory=os.path.join(directory, 'gens'), chunk_size=4096)
+            data, path = downloader.download(f'{files.url}/object.png?sig=1', 'named.png')
+            self.assertIsNone(data)
+            self.assertEqual(path, os.path.join(directory, 'gens', 'named.png'))
+            with open(path, 'rb') as file:
+                self.assertEqual(file.read(), files.content('/object.png?sig=1'))
+            # nothing is left aside
+            self.assertEqual(os.listdir(os.path.join(directory, 'gens')), ['named.png'])
+            self.assertEqual(downloader.bytes, 200_000)
+            downloader.session.close()
+
+    def test_oversized_results_are_not_retried(self):
+        with MockFileServer(size=10_000) as files:
+            downloader = ResultDownloader(max_size=1000, backoff=0)
+            with self.assertRaises(DownloadError) as error:
+                downloader.download(f'{files.url}/large.png')
+            self.assertFalse(error.exception.retryable)
+            self.assertEqual(files.requests['/large.png'], 1)
+            downloader.session.close()
+
+    def test_concurrency_must_be_positive(self):
+        with self.assertRaises(ValueError):
+            ResultDownloader(concurrency=0)
+
+class ConcurrentDownloadTest(unittest.IsolatedAsyncioTestCase):
+    async def test_downloads_share_pooled_connections(self):
+        with MockFileServer(size=50_000) as files:
+            downloader = ResultDownloader(concurrency=4)
+            loop = asyncio.get_running_loop()
+            urls = [f'{files.url}/{i}.png' for i in range(40)]
+            results = await asyncio.gather(*(loop.run_in_executor(downloader.executor, downloader.download, url)
+                                             for url in urls))
+            await downloader.close()
+            for i, (data, _) in enumerate(results):
+                self.assertEqual(data, files.content(f'/{i}.png'))
+            # connections are kept alive and never exceed `concurrency`
+            self.assertLessEqual(files.connections, 4)
+            self.assertEqual(sum(files.requests.values()), 40)
+
+    async def test_results_are_fetched_before_delivery(self):
+        with MockFileServer(size=5000) as files, tempfile.TemporaryDirectory() as directory:
+            async with MockGenerator(result_url=files.url) as generator:
+                downloader = ResultDownloader(concurrency=4, directory=directory)
+                client = GeneratorClient(generator.endpoint, 'test', 'token', downloader=downloader)
+                client.run(asyncio.get_running_loop())
+                handles = [await client.text2img(Executor.AUTOMATIC1111, False, False, False, f'user{i}', 1, 1,
+                                                 AUTOMATIC1111_PAYLOAD, max_user_queue_size=1) for i in range(10)]
+                responses = await asyncio.wait_for(asyncio.gather(*handles), 10)
+                for response in responses:
+                    self.assertEqual(response.gen_status, GenStatus.OK)
+                    self.assertEqual(response.result.path, os.path.join(directory, f'{response.object_id}.png'))
+                    with open(response.result.path, 'rb') as file:
+                        self.assertEqual(file.read(), files.content(f'/{response.object_id}.png'))
+                self.assertEqual(downloader.fetched, 10)
+                await client.close()
+
+if __name__ == '__main__':
+    unittest.main()
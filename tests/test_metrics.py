@@ -0,0 +1,32 @@
+import asyncio
+import unittest
+
+from devoid_client import GeneratorClient
+from devoid_client.enums import *
+from devoid_client.bench.server import MockGenerator
+from devoid_client.bench.payloads import AUTOMATIC1111_PAYLOAD
+
+class LifecycleTest(unittest.IsolatedAsyncioTestCase):
+    async def test_request_is_sent_when_written(self):
+        async with MockGenerator() as generator:
+            client = GeneratorClient(generator.endpoint, 'test', 'token')
+            gateway = client.gateway
+            write = gateway.write
+
+            async def slow_write(batch):
+                # e.g. waiting behind other messages or a full socket
+                await asyncio.sleep(0.2)
+                await write(batch)
+
+            gateway.write = slow_write
+            client.run(asyncio.get_running_loop())
+            handle = await client.text2img(Executor.AUTOMATIC1111, False, False, False, 'user', 1, 1,
+                                           AUTOMATIC1111_PAYLOAD, max_user_queue_size=1)
+            self.assertEqual((await asyncio.wait_for(handle, 5)).gen_status, GenStatus.OK)
+            stages = client.lifecycle.as_dict()["stages"]
+            self.assertGreaterEqual(stages["client_queue"]["automatic1111/text2img"]["sum"], 0.2)
+            self.assertLess(stages["server_ack"]["automatic1111/text2img"]["sum"], 0.2)
+            await client.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,23 @@
+import pickle
+import unittest
+
+from devoid_client.enums import *
+from devoid_client.messages import GenerationResponse
+from devoid_client.bench.payloads import text2img_request, response_message
+
+class ResponsePickleTest(unittest.TestCase):
+    def test_downloaded_data_is_pickled(self):
+        response = GenerationResponse(response_message(text2img_request('user'), GenStatus.OK, 'https://x/1.png'), True)
+        response.result.data = b'image'
+        copy = pickle.loads(pickle.dumps(response))
+        self.assertEqual(copy.result.data, b'image')
+        self.assertEqual(copy.result.content, 'https://x/1.png')
+
+    def test_undecoded_result_is_pickled(self):
+        response = GenerationResponse(response_message(text2img_request('user'), GenStatus.OK, 'content'), True)
+        copy = pickle.loads(pickle.dumps(response))
+        self.assertIsNone(copy.result.data)
+        self.assertEqual(copy.user_id, 'user')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import asyncio
+import unittest
+
+from collections import Counter
+from websockets.exceptions import ConnectionClosed
+
+from devoid_client import GeneratorClient, ReconnectPolicy
+from devoid_client.enums import *
+from devoid_client.bench.server import MockGenerator
+from devoid_client.bench.payloads import AUTOMATIC1111_PAYLOAD
+
+class FailoverTest(unittest.IsolatedAsyncioTestCase):
+    async def test_every_request_is_answered_once_after_member_failure(self):
+        async with MockGenerator(generation_time=0.05) as generator:
+            client = GeneratorClient(generator.endpoint, 'test', 'token', connections=3,
+                                     reconnect_policy=ReconnectPolicy(first_delay=0.05, base_delay=0.05))
+            done = Counter()
+
+            async def count_done(response):
+                done[response.request_id] += 1
+
+            client.register_req_done_handler(count_done)
+            client.run(asyncio.get_running_loop())
+            while not all(member.connected for member in client.gateway.members):
+                await asyncio.sleep(0.01)
+
+            # writes of the failed member stall, e.g. on a full socket, until its connection is gone
+            failed = client.gateway.members[0]
+            stalled = asyncio.Event()
+            released = asyncio.Event()
+
+            async def stalled_write(batch):
+                stalled.set()
+                await released.wait()
+                del failed.write
+                raise ConnectionClosed(None, None)
+
+            failed.write = stalled_write
+            handles = [await client.text2img(Executor.AUTOMATIC1111, False, False, False, f'user-{i}', 1, i,
+                                             AUTOMATIC1111_PAYLOAD, max_user_queue_size=1) for i in range(60)]
+            await asyncio.wait_for(stalled.wait(), 5)
+            self.assertTrue(failed.outbound_keys)
+            await failed.websocket.close()
+            released.set()
+            responses = await asyncio.wait_for(asyncio.gather(*handles), 5)
+            self.assertTrue(all(response.gen_status == GenStatus.OK for response in responses))
+
+            # the failed member reconnects and writes what is left in its queue
+            while not failed.connected or failed.outbound or not failed.outbound_metrics.batches:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.2)
+            await client.drain_handlers(5)
+            request_ids = [handle.request_id for handle in handles]
+            self.assertEqual(Counter(request['service_info']['request_id'] for request in generator.received),
+                             Counter(request_ids))
+            self.assertEqual(done, Counter(request_ids))
+            await client.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,214 @@
+import time
+import asyncio
+import unittest
+
+from devoid_client.queue import GenerationQueue, QueueIsFullError, AdmissionTimeoutError
+from devoid_client.bench.fakes import NullGateway, response_for, response_to_message
+from devoid_client.bench.payloads import text2img_request
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+class AdmissionTest(unittest.IsolatedAsyncioTestCase):
+    async def test_fail(self):
+        queue = GenerationQueue(NullGateway(), max_pending=1, admission='fail')
+        await queue.put('first', text2img_request('first'), 1)
+        with self.assertRaises(QueueIsFullError):
+            await queue.put('second', text2img_request('second'), 1)
+
+    async def test_timeout(self):
+        queue = GenerationQueue(NullGateway(), max_pending=1, admission='timeout', admission_timeout=0.05)
+        await queue.put('first', text2img_request('first'), 1)
+        started = time.monotonic()
+        with self.assertRaises(AdmissionTimeoutError):
+            await queue.put('second', text2img_request('second'), 1)
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+
+    async def test_timeout_requires_admission_timeout(self):
+        with self.assertRaises(ValueError):
+            GenerationQueue(NullGateway(), max_pending=1, admission='timeout')
+
+    async def test_wait(self):
+        gateway = NullGateway(record=True)
+        queue = GenerationQueue(gateway, max_pending=1)
+        request = text2img_request('first')
+        await queue.put('first', request, 1)
+        waiting = asyncio.create_task(queue.put('second', text2img_request('second'), 1))
+        await settle()
+        self.assertFalse(waiting.done())
+        self.assertEqual(queue.utilization()["admission_waiters"], 1)
+        queue.response_listener(response_for(request))
+        self.assertTrue(await asyncio.wait_for(waiting, 1))
+        await settle()
+        self.assertEqual(gateway.sent, 2)
+
+    async def test_rejected_waiter_passes_its_slot_on(self):
+        queue = GenerationQueue(NullGateway(), max_pending=2)
+        await queue.put('full', text2img_request('full'), 1)
+        released = text2img_request('released')
+        await queue.put('released', released, 1)
+        rejected = asyncio.create_task(queue.put('full', text2img_request('full'), 1))
+        waiting = asyncio.create_task(queue.put('other', text2img_request('other'), 1))
+        await settle()
+        queue.response_listener(response_for(released))
+        with self.assertRaises(QueueIsFullError):
+            await rejected
+        self.assertTrue(await asyncio.wait_for(waiting, 1))
+
+class LimitsTest(unittest.IsolatedAsyncioTestCase):
+    async def test_max_in_flight(self):
+        gateway = NullGateway(record=True)
+        queue = GenerationQueue(gateway, max_in_flight=2)
+        for i in range(5):
+            await queue.put(f'user-{i}', text2img_request(f'user-{i}'), 1)
+        await settle()
+        self.assertEqual(gateway.sent, 2)
+        utilization = queue.utilization()
+        self.assertEqual((utilization["in_flight"], utilization["pending"], utilization["ready_users"]), (2, 5, 3))
+        self.assertEqual(utilization["in_flight_utilization"], 1.0)
+        queue.response_listener(response_to_message(gateway.messages.popleft()))
+        await settle()
+        self.assertEqual(gateway.sent, 3)
+        self.assertEqual(queue.utilization()["pending"], 4)
+
+    async def test_rate_limit(self):
+        gateway = NullGateway()
+        queue = GenerationQueue(gateway, rate_limit=20, rate_burst=1)
+        started = time.monotonic()
+        for i in range(3):
+            await queue.put(f'user-{i}', text2img_request(f'user-{i}'), 1)
+        await settle()
+        self.assertEqual(gateway.sent, 1)
+        while gateway.sent < 3:
+            await asyncio.sleep(0.005)
+        # two more tokens at 20 per second
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+class UserParallelismTest(unittest.IsolatedAsyncioTestCase):
+    def sent_ids(self, gateway: NullGateway):
+        return [message['service_info']['request_id'] for message in gateway.messages]
+
+    async def test_user_max_in_flight(self):
+        gateway = NullGateway(record=True)
+        queue = GenerationQueue(gateway, user_max_in_flight=3)
+        requests = [text2img_request('user') for _ in range(5)]
+        for request in requests:
+            await queue.put('user', request, 5)
+        await settle()
+        # sent in submission order, at most 3 at a time
+        self.assertEqual(self.sent_ids(gateway), [request.request_id for request in requests[:3]])
+        # an answer out of order frees a slot for the next request
+        queue.response_listener(response_for(requests[2]))
+        await settle()
+        self.assertEqual(self.sent_ids(gateway)[3:], [requests[3].request_id])
+        self.assertEqual(set(queue.users_bufs['user'].in_flight),
+                         {request.request_id for request in (requests[0], requests[1], requests[3])})
+        for request in requests[:2]:
+            queue.response_listener(response_for(request))
+        await settle()
+        self.assertEqual(gateway.sent, 5)
+        for request in requests[3:]:
+            queue.response_listener(response_for(request))
+        self.assertEqual(queue.users_bufs['user'].cur_size, 0)
+        self.assertEqual(queue.utilization()["pending"], 0)
+
+    async def test_default_is_one_request_per_user(self):
+        gateway = NullGateway(record=True)
+        queue = GenerationQueue(gateway)
+        first, second = text2img_request('user'), text2img_request('user')
+        await queue.put('user', first, 2)
+        await queue.put('user', second, 2)
+        await queue.put('other', text2img_request('other'), 1)
+        await settle()
+        self.assertEqual(gateway.sent, 2)
+        queue.response_listener(response_for(first))
+        await settle()
+        self.assertEqual(self.sent_ids(gateway)[-1], second.request_id)
+
+    async def test_per_user_override_and_function(self):
+        gateway = NullGateway(record=True)
+        limits = []
+
+        def user_max_in_flight(user_id, request):
+            limits.append((user_id, request.request_id))
+            return 2 if user_id.startswith('premium') else 1
+
+        queue = GenerationQueue(gateway, user_max_in_flight=user_max_in_flight)
+        for user_id, override in (('premium', None), ('basic', None), ('override', 4)):
+            for _ in range(4):
+                await queue.put(user_id, text2img_request(user_id), 4, override)
+        await settle()
+        sent = [message['service_info']['user_id'] for message in gateway.messages]
+        self.assertEqual({user_id: sent.count(user_id) for user_id in set(sent)},
+                         {'premium': 2, 'basic': 1, 'override': 4})
+        # the function is asked with the request to be sent next
+        queued = queue.users_bufs['basic'].queue[0]
+        self.assertIn(('basic', queued.request_id), limits)
+        self.assertNotIn('override', {user_id for user_id, _ in limits})
+
+class IdleEvictionTest(unittest.IsolatedAsyncioTestCase):
+    async def fill(self, queue: GenerationQueue, gateway: NullGateway, users: int):
+        '''Queue a request of `users` users and answer all of them'''
+        for i in range(users):
+            await queue.put(f'idle-{i}', text2img_request(f'idle-{i}'), 1)
+        while gateway.sent < users + 1:
+            await settle()
+        for message in list(gateway.messages):
+            if message['service_info']['user_id'].startswith('idle-'):
+                gateway.messages.remove(message)
+                queue.response_listener(response_to_message(message))
+
+    async def busy(self, queue: GenerationQueue):
+        # one request in flight and one queued behind it
+        for _ in range(2):
+            await queue.put('busy', text2img_request('busy'), 2, 1)
+
+    async def test_least_recently_used_are_evicted(self):
+        gateway = NullGateway(record=True)
+        queue = GenerationQueue(gateway, max_idle_buffers=1000)
+        await self.busy(queue)
+        await self.fill(queue, gateway, 5000)
+        self.assertEqual(len(queue.idle_bufs), 1000)
+        self.assertEqual(set(queue.users_bufs), {'busy'} | {f'idle-{i}' for i in range(4000, 5000)})
+        self.assertEqual(next(iter(queue.idle_bufs)), 'idle-4000')
+        self.assertEqual(queue.users_bufs['busy'].cur_size, 2)
+        # a returning user leaves the eviction order and goes to its end when answered
+        await queue.put('idle-4000', text2img_request('idle-4000'), 1)
+        self.assertNotIn('idle-4000', queue.idle_bufs)
+        await settle()
+        queue.response_listener(response_to_message(gateway.messages.pop()))
+        self.assertEqual(len(queue.idle_bufs), 1000)
+        await queue.put('new', text2img_request('new'), 1)
+        await settle()
+        queue.response_listener(response_to_message(gateway.messages.pop()))
+        self.assertIn('idle-4000', queue.users_bufs)
+        self.assertNotIn('idle-4001', queue.users_bufs)
+
+    async def test_expired_are_evicted(self):
+        gateway = NullGateway(record=True)
+        queue = GenerationQueue(gateway, idle_ttl=60)
+        await self.busy(queue)
+        await self.fill(queue, gateway, 3000)
+        self.assertEqual(len(queue.users_bufs), 3001)
+        for user_buf in queue.users_bufs.values():
+            if user_buf.idle_since is not None:
+                # went idle over a ttl ago
+                user_buf.idle_since -= 61
+        # expired buffers are evicted when the next buffer goes idle
+        await queue.put('last', text2img_request('last'), 1)
+        await settle()
+        queue.response_listener(response_to_message(gateway.messages.pop()))
+        self.assertEqual(set(queue.users_bufs), {'busy', 'last'})
+        self.assertEqual(list(queue.idle_bufs), ['last'])
+        # the busy user outlives the ttl and its requests are still answered
+        busy = queue.users_bufs['busy']
+        queue.response_listener(response_to_message(gateway.messages.popleft()))
+        await settle()
+        self.assertEqual((busy.cur_size, len(busy.in_flight)), (1, 1))
+        queue.response_listener(response_to_message(gateway.messages.popleft()))
+        self.assertEqual(busy.cur_size, 0)
+        self.assertIn('busy', queue.idle_bufs)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import asyncio
+import unittest
+
+from devoid_client import GeneratorClient, ReconnectPolicy
+from devoid_client.enums import *
+from devoid_client.bench.server import MockGenerator
+from devoid_client.bench.payloads import AUTOMATIC1111_PAYLOAD
+
+class ClosingGenerator(MockGenerator):
+    '''Closes the first `close_first` connections normally right after their first request, like a restart'''
+    def __init__(self, close_first: int = 1, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.close_first = close_first
+        self.connections = 0
+
+    async def handler(self, websocket, path: str = None):
+        self.connections += 1
+        if self.connections <= self.close_first:
+            await websocket.recv()
+            await websocket.close(1001)
+            return
+        await super().handler(websocket, path)
+
+class CleanCloseTest(unittest.IsolatedAsyncioTestCase):
+    async def test_in_flight_request_is_resent_after_clean_close(self):
+        async with ClosingGenerator() as generator:
+            client = GeneratorClient(generator.endpoint, 'test', 'token', resend_interval=0.01,
+                                     reconnect_policy=ReconnectPolicy(first_delay=0.01, base_delay=0.01))
+            client.run(asyncio.get_running_loop())
+            handle = await client.text2img(Executor.AUTOMATIC1111, False, False, False, 'user', 1, 1,
+                                           AUTOMATIC1111_PAYLOAD, max_user_queue_size=1)
+            response = await asyncio.wait_for(handle, 5)
+            self.assertEqual(response.gen_status, GenStatus.OK)
+            self.assertEqual(generator.connections, 2)
+            self.assertEqual(client.queue.utilization()["in_flight"], 0)
+            await client.close()
+
+    async def test_resend_deferred_by_resend_interval_is_not_stalled(self):
+        # the second reconnect comes before `resend_interval` after the first resend burst
+        async with ClosingGenerator(close_first=2) as generator:
+            client = GeneratorClient(generator.endpoint, 'test', 'token', resend_interval=0.3,
+                                     reconnect_policy=ReconnectPolicy(first_delay=0.01, base_delay=0.01))
+            client.run(asyncio.get_running_loop())
+            handle = await client.text2img(Executor.AUTOMATIC1111, False, False, False, 'user', 1, 1,
+                                           AUTOMATIC1111_PAYLOAD, max_user_queue_size=1)
+            response = await asyncio.wait_for(handle, 5)
+            self.assertEqual(response.gen_status, GenStatus.OK)
+            self.assertEqual(generator.connections, 3)
+            await client.close()
+
+class RejectedHandshakeTest(unittest.IsolatedAsyncioTestCase):
+    async def test_rejected_handshake_is_retried(self):
+        async def reject(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            await reader.readuntil(b'\r\n\r\n')
+            writer.write(b'HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\n\r\n')
+            await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(reject, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        client = GeneratorClient(f'ws://127.0.0.1:{port}', 'test', 'bad-token',
+                                 reconnect_policy=ReconnectPolicy(first_delay=0.01, base_delay=0.01, max_delay=0.01))
+        client.run(asyncio.get_running_loop())
+        with self.assertLogs(level='ERROR'):
+            await asyncio.sleep(0.2)
+        self.assertGreater(client.gateway.metrics.failed_attempts, 1)
+        await client.close()
+        server.close()
+
+class CloseTest(unittest.IsolatedAsyncioTestCase):
+    async def test_close_fails_unfinished_handles(self):
+        async with MockGenerator(respond=False) as generator:
+            client = GeneratorClient(generator.endpoint, 'test', 'token')
+            client.run(asyncio.get_running_loop())
+            handle = await client.text2img(Executor.AUTOMATIC1111, False, False, False, 'user', 1, 1,
+                                           AUTOMATIC1111_PAYLOAD, max_user_queue_size=1)
+            while not generator.received:
+                await asyncio.sleep(0.01)
+            await client.close()
+            with self.assertRaises(ConnectionError):
+                await handle
+            self.assertEqual(len(client.gateway.tracker), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,20 @@
+import os
+import tempfile
+import unittest
+
+from devoid_client.recording import TrafficRecorder, INBOUND, OUTBOUND, read_frames
+
+class TrafficRecorderTest(unittest.TestCase):
+    def test_frames_written_by_thread_keep_order(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'traffic.dvc.gz')
+            frames = [(INBOUND if i % 2 else OUTBOUND, f'frame {i}') for i in range(1000)]
+            with TrafficRecorder(path, buffer_size=256) as recorder:
+                for direction, data in frames:
+                    recorder.record(direction, data)
+                recorder.record(INBOUND, b'\x00binary')
+            read = [(frame.direction, frame.data) for frame in read_frames(path)]
+            self.assertEqual(read, frames + [(INBOUND, b'\x00binary')])
+
+if __name__ == '__main__':
+    unittest.main()
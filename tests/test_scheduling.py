@@ -0,0 +1,62 @@
+import unittest
+
+from collections import Counter
+
+from devoid_client import DeficitRoundRobinPolicy, PremiumLanePolicy
+from devoid_client.enums import *
+from devoid_client.queue import UserRequestBuffer
+from devoid_client.messages import GenerationRequest
+from devoid_client.bench.payloads import AUTOMATIC1111_PAYLOAD, make_service_info
+
+def request(user_id: str, premium: bool = False, width: int = 512, height: int = 512) -> GenerationRequest:
+    payload = dict(AUTOMATIC1111_PAYLOAD, steps=30, width=width, height=height, hr_scale=None)
+    return GenerationRequest(GenType.TEXT2IMG, Executor.AUTOMATIC1111, premium, False, True,
+                             make_service_info(user_id), payload)
+
+def serve(policy, users, sends: int) -> Counter:
+    '''Requests sent per user by the dispatcher of always backlogged `users`'''
+    for user_buf in users:
+        policy.push(user_buf)
+    sent = Counter()
+    for _ in range(sends):
+        user_buf = policy.pop()
+        sent[user_buf.id] += 1
+        user_buf.queue.append(user_buf.queue.popleft())
+        policy.push(user_buf)
+    return sent
+
+def backlogged(user_id: str, **options) -> UserRequestBuffer:
+    user_buf = UserRequestBuffer(user_id, 10, None)
+    user_buf.queue.extend(request(user_id, **options) for _ in range(3))
+    return user_buf
+
+class DeficitRoundRobinTest(unittest.TestCase):
+    def test_light_user_gets_share_of_generator_time(self):
+        # 1024x1024 costs 4 times 512x512
+        sent = serve(DeficitRoundRobinPolicy(), [backlogged('heavy', width=1024, height=1024), backlogged('light')], 500)
+        self.assertEqual(sent['light'], 4 * sent['heavy'])
+
+    def test_premium_weight(self):
+        sent = serve(DeficitRoundRobinPolicy(premium_weight=3), [backlogged('premium', premium=True),
+                                                                 backlogged('standard')], 400)
+        self.assertEqual(sent['premium'], 3 * sent['standard'])
+
+    def test_zero_cost_is_charged(self):
+        policy = DeficitRoundRobinPolicy(cost=lambda request: 0)
+        sent = serve(policy, [backlogged('first'), backlogged('second')], 100)
+        self.assertEqual(sent['first'], sent['second'])
+
+    def test_weights_must_be_positive(self):
+        with self.assertRaises(ValueError):
+            DeficitRoundRobinPolicy(premium_weight=0)
+        with self.assertRaises(ValueError):
+            DeficitRoundRobinPolicy(executor_weights={Executor.KANDINSKY: 0})
+
+class PremiumLaneTest(unittest.TestCase):
+    def test_standard_request_after_premium_streak(self):
+        sent = serve(PremiumLanePolicy(premium_streak=4), [backlogged('premium', premium=True),
+                                                           backlogged('standard')], 500)
+        self.assertEqual(sent['premium'], 4 * sent['standard'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+from devoid_client.cache import request_key
+from devoid_client.enums import *
+from devoid_client.messages import GenerationRequest, RequestTemplate
+from devoid_client.bench.payloads import AUTOMATIC1111_PAYLOAD, KANDINSKY_PAYLOAD, make_service_info
+
+class TemplateRequestTest(unittest.TestCase):
+    def expanded(self, executor: Executor, payload: dict, service_info) -> GenerationRequest:
+        return GenerationRequest(GenType.TEXT2IMG, executor, False, False, True, service_info, payload)
+
+    def test_payload_dict(self):
+        template = RequestTemplate(GenType.TEXT2IMG, Executor.AUTOMATIC1111, False, False, True,
+                                   AUTOMATIC1111_PAYLOAD)
+        base_payload = dict(template.base_payload)
+        request = template.request(make_service_info('user'), prompt='a red fox', seed=7)
+        payload = request.payload_dict()
+        self.assertEqual((payload['prompt'], payload['seed']), ('a red fox', 7))
+        self.assertEqual(payload, dict(base_payload, prompt='a red fox', seed=7))
+        # the template is shared and never changed by its requests
+        payload['prompt'] = 'changed'
+        self.assertEqual(template.base_payload, base_payload)
+        self.assertEqual(request.payload_dict()['prompt'], 'a red fox')
+        self.assertEqual(request.payload.prompt, 'a red fox')
+
+    def test_same_message_and_cache_key_as_expanded_request(self):
+        for executor, payload in ((Executor.AUTOMATIC1111, dict(AUTOMATIC1111_PAYLOAD, seed=7)),
+                                  (Executor.KANDINSKY, KANDINSKY_PAYLOAD)):
+            with self.subTest(executor=executor.value):
+                template = RequestTemplate(GenType.TEXT2IMG, executor, False, False, True, payload)
+                service_info = make_service_info('user')
+                request = template.request(service_info, prompt='a red fox')
+                expanded = self.expanded(executor, dict(payload, prompt='a red fox'), service_info)
+                self.assertEqual(request.as_dict(), expanded.as_dict())
+                # service info is not part of the key
+                other = template.request(make_service_info('other'), prompt='a red fox')
+                self.assertEqual(request_key(request), request_key(expanded))
+                self.assertEqual(request_key(other), request_key(expanded))
+                self.assertNotEqual(request_key(template.request(service_info, prompt='a blue fox')),
+                                    request_key(expanded))
+
+    def test_missing_seed_is_random_per_request(self):
+        payload = dict(AUTOMATIC1111_PAYLOAD)
+        payload.pop('seed', None)
+        template = RequestTemplate(GenType.TEXT2IMG, Executor.AUTOMATIC1111, False, False, True, payload)
+        requests = [template.request(make_service_info('user'), prompt='a red fox') for _ in range(3)]
+        self.assertTrue(all(request.random_seed for request in requests))
+        self.assertEqual(len({request.payload_dict()['seed'] for request in requests}), 3)
+        self.assertIsNone(template.base_payload['seed'])
+        fixed = template.request(make_service_info('user'), prompt='a red fox', seed=7)
+        self.assertFalse(fixed.random_seed)
+
+    def test_unknown_fields_are_rejected(self):
+        template = RequestTemplate(GenType.TEXT2IMG, Executor.KANDINSKY, False, False, True, KANDINSKY_PAYLOAD)
+        with self.assertRaises(ValueError):
+            template.request(make_service_info('user'), prompt='a red fox', seed=7)
+
+if __name__ == '__main__':
+    unittest.main()
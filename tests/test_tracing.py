@@ -0,0 +1,108 @@
+import asyncio
+import unittest
+
+from devoid_client import GeneratorClient
+from devoid_client.enums import *
+from devoid_client.tracing import *
+from devoid_client.tracing import otel_trace
+from devoid_client.bench.server import MockGenerator
+from devoid_client.bench.payloads import AUTOMATIC1111_PAYLOAD
+
+class RecordingTracer(Tracer):
+    def __init__(self) -> None:
+        self.records = []
+
+    def record(self, stage, start, end, attributes=None):
+        self.records.append((stage, start, end, attributes))
+
+    def stages(self, stage: str):
+        return [record for record in self.records if record[0] == stage]
+
+async def done_handler(response):
+    pass
+
+class ClientTracingTest(unittest.IsolatedAsyncioTestCase):
+    async def submit(self, client: GeneratorClient, user_id: str):
+        handle = await client.text2img(Executor.AUTOMATIC1111, False, False, False, user_id, 1, 1,
+                                       AUTOMATIC1111_PAYLOAD, max_user_queue_size=1)
+        return await asyncio.wait_for(handle, 5)
+
+    async def test_hot_path_stages_are_recorded(self):
+        async with MockGenerator() as generator:
+            tracer = RecordingTracer()
+            client = GeneratorClient(generator.endpoint, 'test', 'token', connections=2, tracer=tracer)
+            client.register_req_done_handler(done_handler)
+            client.run(asyncio.get_running_loop())
+            await asyncio.gather(*(self.submit(client, f'user{i}') for i in range(4)))
+            await client.drain_handlers(1)
+            self.assertEqual({record[0] for record in tracer.records},
+                             {REQUEST_AS_DICT, JSON_ENCODE, WEBSOCKET_SEND, JSON_DECODE,
+                              RESPONSE_BUILD, RESPONSE_DISPATCH, HANDLER_RUN})
+            for stage, start, end, _ in tracer.records:
+                self.assertLessEqual(start, end, stage)
+            self.assertEqual(sum(record[3]["requests"] for record in tracer.stages(REQUEST_AS_DICT)), 4)
+            self.assertEqual(len(tracer.stages(JSON_ENCODE)), 4)
+            self.assertTrue(all(record[3]["bytes"] > 0 for record in tracer.stages(JSON_ENCODE)))
+            self.assertEqual(sum(record[3]["messages"] for record in tracer.stages(WEBSOCKET_SEND)), 4)
+            statuses = [record[3]["gen_status"] for record in tracer.stages(RESPONSE_DISPATCH)]
+            self.assertEqual(statuses.count(GenStatus.OK.value), 4)
+            self.assertEqual(len(tracer.stages(JSON_DECODE)), len(statuses))
+            self.assertEqual([record[3] for record in tracer.stages(HANDLER_RUN)],
+                             [{"handler": 'done_handler', "mode": HandlerMode.INLINE.value}] * 4)
+            # switched off at runtime on every pool member
+            client.set_tracer(None)
+            recorded = len(tracer.records)
+            await self.submit(client, 'untraced')
+            await client.drain_handlers(1)
+            self.assertEqual(len(tracer.records), recorded)
+            await client.close()
+
+class StageTimerTest(unittest.TestCase):
+    def test_histograms_and_stalls(self):
+        timer = StageTimer(stall_after=0.05)
+        for duration in (0.00002, 0.0003, 0.002):
+            timer.record(JSON_ENCODE, 1.0, 1.0 + duration)
+        with self.assertLogs(level='WARNING'):
+            timer.record(HANDLER_RUN, 1.0, 1.2, {"handler": 'slow'})
+        self.assertEqual(timer.stalls, 1)
+        self.assertEqual(timer.histograms[JSON_ENCODE].count, 3)
+        self.assertEqual(set(timer.as_dict()["stages"]), {JSON_ENCODE, HANDLER_RUN})
+
+class FakeSpan():
+    def __init__(self, name, start_time, attributes) -> None:
+        self.name = name
+        self.start_time = start_time
+        self.attributes = attributes
+        self.end_time = None
+
+    def end(self, end_time=None):
+        self.end_time = end_time
+
+class FakeOpenTelemetryTracer():
+    def __init__(self) -> None:
+        self.spans = []
+
+    def start_span(self, name, start_time=None, attributes=None):
+        span = FakeSpan(name, start_time, attributes)
+        self.spans.append(span)
+        return span
+
+class OpenTelemetryTracerTest(unittest.TestCase):
+    @unittest.skipIf(otel_trace is None, 'opentelemetry-api is not installed')
+    def test_stages_are_emitted_as_spans(self):
+        spans = FakeOpenTelemetryTracer()
+        tracer = OpenTelemetryTracer(spans, min_duration=0.001)
+        tracer.record(JSON_ENCODE, 10.0, 10.0001)
+        tracer.record(WEBSOCKET_SEND, 10.0, 10.25, {"messages": 3})
+        self.assertEqual([span.name for span in spans.spans], [WEBSOCKET_SEND])
+        span = spans.spans[0]
+        self.assertEqual(span.attributes, {"messages": 3})
+        self.assertAlmostEqual((span.end_time - span.start_time) / 1e9, 0.25, places=6)
+
+    @unittest.skipIf(otel_trace is not None, 'opentelemetry-api is installed')
+    def test_requires_opentelemetry(self):
+        with self.assertRaises(ImportError):
+            OpenTelemetryTracer(FakeOpenTelemetryTracer())
+
+if __name__ == '__main__':
+    unittest.main()
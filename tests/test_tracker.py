@@ -0,0 +1,99 @@
+import asyncio
+import unittest
+
+from devoid_client import GeneratorClient
+from devoid_client.enums import *
+from devoid_client.tracker import RequestTracker
+from devoid_client.bench.server import MockGenerator
+from devoid_client.bench.fakes import response_for
+from devoid_client.bench.payloads import text2img_request, AUTOMATIC1111_PAYLOAD
+
+class RequestHandleTest(unittest.IsolatedAsyncioTestCase):
+    async def test_wait_for_intermediate_statuses(self):
+        tracker = RequestTracker()
+        request = text2img_request('user')
+        handle = tracker.track(request)
+        queued = asyncio.create_task(handle.wait_for(GenStatus.QUEUED))
+        generating = asyncio.create_task(handle.wait_for(GenStatus.GENERATING))
+        await asyncio.sleep(0)
+        tracker.on_response(response_for(request, GenStatus.QUEUED))
+        self.assertEqual((await queued).gen_status, GenStatus.QUEUED)
+        self.assertFalse(generating.done())
+        self.assertEqual(handle.status, GenStatus.QUEUED)
+        tracker.on_response(response_for(request, GenStatus.GENERATING))
+        self.assertEqual((await generating).gen_status, GenStatus.GENERATING)
+        # reached statuses are returned without waiting
+        self.assertEqual((await handle.wait_for(GenStatus.QUEUED)).gen_status, GenStatus.QUEUED)
+        tracker.on_response(response_for(request))
+        self.assertEqual((await handle).gen_status, GenStatus.OK)
+        self.assertEqual((await handle.wait_for(GenStatus.OK)).gen_status, GenStatus.OK)
+        self.assertEqual(len(tracker), 0)
+
+    async def test_skipped_status_returns_terminal_response(self):
+        tracker = RequestTracker()
+        request = text2img_request('user')
+        handle = tracker.track(request)
+        generating = asyncio.create_task(handle.wait_for(GenStatus.GENERATING))
+        await asyncio.sleep(0)
+        tracker.on_response(response_for(request, GenStatus.ERROR))
+        self.assertEqual((await generating).gen_status, GenStatus.ERROR)
+        self.assertEqual((await handle.wait_for(GenStatus.QUEUED)).gen_status, GenStatus.ERROR)
+
+    async def test_failure_reaches_every_waiter(self):
+        tracker = RequestTracker()
+        request = text2img_request('user')
+        handle = tracker.track(request)
+        queued = asyncio.create_task(handle.wait_for(GenStatus.QUEUED))
+        await asyncio.sleep(0)
+        tracker.fail(request.request_id, ConnectionError('closed'))
+        with self.assertRaises(ConnectionError):
+            await queued
+        with self.assertRaises(ConnectionError):
+            await handle
+        self.assertEqual(len(tracker), 0)
+
+    async def test_timed_out_wait_leaves_handle_pending(self):
+        tracker = RequestTracker()
+        request = text2img_request('user')
+        handle = tracker.track(request)
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(handle, 0.01)
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(handle.wait_for(GenStatus.QUEUED), 0.01)
+        tracker.on_response(response_for(request))
+        self.assertEqual((await handle).gen_status, GenStatus.OK)
+
+    async def test_responses_are_routed_by_request_id(self):
+        tracker = RequestTracker()
+        # requests of the same user only differ by request_id
+        requests = [text2img_request('user') for _ in range(3)]
+        handles = [tracker.track(request) for request in requests]
+        tracker.on_response(response_for(text2img_request('user')))
+        for request, status in zip(reversed(requests), (GenStatus.OK, GenStatus.ERROR, GenStatus.OK)):
+            tracker.on_response(response_for(request, status))
+        for handle, status in zip(handles, (GenStatus.OK, GenStatus.ERROR, GenStatus.OK)):
+            response = await handle
+            self.assertEqual(response.request_id, handle.request_id)
+            self.assertEqual(response.gen_status, status)
+        self.assertEqual(len(tracker), 0)
+
+class ClientRoutingTest(unittest.IsolatedAsyncioTestCase):
+    async def test_parallel_requests_of_one_user(self):
+        async with MockGenerator(queue_time=0.01, generation_time='exp:0.02', seed=1) as generator:
+            client = GeneratorClient(generator.endpoint, 'test', 'token', user_max_in_flight=4)
+            client.run(asyncio.get_running_loop())
+            handles = [await client.text2img(Executor.AUTOMATIC1111, False, False, False, 'user', 1, i,
+                                             AUTOMATIC1111_PAYLOAD, max_user_queue_size=8) for i in range(8)]
+            generating = await asyncio.wait_for(handles[0].wait_for(GenStatus.GENERATING), 5)
+            self.assertEqual(generating.request_id, handles[0].request_id)
+            responses = await asyncio.wait_for(asyncio.gather(*handles), 10)
+            for handle, response in zip(handles, responses):
+                self.assertEqual(response.gen_status, GenStatus.OK)
+                self.assertEqual(response.request_id, handle.request_id)
+                self.assertEqual(handle.responses[GenStatus.QUEUED].request_id, handle.request_id)
+            self.assertEqual(len({response.object_id for response in responses}), 8)
+            self.assertEqual(len(client.gateway.tracker), 0)
+            await client.close()
+
+if __name__ == '__main__':
+    unittest.main()
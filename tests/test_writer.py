@@ -0,0 +1,38 @@
+import io
+import asyncio
+import tempfile
+import unittest
+
+from devoid_client import GeneratorClient, ImageSource
+from devoid_client.enums import *
+from devoid_client.bench.server import MockGenerator
+from devoid_client.bench.payloads import AUTOMATIC1111_PAYLOAD
+
+class UnreadableFile(io.FileIO):
+    def read(self, size: int = -1) -> bytes:
+        raise OSError('read failed')
+
+class WriteErrorTest(unittest.IsolatedAsyncioTestCase):
+    async def test_write_error_fails_handle_and_frees_slot(self):
+        async with MockGenerator() as generator:
+            client = GeneratorClient(generator.endpoint, 'test', 'token')
+            client.run(asyncio.get_running_loop())
+            while not client.gateway.connected:
+                await asyncio.sleep(0.01)
+            with tempfile.NamedTemporaryFile() as image, UnreadableFile(image.name) as file:
+                image.write(b'image')
+                image.flush()
+                payload = dict(AUTOMATIC1111_PAYLOAD, init_images=[ImageSource.from_file(file)])
+                handle = await client.img2img(Executor.AUTOMATIC1111, False, False, False, 'user', 1, 1,
+                                              payload, max_user_queue_size=1)
+                with self.assertLogs(level='ERROR'), self.assertRaises(OSError):
+                    await asyncio.wait_for(handle, 5)
+            self.assertEqual(client.queue.utilization()["in_flight"], 0)
+            # the user's slot is free again
+            handle = await client.text2img(Executor.AUTOMATIC1111, False, False, False, 'user', 1, 2,
+                                           AUTOMATIC1111_PAYLOAD, max_user_queue_size=1)
+            self.assertEqual((await asyncio.wait_for(handle, 5)).gen_status, GenStatus.OK)
+            await client.close()
+
+if __name__ == '__main__':
+    unittest.main()